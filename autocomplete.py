@@ -0,0 +1,123 @@
+import re
+from bisect import bisect_left, insort
+import carddb
+
+
+# Suggestions for slash command arguments naming a player or a deck. Names are kept in
+# sorted lists of normalized keys, one per word a name could be typed from, so a prefix is
+# a binary search plus a short scan no matter how many decks there are. Discord shows at
+# most LIMIT suggestions and wants them within 3 seconds.
+
+LIMIT = 25
+WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lower case, accent free, starting at the first letter or digit"""
+    text = ' '.join(text.lower().split()) if text.isascii() else carddb.normalize_name(text)
+    match = WORD.search(text)
+    return text[match.start():] if match else ''
+
+
+class PrefixIndex:
+    """Names found by the start of their full name or of any word in them"""
+
+    def __init__(self, names=()):
+        self.names = set()
+        self.ordered = []       # names in alphabetical order
+        self.starts = []        # sorted (normalized name, name)
+        self.words = []         # sorted (normalized name from the n-th word on, name)
+        self.add(names)
+
+    def add(self, names):
+        """Index new names, a few are inserted in place, many are appended and sorted"""
+        new = [name for name in dict.fromkeys(names) if name not in self.names]
+        self.names.update(new)
+        starts, words = [], []
+        for name in new:
+            key = normalize(name)
+            starts.append((key, name))
+            words += [(key[match.start():], name) for match in list(WORD.finditer(key))[1:]]
+        for keys, added in ((self.ordered, new), (self.starts, starts), (self.words, words)):
+            if len(added) > 32:
+                keys += added
+                keys.sort()
+            else:
+                for item in added:
+                    insort(keys, item)
+
+    def _scan(self, keys, prefix, found, limit):
+        i = bisect_left(keys, (prefix,))
+        while i < len(keys) and len(found) < limit and keys[i][0].startswith(prefix):
+            found.setdefault(keys[i][1])
+            i += 1
+
+    def search(self, text, limit=LIMIT):
+        """Names starting with text, then names with a word starting with text"""
+        prefix = normalize(text)
+        if not prefix:
+            return self.ordered[:limit]
+        found = {}
+        self._scan(self.starts, prefix, found, limit)
+        self._scan(self.words, prefix, found, limit)
+        return list(found)
+
+    def find(self, text):
+        """Name that is text, ignoring case and accents, or the only suggestion for it"""
+        if text in self.names:
+            return text
+        matches = self.search(text, 2)
+        exact = [name for name in matches if normalize(name) == normalize(text)]
+        if exact or len(matches) == 1:
+            return (exact or matches)[0]
+        return None
+
+
+class DeckIndex:
+    """Prefix indexes of deck owners and decks ('Commander (owner)'), kept up to date by
+    adding only the decks that are new since the last update"""
+
+    def __init__(self):
+        self.players = PrefixIndex()
+        self.decks = PrefixIndex()
+        self.count = 0
+        self.last_id = None
+
+    def update(self, decks):
+        """Add decks the index hasn't seen. Decks only ever get appended, anything else
+        (like a restored database) rebuilds the index"""
+        if len(decks) < self.count or (self.count and decks[self.count - 1].id != self.last_id):
+            self.__init__()
+        new = decks[self.count:]
+        self.players.add(deck.owner for deck in new)
+        self.decks.add(str(deck) for deck in new)
+        if decks:
+            self.count, self.last_id = len(decks), decks[-1].id
+        return self
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    import deckstats
+    print('***Testing***')
+    rng = random.Random(0)
+    words = 'Atraxa Praetors Voice Krenko Mob Boss Yuriko Tiger Shadow Edgar Markov Ur Dragon Kinnan Éowyn'.split()
+    decks = [deckstats.Deck(f'player{rng.randrange(1000)}', f'{rng.choice(words)} {rng.choice(words)} {i}', id=i + 1)
+             for i in range(20000)]
+
+    index = DeckIndex()
+    start = time.perf_counter()
+    index.update(decks[:19900])
+    print(f'Indexed {index.count} decks in {time.perf_counter() - start:.2f}s')
+    start = time.perf_counter()
+    index.update(decks)
+    print(f'Added 100 decks in {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    start = time.perf_counter()
+    for query in ['', 'a', 'at', 'eowyn', 'Ur Dr', 'player12', 'zzz'] * 100:
+        index.decks.search(query)
+        index.players.search(query)
+    print(f'{(time.perf_counter() - start) * 1e6 / 1400:.1f} us per search')
+    print(index.decks.search('eowyn')[:3], index.players.search('player99')[:3])
+    print(index.decks.find(str(decks[5]).upper()), index.players.find('PLAYER999'))
@@ -0,0 +1,100 @@
+import argparse
+import itertools
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+import deckstats
+
+
+# Replays the recorded games in order under different rating parameters and scores how
+# well the ratings going into each game predicted its winner. The win probability of a
+# seat is its multi_ev, which sums to 1 over the pod.
+
+_sequence = None
+
+
+def load_sequence():
+    """Games as (deck indexes, winner seat) plus every deck's starting rating"""
+    _, decks, games = deckstats.load_game_database()
+    deck_indx = {id(deck): indx for indx, deck in enumerate(decks)}
+    sequence = [(tuple(deck_indx[id(deck)] for deck in game.decks), game.decks.index(game.winner))
+                for game in games]
+    return sequence, [deck.rating for deck in decks]
+
+
+def init_worker(sequence):
+    # each worker gets the parsed games once instead of with every task
+    global _sequence
+    _sequence = sequence
+
+
+def score(params, sequence=None, warmup=0):
+    """Replay the games with (k_factor, d_factor), returns log loss, brier score and accuracy"""
+    k_factor, d_factor = params
+    games, start_ratings = sequence or _sequence
+    ratings = list(start_ratings)
+
+    log_loss = brier = correct = scored = 0
+    for indx, (pod, winner) in enumerate(games):
+        pod_ratings = [ratings[i] for i in pod]
+        if indx >= warmup:
+            probs = [deckstats.multi_ev(d_factor, pod_ratings, seat) for seat in range(len(pod))]
+            log_loss -= math.log(max(probs[winner], 1e-15))
+            brier += sum((p - (seat == winner)) ** 2 for seat, p in enumerate(probs))
+            correct += max(range(len(pod)), key=probs.__getitem__) == winner
+            scored += 1
+        for i, rating in zip(pod, deckstats.elo(k_factor, d_factor, pod_ratings, winner)):
+            ratings[i] = rating
+
+    scored = max(scored, 1)
+    return {'k_factor': k_factor, 'd_factor': d_factor, 'log_loss': log_loss / scored,
+            'brier': brier / scored, 'accuracy': correct / scored}
+
+
+def grid(k_factors, d_factors):
+    return list(itertools.product(k_factors, d_factors))
+
+
+def random_search(samples, k_range=(10, 300), d_range=(50, 800), seed=0):
+    rng = random.Random(seed)
+    return [(round(rng.uniform(*k_range)), round(rng.uniform(*d_range))) for _ in range(samples)]
+
+
+def sweep(candidates, sequence=None, processes=None):
+    """Score every (k_factor, d_factor) across a process pool, best (lowest log loss) first"""
+    sequence = sequence or load_sequence()
+    with Pool(processes or os.cpu_count(), initializer=init_worker, initargs=(sequence,)) as pool:
+        results = pool.map(score, candidates, chunksize=max(1, len(candidates) // (4 * (processes or os.cpu_count()))))
+    return sorted(results, key=lambda x: (x['log_loss'], x['brier']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest elo parameters against the recorded games')
+    parser.add_argument('--random', type=int, help='number of random samples instead of the grid')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
+
+    if args.random:
+        candidates = random_search(args.random)
+    else:
+        candidates = grid(range(25, 301, 25), range(100, 801, 50))
+    candidates.append((deckstats.K_FACTOR, deckstats.D_FACTOR))
+
+    start = time.perf_counter()
+    sequence = load_sequence()
+    results = sweep(candidates, sequence, args.processes)
+    print(f'{len(candidates)} parameter sets over {len(sequence[0])} games in {time.perf_counter() - start:.1f}s')
+
+    print('rank  k_factor  d_factor  log_loss  brier   accuracy')
+    for rank, result in enumerate(results[:args.top]):
+        print(f"{rank + 1:4}  {result['k_factor']:8}  {result['d_factor']:8}  {result['log_loss']:.4f}    "
+              f"{result['brier']:.4f}  {result['accuracy']:.3f}")
+
+    current = next(rank for rank, x in enumerate(results)
+                   if (x['k_factor'], x['d_factor']) == (deckstats.K_FACTOR, deckstats.D_FACTOR))
+    best = results[0]
+    print(f"Best: k_factor={best['k_factor']} d_factor={best['d_factor']} "
+          f"(current k_factor={deckstats.K_FACTOR} d_factor={deckstats.D_FACTOR} ranks {current + 1})")
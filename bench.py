@@ -0,0 +1,265 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Benchmarks of the data handling code against synthetic players, decks, games, cards
+# and decklists written to a scratch directory. The database, card store and rating
+# state are pointed at that directory, nothing in the repo is touched and no network
+# or discord connection is needed. Results are written as json so runs on different
+# commits can be compared with --compare.
+
+PRESETS = {'small': {'players': 100, 'decks': 1000, 'games': 20000, 'decklists': 200, 'cards': 5000},
+           'medium': {'players': 300, 'decks': 5000, 'games': 200000, 'decklists': 1000, 'cards': 20000},
+           'large': {'players': 1000, 'decks': 20000, 'games': 1000000, 'decklists': 5000, 'cards': 30000}}
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'bench_results')
+
+WORDS = ('Dark Elvish Arcane Sol Grim Storm Ancient Feral Silent Ember Frost Iron Golden Shadow Sky '
+         'Dragon Knight Mage Beast Oracle Titan Serpent Angel Demon Sphinx Wurm Goblin Sliver Hydra').split()
+TYPES = ('Creature — Elf Druid', 'Creature — Human Wizard', 'Instant', 'Sorcery', 'Artifact',
+         'Enchantment', 'Legendary Creature — Dragon', 'Land', 'Planeswalker — Jace')
+BASICS = ('Plains', 'Island', 'Swamp', 'Mountain', 'Forest')
+
+
+# ---------- synthetic data ---------------
+
+def generate_players(count, rng):
+    return [{'name': f'player{i}', 'rating': 1500, 'gold': 300, 'wins': 0, 'losses': 0} for i in range(count)]
+
+
+def generate_decks(count, players, rng):
+    return [{'owner': rng.choice(players)['name'], 'commander': f'{rng.choice(WORDS)} {rng.choice(WORDS)} {i}',
+             'decklist': f'https://www.moxfield.com/decks/bench{i}', 'rating': 1500, 'wins': 0, 'losses': 0}
+            for i in range(count)]
+
+
+def generate_games(count, decks, rng):
+    """4 distinct decks per game, a few games a day in date order"""
+    keys = [f"{deck['commander']} ({deck['owner']})" for deck in decks]
+    games = []
+    for i in range(count):
+        pod = rng.sample(keys, 4)
+        day = i // 20
+        date = f'{2023 + day // 336}-{day // 28 % 12 + 1:02}-{day % 28 + 1:02}'
+        games.append({'date': date, 'winner': rng.choice(pod), 'decks': pod})
+    return games
+
+
+def generate_cards(count, rng):
+    """Cards with the scryfall fields deckstats and the card store use, basic lands first"""
+    cards = [{'name': name, 'cmc': 0.0, 'mana_cost': '', 'type_line': f'Basic Land — {name}',
+              'edhrec_rank': i + 1, 'colors': [], 'color_identity': [], 'oracle_text': '',
+              'prices': {'usd': '0.10', 'usd_foil': None, 'usd_etched': None}}
+             for i, name in enumerate(BASICS)]
+    for i in range(len(cards), count):
+        colors = rng.sample('WUBRG', rng.choice([0, 1, 1, 2, 2, 3]))
+        cmc = rng.randint(0, 8)
+        pips = ''.join('{' + c + '}' for c in colors)
+        generic = max(cmc - len(colors), 0)
+        cards.append({'name': f'{rng.choice(WORDS)} {rng.choice(WORDS)} {i}',
+                      'cmc': float(cmc),
+                      'mana_cost': (f'{{{generic}}}' if generic else '') + pips if cmc else '',
+                      'type_line': rng.choice(TYPES),
+                      'edhrec_rank': rng.randint(1, 30000) if rng.random() < 0.9 else None,
+                      'colors': colors,
+                      'color_identity': colors,
+                      'oracle_text': ' '.join(rng.choice(WORDS).lower() for _ in range(rng.randint(5, 25))),
+                      'prices': {'usd': f'{rng.random() * 10:.2f}', 'usd_foil': None, 'usd_etched': None}})
+        if cards[-1]['edhrec_rank'] is None:
+            del cards[-1]['edhrec_rank']
+    return cards
+
+
+def write_decklists(directory, count, cards, rng):
+    """Moxfield text exports: a commander, ~60 singletons, basic lands and sometimes a sideboard"""
+    os.makedirs(directory, exist_ok=True)
+    spells = [card['name'] for card in cards if not card['type_line'].startswith('Basic Land')]
+    for i in range(count):
+        names = rng.sample(spells, 64)
+        lines = [f'1 {name}' for name in names]
+        lines += [f'{rng.randint(5, 12)} {basic}' for basic in rng.sample(BASICS, rng.randint(1, 4))]
+        if rng.random() < 0.3:
+            lines += ['', 'SIDEBOARD:'] + [f'1 {name}' for name in rng.sample(spells, 5)]
+        with open(os.path.join(directory, f'deck{i}.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def write_dataset(directory, scale, seed=0):
+    """Write players.json, decks.json, games.json, scryfall_data.json and a decklists folder"""
+    rng = random.Random(seed)
+    players = generate_players(scale['players'], rng)
+    decks = generate_decks(scale['decks'], players, rng)
+    cards = generate_cards(scale['cards'], rng)
+    data = {'players.json': players,
+            'decks.json': decks,
+            'games.json': generate_games(scale['games'], decks, rng),
+            'scryfall_data.json': cards}
+    for file_name, rows in data.items():
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as f:
+            json.dump(rows, f)
+    write_decklists(os.path.join(directory, 'decklists'), scale['decklists'], cards, rng)
+
+
+def use_directory(directory):
+    """Point the database, rating state and card store at directory"""
+    import carddb
+    import storage
+    storage.DB_PATH = os.path.join(directory, 'hall_of_records.db')
+    carddb.DATA_DIR = directory
+
+
+# ---------- timing ---------------
+
+def timed(func, repeat=1):
+    """Run func repeat times, returns (last result, {'seconds': best, 'mean_s': mean})"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, {'seconds': round(min(times), 4), 'mean_s': round(sum(times) / len(times), 4)}
+
+
+def per_call(func, calls):
+    """Time calls separate calls of func(i), returns totals and per call latency"""
+    times = []
+    for i in range(calls):
+        start = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {'seconds': round(sum(times), 4), 'calls': calls,
+            'mean_ms': round(1000 * sum(times) / calls, 3),
+            'p50_ms': round(1000 * times[calls // 2], 3),
+            'p99_ms': round(1000 * times[min(int(calls * 0.99), calls - 1)], 3)}
+
+
+def run(directory, repeat=3, calls=200, seed=0):
+    """Run every benchmark against the dataset in directory, returns {name: timings}"""
+    use_directory(directory)
+    import cardmatrix
+    import carddb
+    import deckstats
+    import ratings
+    import storage
+
+    results = {}
+    devnull = open(os.devnull, 'w')
+
+    # first connection creates the database and imports the json files
+    with contextlib.redirect_stdout(devnull):
+        _, results['migrate'] = timed(storage.connect)
+
+    _, results['load_game_database'] = timed(deckstats.load_game_database, repeat)
+
+    def replay():
+        players, decks, games = deckstats.load_game_database()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(devnull):
+            deckstats.calculate_stats(players, decks, games)
+        return time.perf_counter() - start
+    times = [replay() for _ in range(repeat)]
+    results['calculate_stats'] = {'seconds': round(min(times), 4), 'mean_s': round(sum(times) / len(times), 4)}
+
+    # the rating engine replays everything once, after that register_game applies one game
+    engine, results['rating_engine_replay'] = timed(ratings.get_engine)
+    rng = random.Random(seed)
+    keys = list(engine.decks)
+
+    def register(i):
+        pod = rng.sample(keys, 4)
+        deckstats.register_game('2030-01-01', rng.choice(pod), pod)
+    results['register_game'] = per_call(register, calls)
+
+    decks = deckstats.load_json_data('decks.json', deckstats.Deck)
+    owners = sorted({deck.owner for deck in decks})
+    results['game_history'] = per_call(lambda i: storage.game_history(deck=rng.choice(keys), limit=20), calls)
+    results['game_history_month'] = per_call(
+        lambda i: storage.game_history(player=rng.choice(owners), start='2023-03-01', end='2023-04-01'), calls)
+    results['random_decks'] = per_call(lambda i: deckstats.random_decks(decks, rng.sample(owners, 4)), calls)
+
+    _, results['carddb_build'] = timed(lambda: carddb.build(force=True))
+    _, results['card_load'] = timed(lambda: list(carddb.CardDatabase(card_cls=deckstats.Card)), repeat)
+    decklists, results['process_decklists'] = timed(
+        lambda: deckstats.process_decklists(os.path.join(directory, 'decklists')), repeat)
+    _, results['deck_stats'] = timed(lambda: [deckstats.deck_stats(deck['cards']) for deck in decklists], repeat)
+    matrix = cardmatrix.load_matrix()
+    _, results['batch_deck_stats'] = timed(lambda: cardmatrix.batch_deck_stats(decklists, matrix), repeat)
+
+    devnull.close()
+    return results
+
+
+# ---------- reports ---------------
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__) or '.',
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print every benchmark's time next to the baseline run's"""
+    print(f"{'benchmark':24} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, timing in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:24} {'-':>10} {timing['seconds']:>10.4f}")
+            continue
+        change = timing['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+        flag = '  slower' if change > 1.1 else '  faster' if change < 0.9 else ''
+        print(f"{name:24} {before['seconds']:>10.4f} {timing['seconds']:>10.4f} {change:>7.2f}x{flag}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark data handling against synthetic data')
+    parser.add_argument('--preset', default='small', choices=PRESETS)
+    for key in PRESETS['small']:
+        parser.add_argument(f'--{key}', type=int, help=f'override the number of {key}')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per timing, the best one is kept')
+    parser.add_argument('--calls', type=int, default=200, help='calls for per call timings')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help='keep the generated data here instead of a temporary directory')
+    parser.add_argument('--output', help='results file, defaults to bench_results/<commit>-<preset>.json')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    scale = dict(PRESETS[args.preset])
+    scale.update({key: getattr(args, key) for key in scale if getattr(args, key) is not None})
+
+    with contextlib.ExitStack() as stack:
+        directory = args.data_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(directory, exist_ok=True)
+        start = time.perf_counter()
+        write_dataset(directory, scale, args.seed)
+        print(f'Generated {scale} in {time.perf_counter() - start:.1f}s')
+        results = {'commit': git_commit(),
+                   'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': sys.version.split()[0],
+                   'platform': platform.platform(),
+                   'scale': scale,
+                   'results': run(directory, args.repeat, args.calls, args.seed)}
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit'] or 'nocommit'}-{args.preset}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    for name, timing in results['results'].items():
+        extra = f"  mean {timing['mean_ms']} ms  p99 {timing['p99_ms']} ms" if 'calls' in timing else ''
+        print(f"{name:24} {timing['seconds']:10.4f}s{extra}")
+    print(f'Saved {output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
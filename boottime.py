@@ -0,0 +1,6 @@
+import time
+
+
+# main.py imports this module before anything else, so STARTED is taken before the bot's
+# other imports and the startup report can include the time they take
+STARTED = time.perf_counter()
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import deckstats
+import storage
+
+
+class DataCache:
+    """Process wide cache of the players/decks/games tables.
+    Entries are dropped when this process writes a table and when the table's version
+    counter (storage.version) moved on because another process wrote to it"""
+
+    def __init__(self):
+        self.entries = {}   # (file name, class) -> (stamp, objects)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        storage.listeners.append(self.invalidate)
+
+    def stamp(self, file_name):
+        """Version of the table a file name is stored in, writes to other tables (or to
+        storage's meta) leave it alone"""
+        return storage.version(storage.TABLES[file_name])
+
+    def lookup(self, file_name, cls):
+        """Return cached objects if they are still fresh, otherwise None"""
+        entry = self.entries.get((file_name, cls))
+        if entry is not None and entry[0] == self.stamp(file_name):
+            self.hits += 1
+            return list(entry[1])
+        return None
+
+    def get(self, file_name, cls):
+        """Same as deckstats.load_json_data but served from memory when nothing changed.
+        Returns a new list, the objects in it are shared and shouldn't be modified"""
+        objects = self.lookup(file_name, cls)
+        if objects is not None:
+            return objects
+
+        with self.lock:
+            self.misses += 1
+            stamp = self.stamp(file_name)
+            objects = deckstats.load_json_data(file_name, cls)
+            self.entries[(file_name, cls)] = (stamp, objects)
+        return list(objects)
+
+    async def get_async(self, file_name, cls):
+        """Like get, but a cache miss is loaded in a worker thread so the event loop keeps running"""
+        objects = self.lookup(file_name, cls)
+        if objects is not None:
+            return objects
+        return await asyncio.to_thread(self.get, file_name, cls)
+
+    def invalidate(self, table=None):
+        """Drop cached entries for a table (or everything)"""
+        for key in list(self.entries):
+            if table is None or storage.TABLES.get(key[0]) == table:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0}
+
+
+cache = DataCache()
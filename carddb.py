@@ -0,0 +1,278 @@
+import gzip
+import json
+import mmap
+import os
+import re
+import struct
+import unicodedata
+from hashlib import blake2b
+
+
+# cards.dat holds one compact json record per card, cards.idx is a sorted
+# table of (key hash, offset, length) entries that gets binary searched via mmap.
+# A bulk file other than the default one gets its own pair of files, see store_files.
+# Records only keep the scryfall fields the bot reads (FIELDS), the bulk file is streamed
+# card by card while building so it never has to fit in memory.
+DATA_FILE = 'cards.dat'
+INDEX_FILE = 'cards.idx'
+# directory holding the bulk file, the card store and files derived from it
+DATA_DIR = os.path.dirname(__file__)
+
+FIELDS = ('name', 'mana_cost', 'cmc', 'type_line', 'oracle_text', 'colors', 'color_identity',
+          'edhrec_rank', 'prices', 'card_faces')
+FACE_FIELDS = ('name', 'mana_cost', 'type_line', 'oracle_text')
+PRICES = ('usd', 'usd_foil', 'usd_etched')
+CHUNK_SIZE = 1024 * 1024
+
+MAGIC = b'HORIDX2\0'   # bumped whenever the record format changes, older stores get rebuilt
+HEADER = struct.Struct('<8sqqI')    # magic, source mtime_ns, source size, entry count
+ENTRY = struct.Struct('<QQI')       # key hash, record offset, record length
+SEPARATORS = re.compile(r'[\s,]*')
+ITEM_END = re.compile(r'\s*[,\]]')
+
+
+def normalize_name(name: str):
+    """Lower case, accent free, single spaced version of a card name"""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.casefold().split())
+
+
+def key_hash(key: str):
+    return int.from_bytes(blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def local_path(file_name):
+    return os.path.join(DATA_DIR, file_name)
+
+
+def iter_json_array(f, chunk_size=CHUNK_SIZE):
+    """Yield the items of the json array in text file f one at a time, reading chunk_size
+    characters at a time"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while not buffer.strip():
+        more = f.read(chunk_size)
+        if not more:
+            break
+        buffer += more
+    buffer = buffer.lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Expected a json array')
+    pos, eof = 1, False
+    while True:
+        pos = SEPARATORS.match(buffer, pos).end()
+        if buffer.startswith(']', pos):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            # a complete item is followed by a comma or the closing bracket, without one
+            # it may carry on in the next chunk (like a number)
+            if not ITEM_END.match(buffer, end):
+                raise json.JSONDecodeError('Item may continue', buffer, end)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = f.read(chunk_size)
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield item
+        pos = end
+
+
+def project(card):
+    """Record of a scryfall card with only the fields the bot reads"""
+    record = {key: card[key] for key in FIELDS if key in card}
+    if 'prices' in record:
+        record['prices'] = {key: record['prices'].get(key) for key in PRICES}
+    if 'card_faces' in record:
+        record['card_faces'] = [{key: face[key] for key in FACE_FIELDS if key in face}
+                                for face in record['card_faces']]
+    return record
+
+
+def store_files(source):
+    """(data file, index file) of the card store built from source"""
+    stem = os.path.basename(source).split('.')[0]
+    if stem == 'scryfall_data':
+        return DATA_FILE, INDEX_FILE
+    return f'{stem}.{DATA_FILE}', f'{stem}.{INDEX_FILE}'
+
+
+def store_stamp(source='scryfall_data.json'):
+    """Changes whenever the card store of source is rebuilt"""
+    return os.stat(local_path(store_files(source)[1])).st_mtime_ns
+
+
+def resolve_source(source):
+    """The bulk file may have been saved gzipped, use whichever copy is newest"""
+    path = local_path(source)
+    if path.endswith('.gz'):
+        return path
+    gz_path = path + '.gz'
+    if os.path.exists(gz_path) and (not os.path.exists(path) or os.path.getmtime(gz_path) > os.path.getmtime(path)):
+        return gz_path
+    return path
+
+
+def source_stamp(source):
+    stat = os.stat(source)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def is_current(source, index_path):
+    """True if the index was built from the current version of the source file"""
+    try:
+        with open(index_path, 'rb') as f:
+            magic, mtime_ns, size, _ = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return False
+    return magic == MAGIC and (mtime_ns, size) == source_stamp(source)
+
+
+def build(source='scryfall_data.json', force=False):
+    """Build the on-disk card store from the scryfall bulk file if it changed.
+    Returns True if a rebuild happened"""
+
+    data_path, index_path = (local_path(x) for x in store_files(source))
+    source = resolve_source(source)
+    if not force and os.path.exists(data_path) and is_current(source, index_path):
+        return False
+
+    entries = []
+    with (gzip.open if source.endswith('.gz') else open)(source, 'rt', encoding='utf-8') as f, \
+            open(data_path + '.tmp', 'wb') as data:
+        for card in iter_json_array(f):
+            record = json.dumps(project(card), ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            offset = data.tell()
+            data.write(record)
+            for key in {card['name'], normalize_name(card['name'])}:
+                entries.append((key_hash(key), offset, len(record)))
+
+    entries.sort()
+    with open(index_path + '.tmp', 'wb') as index:
+        index.write(HEADER.pack(MAGIC, *source_stamp(source), len(entries)))
+        for entry in entries:
+            index.write(ENTRY.pack(*entry))
+
+    os.replace(data_path + '.tmp', data_path)
+    os.replace(index_path + '.tmp', index_path)
+    return True
+
+
+class CardDatabase:
+    """Read only view of the card store. Lookups are a binary search over the mmapped index"""
+
+    def __init__(self, data_file=DATA_FILE, index_file=INDEX_FILE, card_cls=None):
+        with open(local_path(data_file), 'rb') as f:
+            # an empty file can't be mapped, a store built from an empty dump has no records
+            empty = os.fstat(f.fileno()).st_size == 0
+            self.data = b'' if empty else mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(local_path(index_file), 'rb') as f:
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = HEADER.unpack_from(self.index, 0)[3]     # index entries, not cards
+        self.card_cls = card_cls
+        self._cards = {}
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self.index, HEADER.size + i * ENTRY.size)
+
+    def _candidates(self, key):
+        """Yield (offset, length) of every record whose key hash matches"""
+        target = key_hash(key)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self.count:
+            h, offset, length = self._entry(lo)
+            if h != target:
+                break
+            yield offset, length
+            lo += 1
+
+    def _load(self, offset, length):
+        if offset not in self._cards:
+            obj = json.loads(self.data[offset:offset + length])
+            self._cards[offset] = self.card_cls(**obj) if self.card_cls else obj
+        return self._cards[offset]
+
+    def _card_name(self, card):
+        return card['name'] if isinstance(card, dict) else card.name
+
+    def get(self, name: str):
+        """Return the card with this exact name, falling back to the normalized name"""
+        for offset, length in self._candidates(name):
+            card = self._load(offset, length)
+            if self._card_name(card) == name:
+                return card
+        key = normalize_name(name)
+        for offset, length in self._candidates(key):
+            card = self._load(offset, length)
+            if normalize_name(self._card_name(card)) == key:
+                return card
+        return None
+
+    def __getitem__(self, name):
+        card = self.get(name)
+        if card is None:
+            raise KeyError(name)
+        return card
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __iter__(self):
+        """Iterate every card in the store in file order"""
+        offset = 0
+        while offset < len(self.data):
+            end = self.data.find(b'\n', offset)
+            yield self._load(offset, end + 1 - offset)
+            offset = end + 1
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.index.close()
+
+
+_databases = {}
+
+
+def open_database(source='scryfall_data.json', card_cls=None):
+    """Return a shared CardDatabase, rebuilding the store first if the source file changed"""
+    rebuilt = build(source)
+    key = (source, card_cls)
+    if rebuilt or key not in _databases:
+        if key in _databases:
+            _databases[key].close()
+        _databases[key] = CardDatabase(*store_files(source), card_cls=card_cls)
+    return _databases[key]
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    import deckstats
+    print('***Testing***')
+    source = sys.argv[1] if len(sys.argv) > 1 else 'scryfall_data.json'
+
+    def peak_rss():
+        try:
+            import resource
+        except ImportError:     # windows
+            return ''
+        return f', peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB'
+
+    start = time.perf_counter()
+    build(source, force=True)
+    print(f'Built the card store in {time.perf_counter() - start:.2f}s{peak_rss()}, '
+          f'{os.path.getsize(local_path(store_files(source)[0])) / 1e6:.1f} MB of records')
+    start = time.perf_counter()
+    cards = list(CardDatabase(*store_files(source), card_cls=deckstats.Card))
+    print(f'Loaded {len(cards)} cards in {time.perf_counter() - start:.2f}s{peak_rss()}')
+    print(cards[0].as_dict())
@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import carddb
+
+
+# Per card features kept as numpy arrays (one row per card in the card store) so stats
+# for every deck come out of a few quantity weighted matrix products. Each card store has
+# its own matrix file, cards.npz next to cards.dat and <stem>.cards.npz for other sources
+MATRIX_FILE = 'cards.npz'
+PIPS = ('{W}', '{U}', '{B}', '{R}', '{G}')
+COLORS = 'WUBRG'
+CURVE_BUCKETS = 8   # mana value 0-6 and 7+
+
+
+def field(card, name, default=None):
+    value = card.get(name) if isinstance(card, dict) else getattr(card, name, None)
+    return default if value is None else value
+
+
+def card_price(card):
+    prices = field(card, 'prices', {})
+    values = [float(prices[key]) for key in ['usd', 'usd_foil', 'usd_etched'] if prices.get(key) is not None]
+    return min(values) if values else 0
+
+
+class CardMatrix:
+    def __init__(self, names, cmc, pips, edhrec_rank, basic_land, color_identity, price):
+        self.names = names
+        self.cmc = cmc                          # float64 (n,)
+        self.pips = pips                        # int64 (n, 5) WUBRG pip counts
+        self.edhrec_rank = edhrec_rank          # int64 (n,), 0 if unranked
+        self.basic_land = basic_land            # bool (n,)
+        self.color_identity = color_identity    # uint8 (n,) WUBRG bit mask
+        self.price = price                      # float64 (n,)
+        # the first card of a name, like carddb.get returns
+        self.rows = {}
+        for i, name in enumerate(names):
+            self.rows.setdefault(name, i)
+
+    @classmethod
+    def from_cards(cls, cards):
+        cards = list(cards)
+        return cls(names=[field(card, 'name') for card in cards],
+                   cmc=np.array([field(card, 'cmc', 0) for card in cards], dtype=np.float64),
+                   pips=np.array([[field(card, 'mana_cost', '').count(x) for x in PIPS] for card in cards],
+                                 dtype=np.int64).reshape(-1, len(PIPS)),
+                   edhrec_rank=np.array([field(card, 'edhrec_rank', 0) for card in cards], dtype=np.int64),
+                   basic_land=np.array([field(card, 'type_line', '').startswith('Basic Land') for card in cards],
+                                       dtype=bool),
+                   color_identity=np.array([sum(1 << COLORS.index(c) for c in field(card, 'color_identity', []))
+                                            for card in cards], dtype=np.uint8),
+                   price=np.array([card_price(card) for card in cards], dtype=np.float64))
+
+    def save(self, path, stamp):
+        np.savez(path, names=np.array(self.names), cmc=self.cmc, pips=self.pips, edhrec_rank=self.edhrec_rank,
+                 basic_land=self.basic_land, color_identity=self.color_identity, price=self.price,
+                 stamp=np.array(stamp))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(names=data['names'].tolist(), cmc=data['cmc'], pips=data['pips'],
+                       edhrec_rank=data['edhrec_rank'], basic_land=data['basic_land'],
+                       color_identity=data['color_identity'], price=data['price']), int(data['stamp'])
+
+
+_matrices = {}     # source -> (matrix, store stamp)
+
+
+def matrix_file(source):
+    data_file = carddb.store_files(source)[0]
+    return data_file[:-len(carddb.DATA_FILE)] + MATRIX_FILE
+
+
+def load_matrix(source='scryfall_data.json'):
+    """Feature matrix for every card in the store, only recomputed after the store is rebuilt"""
+    carddb.build(source)
+    stamp = carddb.store_stamp(source)
+    cached = _matrices.get(source)
+    if cached is not None and cached[1] == stamp:
+        return cached[0]
+
+    path = carddb.local_path(matrix_file(source))
+    matrix, saved_stamp = CardMatrix.load(path) if os.path.exists(path) else (None, None)
+    if saved_stamp != stamp:
+        matrix = CardMatrix.from_cards(carddb.open_database(source))
+        matrix.save(path, stamp)
+    _matrices[source] = (matrix, stamp)
+    return matrix
+
+
+def card_rows(matrix, decklists):
+    """Deck index and matrix row of every card copy in process_decklists output"""
+    deck_indx, rows = [], []
+    for indx, deck in enumerate(decklists):
+        for card in deck['cards']:
+            row = matrix.rows.get(card.name)
+            if row is not None:
+                deck_indx.append(indx)
+                rows.append(row)
+    return np.array(deck_indx, dtype=np.int64), np.array(rows, dtype=np.int64)
+
+
+def batch_deck_stats(decklists, matrix=None):
+    """Same average_cmc, edh_score and pips as deckstats.deck_stats for every deck in one pass,
+    plus a mana curve, share of each color's pips, total price and color identity.
+    Every stat is a quantity weighted sum per deck (np.bincount over all card copies)"""
+
+    matrix = matrix or load_matrix()
+    decks, rows = card_rows(matrix, decklists)
+    n = len(decklists)
+
+    def per_deck(weights):
+        return np.bincount(decks, weights=weights, minlength=n)
+
+    # basic lands don't count towards any of the stats
+    counted = ~matrix.basic_land[rows]
+    cmc_values = matrix.cmc[rows]
+
+    count = per_deck(counted)
+    cmc = per_deck(cmc_values * counted)
+    edhrec = per_deck(matrix.edhrec_rank[rows] * counted)
+    pips = np.stack([per_deck(matrix.pips[rows, color] * counted) for color in range(len(PIPS))], axis=1)
+    price = per_deck(matrix.price[rows])
+    buckets = np.minimum(cmc_values, CURVE_BUCKETS - 1).astype(np.int64)
+    curve = np.bincount(decks * CURVE_BUCKETS + buckets, weights=counted,
+                        minlength=n * CURVE_BUCKETS).reshape(n, CURVE_BUCKETS)
+    identity = np.zeros(n, dtype=np.uint8)
+    np.bitwise_or.at(identity, decks, matrix.color_identity[rows])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average_cmc = np.where(count > 0, cmc / count, 0)
+        edh_score = np.where(count > 0, edhrec / count, 0)
+        pip_share = np.where(pips.sum(axis=1, keepdims=True) > 0, pips / pips.sum(axis=1, keepdims=True), 0)
+
+    return [{'name': deck['name'],
+             'average_cmc': round(float(average_cmc[i]), 2),
+             'edh_score': int(edh_score[i]),
+             'pips': pips[i].astype(np.int64).tolist(),
+             'curve': curve[i].astype(np.int64).tolist(),
+             'pip_share': [round(float(x), 3) for x in pip_share[i]],
+             'price': round(float(price[i]), 2),
+             'color_identity': ''.join(c for bit, c in enumerate(COLORS) if identity[i] >> bit & 1)}
+            for i, deck in enumerate(decklists)]
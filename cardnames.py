@@ -0,0 +1,166 @@
+import re
+import numpy as np
+import carddb
+
+
+# Resolves card names as they're written in decklists to names in the card store: exact
+# names, normalized names (case, accents, spacing), the front face or slash separated
+# faces of double faced and split cards, and a trigram index over all of those for typos.
+# Decklists are resolved in batches so every distinct name is looked up once.
+
+FUZZY_ACCEPT = 0.75     # trigram similarity at which a typo is corrected without asking
+FUZZY_SUGGEST = 0.4     # lowest similarity still worth suggesting
+SUGGESTIONS = 3
+
+# "4 Sol Ring", "1x Sol Ring (C21) 263", "1 Sol Ring (C21) 263 *F*"
+QUANTITY = re.compile(r'(\d+)x?\s+')
+PRINTING = re.compile(r'(?:\s+\([A-Za-z0-9]{2,6}\)(?:\s+[^\s*]+)?)?(?:\s+\*[A-Z]+\*)*$')
+QUOTES = str.maketrans({'’': "'", '‘': "'", '“': '"', '”': '"'})
+
+
+def parse_line(line: str):
+    """(quantity, card name) of a decklist line, None for blank lines"""
+    line = line.strip()
+    if not line:
+        return None
+    qty = 1
+    match = QUANTITY.match(line)
+    if match is not None:
+        qty, line = int(match.group(1)), line[match.end():]
+    if '(' in line or line.endswith('*'):
+        line = PRINTING.sub('', line, count=1)
+    return qty, line
+
+
+def normalize(name: str):
+    return carddb.normalize_name(name.translate(QUOTES))
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameResolver:
+    def __init__(self, names):
+        self.names = list(names)
+        self.keys = {}          # normalized name or alias -> index in names
+        for indx, name in enumerate(self.names):
+            self.keys.setdefault(normalize(name), indx)
+        # aliases go in after every full name so they never shadow a card's real name
+        for indx, name in enumerate(self.names):
+            if ' // ' in name:
+                faces = name.split(' // ')
+                for alias in (faces[0], '/'.join(faces), ' / '.join(faces)):
+                    self.keys.setdefault(normalize(alias), indx)
+        self.exact = {name: name for name in self.names}
+        self._fuzzy = None
+
+    def fuzzy_index(self):
+        """Trigram -> ids of the keys containing it, built the first time a name needs it"""
+        if self._fuzzy is None:
+            keys = list(self.keys)
+            postings = {}
+            sizes = np.zeros(len(keys), dtype=np.int32)
+            for indx, key in enumerate(keys):
+                grams = trigrams(key)
+                sizes[indx] = len(grams)
+                for gram in grams:
+                    postings.setdefault(gram, []).append(indx)
+            postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+            self._fuzzy = (keys, postings, sizes)
+        return self._fuzzy
+
+    def similar(self, name, limit=SUGGESTIONS):
+        """(similarity, card name) of the closest cards, best first. Similarity is the
+        dice coefficient of the trigram sets"""
+        keys, postings, sizes = self.fuzzy_index()
+        grams = trigrams(normalize(name))
+        ids = [postings[gram] for gram in grams if gram in postings]
+        if not ids:
+            return []
+        shared = np.bincount(np.concatenate(ids), minlength=len(keys))
+        scores = 2 * shared / (len(grams) + sizes)
+        count = min(limit * 4, len(keys))
+        best = np.argpartition(-scores, count - 1)[:count]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        result = []
+        for indx in best:
+            name = self.names[self.keys[keys[indx]]]
+            if scores[indx] >= FUZZY_SUGGEST and all(name != x for _, x in result):
+                result.append((round(float(scores[indx]), 3), name))
+        return result[:limit]
+
+    def get(self, name):
+        """Card name for one written name, None if only a fuzzy match would do"""
+        found = self.exact.get(name)
+        if found is None:
+            indx = self.keys.get(normalize(name))
+            found = self.names[indx] if indx is not None else None
+        return found
+
+    def resolve(self, names):
+        """Resolve many written names at once. Returns two dicts: name -> card name for the
+        names that resolved (typos included), name -> suggested card names for the rest"""
+        found, missing = {}, {}
+        for name in set(names):
+            match = self.get(name)
+            if match is not None:
+                found[name] = match
+                continue
+            similar = self.similar(name)
+            # a typo is only corrected when one card is clearly the closest
+            if similar and similar[0][0] >= FUZZY_ACCEPT and (len(similar) == 1 or similar[1][0] < similar[0][0]):
+                found[name] = similar[0][1]
+            else:
+                missing[name] = [x for _, x in similar]
+        return found, missing
+
+
+_resolver = None
+
+
+def get_resolver(source='scryfall_data.json'):
+    """Shared resolver over every card in the store, rebuilt when the store is rebuilt"""
+    global _resolver
+    import cardmatrix
+    matrix = cardmatrix.load_matrix(source)
+    if _resolver is None or _resolver[0] is not matrix:
+        _resolver = (matrix, NameResolver(matrix.names))
+    return _resolver[1]
+
+
+def missing_text(missing):
+    """Unmatched names and their suggestions, one per line"""
+    lines = []
+    for name, suggestions in sorted(missing.items()):
+        hint = f' (did you mean {" / ".join(suggestions)}?)' if suggestions else ''
+        lines.append(f'Unknown card: {name}{hint}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    print('***Testing***')
+    if len(sys.argv) > 1:
+        carddb.DATA_DIR = sys.argv[1]
+
+    start = time.perf_counter()
+    resolver = get_resolver()
+    print(f'{len(resolver.names)} cards, {len(resolver.keys)} keys in {time.perf_counter() - start:.2f}s')
+    for line in ['1 Sol Ring (C21) 263', '2x Lightning Bolt', '1 Sol Ring (C21) 263 *F*', 'Opt', '   ']:
+        print(repr(line), parse_line(line))
+
+    import random
+    rng = random.Random(0)
+    sample = rng.sample(resolver.names, 2000)
+    typos = [name[:i] + name[i + 1:] for name in rng.sample(resolver.names, 50) for i in [len(name) // 2]]
+    written = sample + [name.upper() for name in sample[:200]] + typos + ['Not A Real Card']
+    decks = [[rng.choice(written) for _ in range(100)] for _ in range(500)]
+
+    start = time.perf_counter()
+    found, missing = resolver.resolve(name for deck in decks for name in deck)
+    print(f'Resolved {len(decks)} decks of 100 cards in {time.perf_counter() - start:.3f}s, '
+          f'{len(found)} names found, {len(missing)} missing')
+    print(missing_text(dict(list(missing.items())[:5])))
@@ -0,0 +1,282 @@
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+import carddb
+
+
+# A subset of scryfall search syntax answered from the local card store:
+#   bare words / "quoted phrases"   name
+#   t: type:                        type line
+#   o: oracle:                      rules text
+#   c: color:                       colors (c:ug is at least blue and green, c=ug exactly, c:c colorless)
+#   id: identity:                   color identity within (id:wubrg fits a 5 color commander)
+#   cmc  mv                         with : = < <= > >=
+#   edhrec                          edhrec rank with the same operators
+# A leading - negates a term. Words match the start of words in the field, phrases
+# must appear as written. Results are sorted by edhrec rank.
+
+COLORS = 'WUBRG'
+TERM = re.compile(r'(-?)(?:(\w+)(:|<=|>=|!=|<|>|=))?("[^"]*"|\S+)')
+WORD = re.compile(r"[a-z0-9']+")
+
+FIELD_ALIASES = {'t': 'type', 'type': 'type', 'o': 'oracle', 'oracle': 'oracle',
+                 'c': 'color', 'color': 'color', 'id': 'identity', 'identity': 'identity',
+                 'cmc': 'cmc', 'mv': 'cmc', 'edhrec': 'edhrec', 'name': 'name', 'n': 'name'}
+
+
+def tokens(text):
+    return WORD.findall(carddb.normalize_name(text or ''))
+
+
+def color_mask(colors):
+    return sum(1 << COLORS.index(c) for c in colors if c in COLORS)
+
+
+def bitset(ids):
+    """int with the bit of every id set"""
+    bits = bytearray((max(ids) >> 3) + 1) if ids else bytearray()
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def set_bits(mask, limit=None):
+    """ids of the set bits, lowest first"""
+    ids = []
+    for byte_indx, byte in enumerate(mask.to_bytes((mask.bit_length() + 7) // 8, 'little')):
+        while byte:
+            if len(ids) == limit:
+                return ids
+            low = byte & -byte
+            ids.append(byte_indx * 8 + low.bit_length() - 1)
+            byte ^= low
+    return ids
+
+
+class CardIndex:
+    """Inverted indexes over the card store for name, type line, rules text, colors,
+    color identity, mana value and edhrec rank.
+    Cards are numbered in edhrec rank order and every posting list is an int bitset,
+    so terms combine with & | ~ and the lowest set bits are the most played matches"""
+
+    def __init__(self, cards):
+        cards = [card if isinstance(card, dict) else card.as_dict() for card in cards]
+        cards.sort(key=lambda card: (card.get('edhrec_rank') is None, card.get('edhrec_rank') or 0))
+
+        self.cards = []
+        self.normalized = {'name': [], 'type': [], 'oracle': []}  # for checking phrases
+        words = {'name': {}, 'type': {}, 'oracle': {}}             # field -> word -> card ids
+        colors, identity, cmc = {}, {}, {}
+        self.ranks = []
+
+        for i, card in enumerate(cards):
+            if 'card_faces' in card and 'oracle_text' not in card:
+                oracle = '\n'.join(face.get('oracle_text', '') for face in card['card_faces'])
+                mana_cost = ' // '.join(face.get('mana_cost', '') for face in card['card_faces'])
+            else:
+                oracle, mana_cost = card.get('oracle_text', ''), card.get('mana_cost', '')
+            self.cards.append({'name': card['name'], 'mana_cost': mana_cost,
+                               'type_line': card.get('type_line', ''), 'oracle_text': oracle,
+                               'cmc': card.get('cmc', 0), 'edhrec_rank': card.get('edhrec_rank')})
+
+            for field, text in (('name', card['name']), ('type', card.get('type_line')), ('oracle', oracle)):
+                self.normalized[field].append(carddb.normalize_name(text or ''))
+                for word in set(tokens(text)):
+                    words[field].setdefault(word, []).append(i)
+            colors.setdefault(color_mask(card.get('colors', [])), []).append(i)
+            identity.setdefault(color_mask(card.get('color_identity', [])), []).append(i)
+            cmc.setdefault(card.get('cmc', 0), []).append(i)
+            if card.get('edhrec_rank') is not None:
+                self.ranks.append(card['edhrec_rank'])
+
+        self.words = {field: {word: bitset(ids) for word, ids in postings.items()}
+                      for field, postings in words.items()}
+        self.sorted_words = {field: sorted(postings) for field, postings in words.items()}
+        self.colors = {mask: bitset(ids) for mask, ids in colors.items()}
+        self.identity = {mask: bitset(ids) for mask, ids in identity.items()}
+        self.cmc = {value: bitset(ids) for value, ids in cmc.items()}
+        self.all = (1 << len(self.cards)) - 1
+
+    def prefix(self, field, word):
+        """Cards with a word in field starting with word"""
+        words = self.sorted_words[field]
+        result = 0
+        for indx in range(bisect_left(words, word), len(words)):
+            if not words[indx].startswith(word):
+                break
+            result |= self.words[field][words[indx]]
+        return result
+
+    def text(self, field, value):
+        phrase = value.startswith('"')
+        value = value.strip('"')
+        result = self.all
+        for word in tokens(value):
+            result &= self.prefix(field, word)
+        if phrase and ' ' in value.strip():
+            needle = carddb.normalize_name(value)
+            texts = self.normalized[field]
+            result = bitset([i for i in set_bits(result) if needle in texts[i]])
+        return result
+
+    def color(self, buckets, op, value, default_op):
+        value = value.upper()
+        mask = 0 if value == 'C' else color_mask(value)
+        op = default_op if op == ':' else op
+        result = 0
+        for bucket_mask, ids in buckets.items():
+            if value == 'C' and op in ('>=', '='):
+                match = bucket_mask == 0
+            elif op == '>=':
+                match = bucket_mask & mask == mask
+            elif op == '<=':
+                match = bucket_mask | mask == mask
+            elif op == '=':
+                match = bucket_mask == mask
+            elif op == '>':
+                match = bucket_mask & mask == mask and bucket_mask != mask
+            elif op == '<':
+                match = bucket_mask | mask == mask and bucket_mask != mask
+            else:
+                match = bucket_mask != mask
+            if match:
+                result |= ids
+        return result
+
+    def compare(self, op, a, b):
+        return {':': a == b, '=': a == b, '!=': a != b,
+                '<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b}[op]
+
+    def mana_value(self, op, value):
+        result = 0
+        for cmc, ids in self.cmc.items():
+            if self.compare(op, cmc, value):
+                result |= ids
+        return result
+
+    def edhrec(self, op, value):
+        """Ranked cards come first in id order, so a rank range is a range of ids"""
+        if op == '!=':
+            return self.all & ~self.edhrec('=', value)
+        lo = 0 if op in ('<', '<=') else bisect_left(self.ranks, value) if op in (':', '=', '>=') \
+            else bisect_right(self.ranks, value)
+        hi = len(self.ranks) if op in ('>', '>=') else bisect_left(self.ranks, value) if op == '<' \
+            else bisect_right(self.ranks, value)
+        return ((1 << hi) - 1) ^ ((1 << lo) - 1) if hi > lo else 0
+
+    def term(self, field, op, value):
+        if field in ('name', 'type', 'oracle'):
+            return self.text(field, value)
+        if field == 'color':
+            return self.color(self.colors, op, value, '>=')
+        if field == 'identity':
+            return self.color(self.identity, op, value, '<=')
+        if field == 'cmc':
+            return self.mana_value(op, float(value))
+        if field == 'edhrec':
+            return self.edhrec(op, float(value))
+        raise ValueError(f'Unsupported search field: {field}')
+
+    def match(self, query: str):
+        """Bitset of the cards matching every term of the query"""
+        result = self.all
+        for negate, field, op, value in TERM.findall(query):
+            if field and field.lower() not in FIELD_ALIASES:
+                raise ValueError(f'Unsupported search field: {field}')
+            matches = self.term(FIELD_ALIASES[field.lower()] if field else 'name', op or ':', value)
+            result &= ~matches if negate else matches
+            if not result:
+                break
+        return result
+
+    def search(self, query: str, limit=None):
+        """Return cards (dicts) matching every term of the query, most played first"""
+        return [self.cards[i] for i in set_bits(self.match(query), limit)]
+
+    def count(self, query: str):
+        return self.match(query).bit_count()
+
+
+def card_text(card):
+    """Card formatted like scryfall's text format"""
+    lines = [f"{card['name']} {card['mana_cost']}".strip(), card['type_line']]
+    if card['oracle_text']:
+        lines.append(card['oracle_text'])
+    return '\n'.join(lines)
+
+
+def search_text(index, query, limit=5, max_length=2000):
+    """Search results formatted for a discord message"""
+    try:
+        matches = index.match(query)
+    except ValueError as e:
+        return str(e)
+    if not matches:
+        return f'No cards found for `{query}`'
+    cards = [index.cards[i] for i in set_bits(matches, limit)]
+    output = '\n\n'.join(card_text(card) for card in cards)
+    if matches.bit_count() > limit:
+        output += f'\n\n... and {matches.bit_count() - limit} more'
+    return output[:max_length]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def ready():
+    """True once the shared index has been built"""
+    return _index is not None
+
+
+def current():
+    """Shared index as it is, without checking for a newer bulk file. None until built"""
+    return _index
+
+
+def get_index(source='scryfall_data.json'):
+    """Shared index, rebuilt when the card store was rebuilt from a newer bulk file.
+    Checking and rebuilding are blocking, run it in a thread from the bot"""
+    global _index
+    with _index_lock:
+        if carddb.build(source) or _index is None:
+            _index = CardIndex(carddb.open_database(source))
+    return _index
+
+
+def benchmark(index, count=3000, seed=1):
+    """Time a few thousand generated queries of every supported kind"""
+    import random
+    rng = random.Random(seed)
+    names = [w for w in index.sorted_words['name'] if len(w) > 3]
+    types = index.sorted_words['type']
+    oracle = [w for w in index.sorted_words['oracle'] if len(w) > 3]
+    colors = ['w', 'u', 'b', 'r', 'g', 'ug', 'wb', 'rg', 'c', 'wubrg']
+    makers = [lambda: rng.choice(names),
+              lambda: f't:{rng.choice(types)}',
+              lambda: f'o:{rng.choice(oracle)}',
+              lambda: f'o:"draw a card" c:{rng.choice(colors)}',
+              lambda: f't:creature id:{rng.choice(colors)} cmc<={rng.randint(1, 6)}',
+              lambda: f'c:{rng.choice(colors)} cmc={rng.randint(0, 7)} -t:land',
+              lambda: f'{rng.choice(names)} t:{rng.choice(types)}']
+    queries = [rng.choice(makers)() for _ in range(count)]
+
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, limit=5)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {'queries': count,
+            'total_s': round(sum(timings), 3),
+            'mean_ms': round(1000 * sum(timings) / count, 3),
+            'p50_ms': round(1000 * timings[count // 2], 3),
+            'p99_ms': round(1000 * timings[int(count * 0.99)], 3)}
+
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    index = get_index()
+    print(f'Indexed {len(index.cards)} cards in {time.perf_counter() - start:.2f}s')
+    print(benchmark(index))
@@ -1,14 +1,32 @@
+import gzip
 import json
-import requests
-from bs4 import BeautifulSoup
+import shutil
 import random
 import os
-import random
+import sys
+import carddb
+import httpcache
+import metrics
+import storage
+from urllib.parse import quote_plus
+
+
+# rating parameters used when replaying games
+K_FACTOR = 133
+D_FACTOR = 200
+GOLD_ANTE = 25
+
+# decklists are split across a process pool once at least this many changed, stats of
+# every file are cached in the deck_stats table of the database
+PARALLEL_FILES = 64
+STATS_KEYS = ('name', 'average_cmc', 'edh_score', 'pips')
+STATS_VERSION = 2       # bump when the way decklists are read changes, cached stats are dropped
 
 
 class Player:
     def __init__(self, name, rating=1500, 
-                 gold=300, wins=0, losses=0):
+                 gold=300, wins=0, losses=0, id=None):
+        self.id = id
         self.name = name
         self.rating = rating
         self.gold = gold
@@ -18,7 +36,8 @@ class Player:
 
 class Deck:
     def __init__(self, owner, commander, decklist=None, 
-                 rating=1500, wins=0, losses=0):
+                 rating=1500, wins=0, losses=0, id=None):
+        self.id = id
         self.owner = owner
         self.commander = commander
         self.decklist = decklist
@@ -31,7 +50,8 @@ class Deck:
 
 
 class Game:
-    def __init__(self, date, winner, decks):
+    def __init__(self, date, winner, decks, id=None):
+        self.id = id
         self.date = date
         self.winner = winner
         self.decks = decks
@@ -41,32 +61,60 @@ class Game:
     
 
 class Card:
+    """Card from the card store or a raw scryfall dump. Only carddb.FIELDS are kept, fields
+    the card doesn't have are left unset, repeated strings and color lists are shared
+    between cards"""
+    __slots__ = carddb.FIELDS
+    _shared = {}
+
     def __init__(self, **kwargs):
         for key, value in kwargs.items():
+            if key not in Card.__slots__:
+                continue
+            if key in ('type_line', 'mana_cost'):
+                value = sys.intern(value)
+            elif key in ('colors', 'color_identity'):
+                value = Card._shared.setdefault(tuple(value), tuple(value))
             setattr(self, key, value)
 
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__ if hasattr(self, key)}
+
+
+def add_decks(decks: list):
+    """Append new decks to the deck database"""
+    storage.insert('decks', [x.__dict__ for x in decks])
+
 
 def register_game(date, winner, decks):
-    """Wrtie new game to json file"""
-    games = load_json_data('games.json', Game)
+    """Append new game to the game database"""
     new_game = Game(date,winner,decks)
-    games.append(new_game)
-    save_to_json(games,'games.json')
+    storage.insert('games', [new_game.__dict__])
+
+    # apply just this game to the saved ratings
+    import ratings
+    ratings.get_engine()
     return new_game
 
 
 def load_json_data(file_name, cls):
     """Load json data to class objects"""
+    if file_name in storage.TABLES:
+        return [cls(**obj) for obj in storage.load(storage.TABLES[file_name])]
     path = os.path.join(os.path.dirname(__file__), file_name)
     return [cls(**obj) for obj in read_file(path)]
 
 
 def save_to_json(objects: list, file_name):
     """Save list of class objects to json file"""
+    if file_name in storage.TABLES:
+        storage.save(storage.TABLES[file_name], [x.__dict__ for x in objects])
+        return
     path = os.path.join(os.path.dirname(__file__), file_name)
     write_file([x.__dict__ for x in objects], path)
 
 
+@metrics.io
 def read_file(path):
     '''Read json data from a file'''
     with open(path, 'r', encoding="utf-8") as f:
@@ -74,6 +122,7 @@ def read_file(path):
     return data
 
 
+@metrics.io
 def write_file(data, path):
     '''Write json data to a file'''
     with open(path, 'w') as f:
@@ -102,19 +151,48 @@ def multi_ev(d_factor: int, ratings: list, indx: int):
         return sum_ev / (len(ratings) * (len(ratings) - 1) / 2)
 
 
+# decklist sites we can read a commander from, by link prefix
+DECK_SITES = {'https://www.mtggoldfish.com': 'mtggoldfish',
+              'https://www.moxfield.com': 'moxfield'}
+
+DECK_PAGE_HEADERS = {'User-Agent': 'python-requests/2.28.2',
+                     'Accept': 'text/html'}
+
+
+def deck_site(link: str, sites=DECK_SITES):
+    """Returns which decklist site a link belongs to, or None if it isn't supported"""
+    return next((site for prefix, site in sites.items() if link.startswith(prefix)), None)
+
+
 def get_commander_name(link: str):
     """Takes a decklist link and return the name of the commander"""
 
-    headers = {'User-Agent': 'python-requests/2.28.2',
-                'Accept': 'text/html'}
-    response = requests.get(link, headers=headers)
+    site = deck_site(link)
+    if site is None:
+        return 'I can only process www.mtggoldfish.com or www.moxfield.com links at this time.'
 
-    if response.status_code//100 != 2:
-        return response
-    
-    soup = BeautifulSoup(response.content, 'html.parser')
+    # a deck page we already read costs nothing until the cached copy expires
+    commander = httpcache.extracted(link, 'commander')
+    if commander is None:
+        response = httpcache.get(link, headers=DECK_PAGE_HEADERS)
+
+        if response.status_code//100 != 2:
+            return response
+
+        commander = parse_commander_name(site, response.content)
+        httpcache.set_extracted(link, 'commander', commander)
+
+    return commander
 
-    if link.startswith('https://www.mtggoldfish.com'):
+
+def parse_commander_name(site: str, html):
+    """Takes a mtggoldfish or moxfield deck page and return the name of the commander"""
+    # imported here, the bot only needs it when pulling decks
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    if site == 'mtggoldfish':
         # For mtggoldfish links, the commander is in an input element
 
         commander_element = soup.find(
@@ -123,30 +201,29 @@ def get_commander_name(link: str):
             'input', {'name': 'deck_input[commander_alt]'})
         
         commander_name = commander_element.get('value')
-        partner_name = partner_element.get('value')
+        partner_name = partner_element.get('value') if partner_element else None
 
         if partner_name is None:
             return commander_name
         else:
-            # return commander_element.get('value') + ' / ' + partner_element.get('value')
             return f"{commander_name} / {partner_name}"
         
-    elif link.startswith('https://www.moxfield.com'):
+    elif site == 'moxfield':
         # For moxfield links, the commander is in the title element
         title = soup.find('title').text
         # Return text between parentheses
         return title[title.index('Commander (') + 11:title.index(')')]
-    
-    else:
-        return 'I can only process www.mtggoldfish.com or www.moxfield.com links at this time.'
 
 
 def random_decks(decks: list[object], players=None):
     """Returns a random deck for each player"""
+    owners = {}
+    for deck in decks:
+        owners.setdefault(deck.owner, []).append(deck)
     if players == None:
-        players = random.sample(list(set([x.owner for x in decks])), k=4)
+        players = random.sample(list(owners), k=4)
 
-    return [random.choice([deck for deck in decks if deck.owner == player]) for player in players]
+    return [random.choice(owners[player]) for player in players]
 
 
 def roll(dice: str):
@@ -160,82 +237,200 @@ def roll(dice: str):
 
 
 def scryfall_search(query, limit):
-    # Format text for query url and send the GET request
-    query.replace(' ', '+').replace(':', '%3A')
-    response = requests.get(f'https://api.scryfall.com/cards/search?q={query}')
+    # Format text for query url and send the GET request (repeat queries come from the cache)
+    response = httpcache.get(f'https://api.scryfall.com/cards/search?q={quote_plus(query)}')
     response_json = response.json()
     output = ''
     for card in [card['id'] for card in response_json['data']][:limit]:
-        text = requests.get(f'https://api.scryfall.com/cards/{card}?format=text&pretty=true')
+        text = httpcache.get(f'https://api.scryfall.com/cards/{card}?format=text&pretty=true')
         output += f'{text.text}\n\n'
     return output[:2000]
 
 
-def scryfall_bulk_data():
-    """Use scryfall API to pull bulk card data"""
+SCRYFALL_API = 'https://api.scryfall.com'
+BULK_META = 'scryfall_bulk_meta.json'
+
+
+def scryfall_bulk_data(api=SCRYFALL_API, compress=False, chunk_size=1024 * 1024):
+    """Use scryfall API to pull bulk card data.
+    Skips the download if the bulk entry's updated_at hasn't changed, streams it to a .part
+    file that later calls resume with a Range request, and optionally stores it gzipped.
+    Returns True if a new file was downloaded, False if nothing changed or the download
+    failed"""
+    import requests
 
     headers = {'User-Agent': 'python-requests/2.28.2'}
-    link = 'https://api.scryfall.com/bulk-data'
-    response = requests.get(link, headers=headers)
+    link = f'{api}/bulk-data'
+    try:
+        response = requests.get(link, headers=headers)
+    except requests.RequestException as e:
+        print(f'Bulk data lookup failed: {e}')
+        return False
 
     if response.status_code//100 != 2:
         print(response.status_code)
+        return False
 
     response_json = json.loads(response.text)
     oracle_cards = [x for x in response_json['data'] if x['type'] == 'oracle_cards'][0]
     download_uri = oracle_cards['download_uri']
-    bulk_data_response = requests.get(download_uri, headers=headers)
+    updated_at = oracle_cards['updated_at']
+
+    file_name = 'scryfall_data.json.gz' if compress else 'scryfall_data.json'
+    path = carddb.local_path(file_name)
+    meta_path = carddb.local_path(BULK_META)
+    meta = read_file(meta_path) if os.path.exists(meta_path) else {}
+    if meta.get('updated_at') == updated_at and os.path.exists(path):
+        return False
+
+    # a partial download can only be resumed if it is from the same version
+    part_path = carddb.local_path('scryfall_data.json.part')
+    if meta.get('partial_updated_at') != updated_at and os.path.exists(part_path):
+        os.remove(part_path)
+    meta['partial_updated_at'] = updated_at
+    write_file(meta, meta_path)
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    # ask for the raw bytes, ranges of a compressed transfer can't be stitched back together
+    download_headers = dict(headers, **{'Accept-Encoding': 'identity'})
+    if offset:
+        download_headers['Range'] = f'bytes={offset}-'
+
+    try:
+        with requests.get(download_uri, headers=download_headers, stream=True) as bulk_data_response:
+            if bulk_data_response.status_code == 416:
+                pass    # the partial file is already complete
+            elif bulk_data_response.status_code//100 != 2:
+                print(bulk_data_response.status_code)
+                return False
+            else:
+                # a server that ignores the Range header sends the whole file again
+                mode = 'ab' if bulk_data_response.status_code == 206 else 'wb'
+                with open(part_path, mode) as file:
+                    for chunk in bulk_data_response.iter_content(chunk_size):
+                        file.write(chunk)
+    except requests.RequestException as e:
+        # the connection broke off mid-stream, the next call downloads the file again
+        # instead of resuming from whatever the broken response left behind
+        print(f'Bulk data download failed: {e}')
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return False
+
+    if oracle_cards.get('size') and os.path.getsize(part_path) != oracle_cards['size']:
+        print(f'Incomplete download: {os.path.getsize(part_path)} of {oracle_cards["size"]} bytes')
+        return False
+
+    if compress:
+        with open(part_path, 'rb') as src, gzip.open(path + '.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst, chunk_size)
+        os.replace(path + '.tmp', path)
+        os.remove(part_path)
+    else:
+        os.replace(part_path, path)
+
+    write_file({'updated_at': updated_at, 'file': file_name}, meta_path)
+
+    # Only reindexes the card store if the downloaded file changed
+    carddb.build(file_name)
+    return True
 
-    file_name = 'scryfall_data.json'
-    path = f'{os.path.dirname(__file__)}\{file_name}'
-    with open(path, 'wb') as file:
-            file.write(bulk_data_response.content)
 
+def report_unresolved(kind, names, strict):
+    """Print (or raise on) names that don't match any saved player/deck"""
+    if not names:
+        return
+    message = f'Unresolved {kind}: {", ".join(sorted(set(names)))}'
+    if strict:
+        raise ValueError(message)
+    print(message)
 
-def load_game_database():
-    """Load players, decks, and games from saved json files"""
+
+def load_roster(strict=False):
+    """Load players and decks with each deck's owner replaced by its player object.
+    Decks whose owner isn't a saved player are reported and left out"""
 
     players = load_json_data('players.json', Player)
     decks = load_json_data('decks.json', Deck)
-    games = load_json_data('games.json', Game)
-
-    # replace text with deck objects for each game
-    for game in games:
-        game.winner = next((deck for deck in decks if f'{deck.commander} ({deck.owner})' == game.winner), None)
-        game.decks = [next((deck for deck in decks if f'{deck.commander} ({deck.owner})' == deck_name), None) 
-                      for deck_name in game.decks] 
 
     # replace owner with player object for each deck
+    players_by_name = {player.name: player for player in players}
+    linked_decks, unresolved = [], []
     for deck in decks:
-        deck.owner = next((player for player in players if player.name == deck.owner), None)
+        owner = players_by_name.get(deck.owner)
+        if owner is None:
+            unresolved.append(deck.owner)
+            continue
+        deck.owner = owner
         deck.owner.gold = 500
+        linked_decks.append(deck)
+    report_unresolved('deck owners', unresolved, strict)
+
+    return players, linked_decks
 
-    return players, decks, games
 
+def load_game_database(strict=False):
+    """Load players, decks, and games from the game database.
+    Games naming a deck that doesn't exist are reported and left out"""
 
-def calculate_stats(players, decks, games):
+    players, decks = load_roster(strict)
+    games = load_json_data('games.json', Game)
 
-    k_factor = 133
-    d_factor = 200
-    gold_ante = 25
+    # replace text with deck objects for each game
+    decks_by_key = {}
+    for deck in decks:
+        decks_by_key.setdefault(deck_key(deck), deck)
 
+    linked_games, unresolved = [], []
     for game in games:
+        missing = [name for name in game.decks + [game.winner] if name not in decks_by_key]
+        if missing:
+            unresolved.extend(missing)
+            continue
+        game.winner = decks_by_key[game.winner]
+        game.decks = [decks_by_key[deck_name] for deck_name in game.decks]
+        linked_games.append(game)
+    report_unresolved('decks in games', unresolved, strict)
+
+    return players, decks, linked_games
+
+
+def deck_key(deck):
+    """Name used to reference a deck in games, e.g. 'Commander (owner)'"""
+    owner = deck.owner if isinstance(deck.owner, str) else deck.owner.name
+    return f'{deck.commander} ({owner})'
+
+
+def apply_game(game, k_factor=K_FACTOR, d_factor=D_FACTOR, gold_ante=GOLD_ANTE):
+    """Update ratings, records and gold of every deck and owner in a linked game"""
+
+    winner_indx = game.decks.index(game.winner)
+    new_deck_ratings = elo(k_factor, d_factor, [deck.rating for deck in game.decks], winner_indx)
+    new_player_ratings = elo(k_factor, d_factor, [deck.owner.rating for deck in game.decks], winner_indx)
+
+    for indx, deck in enumerate(game.decks):
+        deck.rating = new_deck_ratings[indx]
+        deck.owner.rating = new_player_ratings[indx]
+        if indx == winner_indx:
+            deck.wins += 1
+            deck.owner.wins += 1
+            deck.owner.gold += gold_ante *3
+        else:
+            deck.losses += 1
+            deck.owner.losses += 1
+            deck.owner.gold -= gold_ante
 
-        winner_indx = game.decks.index(game.winner)
-        new_deck_ratings = elo(k_factor, d_factor, [deck.rating for deck in game.decks], winner_indx)
-        new_player_ratings = elo(k_factor, d_factor, [deck.owner.rating for deck in game.decks], winner_indx)
-
-        for indx, deck in enumerate(game.decks):
-            deck.rating = new_deck_ratings[indx]
-            deck.owner.rating = new_player_ratings[indx]
-            if indx == winner_indx:
-                deck.wins += 1
-                deck.owner.wins += 1
-                deck.owner.gold += gold_ante *3
-            else:
-                deck.losses += 1
-                deck.owner.losses += 1
-                deck.owner.gold -= gold_ante
+
+def calculate_stats(players, decks, games, k_factor=K_FACTOR, d_factor=D_FACTOR, gold_ante=GOLD_ANTE):
+    """Replay every game from scratch and print the standings"""
+
+    for game in games:
+        apply_game(game, k_factor, d_factor, gold_ante)
+
+    print_standings(players, decks)
+
+
+def print_standings(players, decks):
 
     # deck ratings
     active_decks = [x for x in decks if x.wins + x.losses > 0]
@@ -280,31 +475,112 @@ def deck_stats(deck):
     return average_cmc, edhrec_score, mana_symbols
 
 
-def process_decklists(decklists_directory='decklists', card_database='scryfall_data.json'):
-    """Get moxfield decklists from directory and return card objects"""
+def decklist_files(decklists_directory):
+    """Decklist file names in a directory, skipping folders and hidden files"""
+    return sorted(x for x in os.listdir(decklists_directory)
+                  if not x.startswith('.') and os.path.isfile(os.path.join(decklists_directory, x)))
+
+
+def read_decklist(file_path):
+    """(quantity, card name) of every main deck line in a text decklist export"""
+    # imported here, it loads numpy and the bot only needs it for decklists
+    import cardnames
+    entries = []
+    with open(file_path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip() == 'SIDEBOARD:':
+                break
+            entry = cardnames.parse_line(line)
+            if entry is not None:
+                entries.append(entry)
+    return entries
+
+
+def load_decklists(paths, card_database='scryfall_data.json'):
+    """Card objects (one per copy) of the main deck of every decklist file. The card names
+    of all files are resolved in one batch, the ones that match no card are left out and
+    listed with suggestions under 'unmatched'"""
+
+    import cardnames
+    # Open the indexed scryfall card store (built once from the bulk file)
+    cards = carddb.open_database(card_database, Card)
+    resolver = cardnames.get_resolver(card_database)
+
+    entries = [read_decklist(path) for path in paths]
+    found, missing = resolver.resolve(name for deck in entries for _, name in deck)
+    found = {name: cards[card_name] for name, card_name in found.items()}
+    decklists = []
+    for path, deck in zip(paths, entries):
+        decklist = {'name': os.path.basename(path), 'cards': [], 'unmatched': {}}
+        for qty, name in deck:
+            if name in found:
+                decklist['cards'] += [found[name]] * qty
+            else:
+                decklist['unmatched'][name] = missing[name]
+        if decklist['unmatched']:
+            print(f"{decklist['name']}:\n{cardnames.missing_text(decklist['unmatched'])}")
+        decklists.append(decklist)
+    return decklists
 
-    # Load scryfall card database
-    cards = load_json_data(card_database, Card)
 
-    decklists = []
-    for file_name in os.listdir(decklists_directory):
-        decklists.append({'name': file_name, 'cards': []})
-        file_path = os.path.join(decklists_directory, file_name)
-        with open(file_path) as f:
-            for line in f:
-                line = line.strip('\n')
-                if line == 'SIDEBOARD:':
-                    break
-                if line != '':
-                    split_line = line.strip().split(' ', 1)
-                    qty = split_line[0]
-                    card_name = split_line[1]
-                    card_object = next((card for card in cards if card.name == card_name), None)
-                    if card_object:
-                        for _ in range(int(qty)):
-                            decklists[-1]['cards'].append(card_object)
+def process_decklists(decklists_directory='decklists', card_database='scryfall_data.json'):
+    """Get moxfield decklists from directory and return card objects"""
+    return load_decklists([os.path.join(decklists_directory, x) for x in decklist_files(decklists_directory)],
+                          card_database)
+
+
+def decklist_stats(paths, card_database='scryfall_data.json'):
+    """Name, average cmc, edhrec score and pips of each decklist file (runs in pool workers)"""
+    # stats for every deck in one pass over the card feature matrix
+    import cardmatrix
+    decklists = load_decklists(paths, card_database)
+    return [{key: deck[key] for key in STATS_KEYS}
+            for deck in cardmatrix.batch_deck_stats(decklists, cardmatrix.load_matrix(card_database))]
+
+
+def build_deck_stats(decklists_directory='decklists', path='stats.json', card_database='scryfall_data.json',
+                     processes=None):
+    """Write name, average cmc, edhrec score and pips of every downloaded decklist to path.
+    Stats are cached per file by content hash in the database, so only decklists that were
+    added or changed since the last run are read and only their cache rows are written.
+    Many changed files are split across a process pool"""
+
+    from hashlib import blake2b
+    from multiprocessing import Pool
+
+    # the cache is only good for the card data it was computed from
+    carddb.build(card_database)
+    source = {'cards': carddb.store_stamp(card_database), 'version': STATS_VERSION}
+    current = storage.get_meta(storage.DECK_STATS_KEY) == source
+    files = storage.deck_stats() if current else {}
+
+    hashes = {}
+    for file_name in decklist_files(decklists_directory):
+        with open(os.path.join(decklists_directory, file_name), 'rb') as f:
+            hashes[file_name] = blake2b(f.read(), digest_size=16).hexdigest()
+    changed = [os.path.join(decklists_directory, x) for x, digest in hashes.items()
+               if files.get(x, (None,))[0] != digest]
+    removed = [x for x in files if x not in hashes]
+
+    if not changed and not removed and os.path.exists(path):
+        return [files[x][1] for x in hashes]
+
+    if len(changed) < PARALLEL_FILES:
+        results = decklist_stats(changed, card_database)
+    else:
+        processes = min(processes or os.cpu_count(), len(changed) // PARALLEL_FILES + 1)
+        chunks = [changed[i::processes] for i in range(processes)]
+        with Pool(processes) as pool:
+            results = [x for chunk in pool.starmap(decklist_stats, [(x, card_database) for x in chunks])
+                       for x in chunk]
 
-    return decklists
+    updated = {stats['name']: (hashes[stats['name']], stats) for stats in results}
+    storage.update_deck_stats(updated, removed, None if current else source)
+    files.update(updated)
+    stats = [files[x][1] for x in hashes]
+    # a json list can't be patched in place, it's only rewritten when a decklist changed
+    write_file(stats, path)
+    return stats
 
 
 if __name__=='__main__':
@@ -315,15 +591,7 @@ if __name__=='__main__':
     # calculate_stats(players, decks, games)
    
 
-    stats = []
-    for deck in process_decklists():
-        cmc, edh_score, pips = deck_stats(deck['cards'])
-        stats.append({'name': deck['name'],
-                      'average_cmc': cmc,
-                      'edh_score': edh_score,
-                      'pips': pips})
-        
-    write_file(stats, 'stats.json')
+    stats = build_deck_stats()
         
     list_of_pips = [x['pips'] for x in stats]
     result = [sum(values) for values in zip(*(x['pips'] for x in stats))]
@@ -0,0 +1,98 @@
+from datetime import date, timedelta
+import deckstats
+import storage
+
+
+# /history pages through games newest first, filtered by deck, player and a period of
+# time. Every page is one index range query (storage.game_history) continuing after the
+# last game of the page before it, so no page loads the whole game table.
+
+PAGE_SIZE = 10
+
+
+def date_range(period):
+    """(start, end) dates, end not included, of a period written as 2024, 2024-03,
+    2024-03-15 or two of those joined by .. (2024-01..2024-03). (None, None) for no period"""
+    if not period or not period.strip():
+        return None, None
+    first, _, last = period.strip().partition('..')
+    return _bounds(first.strip())[0], _bounds((last or first).strip())[1]
+
+
+def _bounds(text):
+    parts = text.split('-')
+    try:
+        numbers = [int(x) for x in parts]
+        if len(numbers) == 1:
+            return date(numbers[0], 1, 1).isoformat(), date(numbers[0] + 1, 1, 1).isoformat()
+        if len(numbers) == 2:
+            year, month = numbers
+            following = date(year + month // 12, month % 12 + 1, 1)
+            return date(year, month, 1).isoformat(), following.isoformat()
+        if len(numbers) == 3:
+            day = date(*numbers)
+            return day.isoformat(), (day + timedelta(days=1)).isoformat()
+    except ValueError:
+        pass
+    raise ValueError(f'Not a year, month or day: {text}')
+
+
+class Pages:
+    """Pages of games matching some filters, remembering where each page seen so far starts"""
+
+    def __init__(self, deck=None, player=None, period=None, size=PAGE_SIZE):
+        start, end = date_range(period)
+        self.filters = {'deck': deck, 'player': player, 'start': start, 'end': end}
+        self.size = size
+        self.total = storage.count_games(**self.filters)
+        self.starts = [None]    # cursor each page continues from, the last one is the current page
+        self.games = storage.game_history(**self.filters, limit=self.size)
+
+    @property
+    def number(self):
+        return len(self.starts) - 1
+
+    def has_older(self):
+        return (self.number + 1) * self.size < self.total
+
+    def older(self):
+        last = self.games[-1]
+        self.starts.append((last['date'], last['id']))
+        self.games = storage.game_history(**self.filters, before=self.starts[-1], limit=self.size)
+
+    def newer(self):
+        if len(self.starts) > 1:
+            self.starts.pop()
+        self.games = storage.game_history(**self.filters, before=self.starts[-1], limit=self.size)
+
+    def text(self):
+        if not self.games:
+            return 'No games found'
+        first = self.number * self.size
+        lines = [f'Games {first + 1}-{first + len(self.games)} of {self.total}, newest first']
+        lines += [f"`{game['date']}` {deckstats.Game(**game)}" for game in self.games]
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    print('***Testing***')
+    if len(sys.argv) > 1:
+        storage.DB_PATH = sys.argv[1]
+
+    for period in ['2024', '2024-12', '2024-02-29', '2023-11..2024-02', '']:
+        print(repr(period), date_range(period))
+
+    deck = storage.game_history(limit=1)[0]['decks'][0]
+    start = time.perf_counter()
+    pages = Pages(deck=deck)
+    while pages.has_older():
+        pages.older()
+    print(f'{pages.number + 1} pages of {deck} in {(time.perf_counter() - start) * 1000:.1f} ms')
+    print(pages.text())
+
+    start = time.perf_counter()
+    pages = Pages(player=storage.deck_owner(deck), period='2023-03')
+    print(f'first page of a month of a player in {(time.perf_counter() - start) * 1000:.1f} ms')
+    print(pages.text())
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# Responses are kept on disk as <key>.body plus <key>.json holding the url, validators,
+# fetch time and any values extracted from the body. Entries are reused without a request
+# while younger than the ttl, then revalidated with ETag/Last-Modified. The least recently
+# used entries are dropped once the directory grows past max_bytes
+CACHE_DIR = os.environ.get('HOR_HTTP_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'http_cache'))
+DEFAULT_TTL = 24 * 60 * 60
+MAX_BYTES = 50 * 1024 * 1024
+
+_lock = threading.Lock()
+_sizes = None       # key -> bytes on disk, filled on first store
+counters = {'fresh': 0, 'revalidated': 0, 'miss': 0, 'extract_hit': 0, 'extract_miss': 0}
+
+
+def configure(directory=None, ttl=None, max_bytes=None):
+    """Change the cache directory, default ttl (seconds) or size cap"""
+    global CACHE_DIR, DEFAULT_TTL, MAX_BYTES, _sizes
+    if directory is not None:
+        CACHE_DIR = directory
+        _sizes = None
+    if ttl is not None:
+        DEFAULT_TTL = ttl
+    if max_bytes is not None:
+        MAX_BYTES = max_bytes
+
+
+class Response:
+    def __init__(self, url, status_code, content, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def _paths(key):
+    base = os.path.join(CACHE_DIR, key)
+    return base + '.json', base + '.body'
+
+
+def _write_atomic(path, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_meta(url):
+    meta_path, _ = _paths(_key(url))
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('url') == url else None
+
+
+def _write_meta(meta):
+    meta_path, _ = _paths(_key(meta['url']))
+    _write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+
+def _read_body(url):
+    _, body_path = _paths(_key(url))
+    with open(body_path, 'rb') as f:
+        body = f.read()
+    # touch the entry so LRU eviction sees it was used
+    os.utime(body_path)
+    return body
+
+
+def is_fresh(meta, ttl=None):
+    return time.time() - meta['fetched_at'] < (DEFAULT_TTL if ttl is None else ttl)
+
+
+def lookup(url, ttl=None):
+    """Return (meta, fresh) for a cached url, or (None, False)"""
+    meta = _read_meta(url)
+    if meta is None or not os.path.exists(_paths(_key(url))[1]):
+        return None, False
+    return meta, is_fresh(meta, ttl)
+
+
+def conditional_headers(meta):
+    headers = {}
+    if meta and meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta and meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+
+def cached_response(meta, revalidated=False):
+    """Serve a cached entry, a revalidated one also gets a new fetch time"""
+    counters['revalidated' if revalidated else 'fresh'] += 1
+    if revalidated:
+        meta['fetched_at'] = time.time()
+        _write_meta(meta)
+    return Response(meta['url'], meta['status'], _read_body(meta['url']), from_cache=True)
+
+
+def store(url, status, headers, body: bytes):
+    """Save a 2xx response, dropping values extracted from any previous body"""
+    counters['miss'] += 1
+    if status // 100 != 2:
+        return Response(url, status, body)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    key = _key(url)
+    meta_path, body_path = _paths(key)
+    _write_atomic(body_path, body)
+    meta = {'url': url, 'status': status, 'fetched_at': time.time(),
+            'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'),
+            'extracted': {}}
+    _write_meta(meta)
+    _account(key, len(body))
+    return Response(url, status, body)
+
+
+def get(url, headers=None, ttl=None, session=None):
+    """requests.get through the cache"""
+    meta, fresh = lookup(url, ttl)
+    if fresh:
+        return cached_response(meta)
+
+    if session is None:
+        # requests is slow to import, only load it once something isn't cached
+        import requests
+        session = requests
+
+    response = session.get(url, headers={**(headers or {}), **conditional_headers(meta)})
+    if response.status_code == 304 and meta:
+        return cached_response(meta, revalidated=True)
+    return store(url, response.status_code, response.headers, response.content)
+
+
+def extracted(url, name, ttl=None):
+    """Return a value previously extracted from a fresh cached body, or None"""
+    meta, fresh = lookup(url, ttl)
+    value = meta['extracted'].get(name) if meta and fresh else None
+    counters['extract_miss' if value is None else 'extract_hit'] += 1
+    return value
+
+
+def set_extracted(url, name, value):
+    """Remember a value extracted from the cached body of url"""
+    meta = _read_meta(url)
+    if meta is not None:
+        meta['extracted'][name] = value
+        _write_meta(meta)
+
+
+def _account(key, size):
+    """Track bytes per entry and evict least recently used entries past MAX_BYTES"""
+    global _sizes
+    with _lock:
+        if _sizes is None:
+            _sizes = {}
+            for file_name in os.listdir(CACHE_DIR):
+                if file_name.endswith('.body'):
+                    _sizes[file_name[:-5]] = os.path.getsize(os.path.join(CACHE_DIR, file_name))
+        _sizes[key] = size
+        if sum(_sizes.values()) <= MAX_BYTES:
+            return
+
+        by_use = sorted(_sizes, key=lambda k: os.path.getmtime(_paths(k)[1]) if os.path.exists(_paths(k)[1]) else 0)
+        total = sum(_sizes.values())
+        for old_key in by_use:
+            if total <= MAX_BYTES * 0.9 or old_key == key:
+                continue
+            for path in _paths(old_key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= _sizes.pop(old_key)
+
+
+def stats():
+    """Counters plus hit rates for responses and extracted values"""
+    requests_total = counters['fresh'] + counters['revalidated'] + counters['miss']
+    extracts_total = counters['extract_hit'] + counters['extract_miss']
+    return {**counters,
+            'hit_rate': round((counters['fresh'] + counters['revalidated']) / requests_total, 3) if requests_total else 0,
+            'extract_hit_rate': round(counters['extract_hit'] / extracts_total, 3) if extracts_total else 0}
@@ -0,0 +1,120 @@
+import asyncio
+import random
+import aiohttp
+import deckstats
+import httpcache
+
+
+# retry these statuses, anything else that isn't 2xx fails right away
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# longest Retry-After honoured, a server asking for more can't hold up the whole batch
+MAX_RETRY_AFTER = 60
+
+
+class FetchError(Exception):
+    """A page that couldn't be read. transient errors (timeouts, 429 and 5xx after the last
+    retry) may work later, anything else won't"""
+
+    def __init__(self, message, transient=False):
+        super().__init__(message)
+        self.transient = transient
+
+
+async def fetch_page(session, link, retries=3, backoff=0.5):
+    """GET a page through the http cache, retrying connection errors and 429/5xx
+    responses with exponential backoff. Cache reads and writes are disk I/O and run in
+    worker threads"""
+
+    meta, fresh = await asyncio.to_thread(httpcache.lookup, link)
+    if fresh:
+        return (await asyncio.to_thread(httpcache.cached_response, meta)).content
+    headers = {**deckstats.DECK_PAGE_HEADERS, **httpcache.conditional_headers(meta)}
+
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(link, headers=headers) as response:
+                if response.status == 304 and meta:
+                    return (await asyncio.to_thread(httpcache.cached_response, meta, revalidated=True)).content
+                if response.status // 100 == 2:
+                    body = await response.read()
+                    await asyncio.to_thread(httpcache.store, link, response.status, response.headers, body)
+                    return body
+                if response.status not in RETRY_STATUSES:
+                    raise FetchError(f'HTTP {response.status}')
+                error = FetchError(f'HTTP {response.status}', transient=True)
+                retry_after = response.headers.get('Retry-After', '')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = FetchError(f'{type(e).__name__}: {e}', transient=True)
+            retry_after = ''
+
+        if attempt == retries:
+            raise error
+        delay = min(float(retry_after), MAX_RETRY_AFTER) if retry_after.isdigit() else backoff * 2 ** attempt
+        await asyncio.sleep(delay + random.uniform(0, backoff))
+
+
+async def fetch_commander(session, link, site, **retry_args):
+    commander = await asyncio.to_thread(httpcache.extracted, link, 'commander')
+    if commander is not None:
+        return commander
+
+    html = await fetch_page(session, link, **retry_args)
+    # BeautifulSoup parsing is cpu bound, keep it off the event loop
+    commander = await asyncio.to_thread(deckstats.parse_commander_name, site, html)
+    if not commander:
+        raise FetchError('commander not found on page')
+    await asyncio.to_thread(httpcache.set_extracted, link, 'commander', commander)
+    return commander
+
+
+async def fetch_commanders(links, sites=deckstats.DECK_SITES, per_host=4, timeout=20, progress=None, **retry_args):
+    """Look up the commander of every decklist link concurrently.
+    At most per_host requests run against one host at a time, progress is awaited with
+    (links done, total) after each one. Returns two dicts: link -> commander name for the
+    links that worked, link -> error message for the rest, and the set of failed links
+    worth trying again later (see FetchError.transient)"""
+
+    found, failed, transient = {}, {}, set()
+    supported = {}
+    for link in dict.fromkeys(links):
+        site = deckstats.deck_site(link, sites)
+        if site is None:
+            failed[link] = 'unsupported site'
+        else:
+            supported[link] = site
+
+    total = len(supported) + len(failed)
+
+    async def worker(session, link, site):
+        try:
+            found[link] = await fetch_commander(session, link, site, **retry_args)
+        except Exception as e:
+            failed[link] = str(e) or type(e).__name__
+            if getattr(e, 'transient', False):
+                transient.add(link)
+        if progress is not None:
+            await progress(len(found) + len(failed), total)
+
+    connector = aiohttp.TCPConnector(limit_per_host=per_host)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        await asyncio.gather(*(worker(session, link, site) for link, site in supported.items()))
+
+    return found, failed, transient
+
+
+async def new_decks(posts, known_links, **kwargs):
+    """Takes (link, owner) pairs and returns Deck objects for the links not already known,
+    along with a dict of links that couldn't be read and the (link, owner) pairs of the
+    ones worth trying again"""
+
+    owners = {}
+    for link, owner in posts:
+        if link not in known_links:
+            owners.setdefault(link, owner)
+
+    found, failed, transient = await fetch_commanders(owners, **kwargs)
+    decks = [deckstats.Deck(owner=owner, commander=found[link], decklist=link)
+             for link, owner in owners.items() if link in found]
+    retry = [(link, owner) for link, owner in owners.items() if link in transient]
+    return decks, failed, retry
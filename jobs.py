@@ -0,0 +1,99 @@
+import asyncio
+import functools
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import discord
+import metrics
+
+
+# Long running commands hand their work to start() as a background job and return right
+# after deferring, so the interaction is answered in time and the event loop stays free
+# for everyone else. A job runs blocking I/O on a thread pool and CPU heavy work on a
+# process pool, and shows its progress by editing the deferred response. Only one job of
+# each kind runs at a time.
+
+THREADS = 4
+PROCESSES = 2
+PROGRESS_INTERVAL = 2   # seconds between progress edits, discord rate limits message edits
+
+_threads = None
+_processes = None
+_running = {}           # kind -> Job
+
+
+class Job:
+    def __init__(self, kind, interaction=None):
+        self.kind = kind
+        self.interaction = interaction
+        self.user = interaction.user.name if interaction is not None else None
+        self.started = time.monotonic()
+        self.status = 'Starting'
+        self.task = None
+        self.last_edit = 0
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    async def progress(self, status, force=False):
+        """Show status on the deferred response, at most once every PROGRESS_INTERVAL seconds"""
+        self.status = status
+        now = time.monotonic()
+        if self.interaction is None or (not force and now - self.last_edit < PROGRESS_INTERVAL):
+            return
+        self.last_edit = now
+        try:
+            await self.interaction.edit_original_response(content=status)
+        except discord.HTTPException as e:
+            # interaction tokens expire after 15 minutes, the job itself carries on
+            print(f'{self.kind}: could not show progress: {e}')
+
+    async def run_in_thread(self, func, *args, **kwargs):
+        """Run blocking func on the job thread pool"""
+        global _threads
+        if _threads is None:
+            _threads = ThreadPoolExecutor(THREADS, thread_name_prefix='job')
+        return await asyncio.get_running_loop().run_in_executor(_threads, functools.partial(func, *args, **kwargs))
+
+    async def run_in_process(self, func, *args, **kwargs):
+        """Run CPU heavy func on the job process pool, func and its arguments have to pickle"""
+        global _processes
+        if _processes is None:
+            _processes = ProcessPoolExecutor(PROCESSES)
+        return await asyncio.get_running_loop().run_in_executor(_processes, functools.partial(func, *args, **kwargs))
+
+
+def running(kind):
+    """The job of a kind that is running, None if there is none"""
+    return _running.get(kind)
+
+
+def start(kind, work, interaction=None):
+    """Run the coroutine function work(job) in the background unless a job of the same
+    kind is already running. The text work returns replaces the progress message.
+    Returns the new Job, or None if the kind is busy"""
+    if kind in _running:
+        return None
+    job = _running[kind] = Job(kind, interaction)
+    job.task = asyncio.create_task(_run(job, work), name=f'job-{kind}')
+    return job
+
+
+async def _run(job, work):
+    try:
+        result = await work(job)
+        await job.progress(result or 'Done', force=True)
+    except Exception as e:
+        traceback.print_exc()
+        metrics.increment(metrics.errors, f'job.{job.kind}')
+        await job.progress(f'Failed: {e}', force=True)
+    finally:
+        del _running[job.kind]
+        metrics.observe(metrics.latency, f'job.{job.kind}', job.elapsed())
+
+
+async def busy_message(interaction, kind):
+    """Tell the user a job of this kind is already running"""
+    job = running(kind)
+    await interaction.edit_original_response(
+        content=f'Already running for {job.user} ({job.elapsed():.0f}s): {job.status}')
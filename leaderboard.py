@@ -0,0 +1,262 @@
+from array import array
+import numpy as np
+import deckstats
+
+
+# Standings kept up to date one game at a time by the rating engine (ratings.py):
+# win/loss streaks and head to head records for decks and players.
+# Head to head is a sparse count matrix per kind: for every pair (i, j) that shared a pod,
+# the games i won with j in it and the games they played together. Pairs are int64 keys
+# (i << 32 | j) in a sorted array with the counts in matching arrays, new pairs are
+# appended to a pending buffer and merged in once it's as big as the merged part.
+
+KINDS = ('decks', 'players')
+SORTS = ('rating', 'wins', 'win_rate', 'games', 'streak', 'best_streak', 'gold')
+COMPACT_AT = 4096
+
+
+class Table:
+    """Records, streaks and head to head counts of one kind (decks or players), rows by name"""
+
+    def __init__(self, names=(), wins=(), games=(), streak=(), best_streak=(), pairs=((), (), ())):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        size = max(len(self.names), 16)
+        n = len(self.names)
+        self.wins = np.zeros(size, dtype=np.int32)
+        self.games = np.zeros(size, dtype=np.int32)
+        self.streak = np.zeros(size, dtype=np.int32)         # > 0 wins in a row, < 0 losses in a row
+        self.best_streak = np.zeros(size, dtype=np.int32)
+        if n:
+            self.wins[:n] = wins
+            self.games[:n] = games
+            self.streak[:n] = streak
+            self.best_streak[:n] = best_streak
+
+        keys, pair_wins, pair_games = pairs
+        self.keys = np.array(keys, dtype=np.int64)
+        self.pair_wins = np.array(pair_wins, dtype=np.int32)
+        self.pair_games = np.array(pair_games, dtype=np.int32)
+        self.pending_keys = array('q')
+        self.pending_won = array('b')
+
+    def row(self, name):
+        """Row of a name, adding it (and growing the arrays) if it's new"""
+        indx = self.index.get(name)
+        if indx is not None:
+            return indx
+        indx = len(self.names)
+        if indx == len(self.streak):
+            for attr in ('wins', 'games', 'streak', 'best_streak'):
+                setattr(self, attr, np.concatenate([getattr(self, attr), np.zeros(indx, dtype=np.int32)]))
+        self.names.append(name)
+        self.index[name] = indx
+        return indx
+
+    def record(self, names, winner):
+        """Count one game between names (no repeats) won by winner"""
+        pod = [self.row(name) for name in names]
+        won = self.index[winner]
+        for indx in pod:
+            self.games[indx] += 1
+            if indx == won:
+                self.wins[indx] += 1
+                self.streak[indx] = self.streak[indx] + 1 if self.streak[indx] > 0 else 1
+                self.best_streak[indx] = max(self.best_streak[indx], self.streak[indx])
+            else:
+                self.streak[indx] = self.streak[indx] - 1 if self.streak[indx] < 0 else -1
+            for other in pod:
+                if other != indx:
+                    self.pending_keys.append(indx << 32 | other)
+                    self.pending_won.append(indx == won)
+        if len(self.pending_keys) >= max(COMPACT_AT, len(self.keys)):
+            self.compact()
+
+    def compact(self):
+        """Merge the pending pairs into the sorted arrays"""
+        if not self.pending_keys:
+            return
+        keys = np.concatenate([self.keys, np.frombuffer(self.pending_keys, dtype=np.int64)])
+        wins = np.concatenate([self.pair_wins, np.frombuffer(self.pending_won, dtype=np.int8)])
+        games = np.concatenate([self.pair_games, np.ones(len(self.pending_keys), dtype=np.int32)])
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.pair_wins = np.bincount(inverse, weights=wins, minlength=len(self.keys)).astype(np.int32)
+        self.pair_games = np.bincount(inverse, weights=games, minlength=len(self.keys)).astype(np.int32)
+        self.pending_keys, self.pending_won = array('q'), array('b')
+
+    def pair(self, first, second):
+        """(games first won with second in the pod, games together) for two rows"""
+        key = first << 32 | second
+        pos = np.searchsorted(self.keys, key)
+        wins = games = 0
+        if pos < len(self.keys) and self.keys[pos] == key:
+            wins, games = int(self.pair_wins[pos]), int(self.pair_games[pos])
+        if self.pending_keys:
+            match = np.frombuffer(self.pending_keys, dtype=np.int64) == key
+            wins += int(np.frombuffer(self.pending_won, dtype=np.int8)[match].sum())
+            games += int(match.sum())
+        return wins, games
+
+    def head_to_head(self, first, second):
+        """(first's wins, second's wins, games together) for two names"""
+        a, b = self.index.get(first), self.index.get(second)
+        if a is None or b is None:
+            return 0, 0, 0
+        first_wins, games = self.pair(a, b)
+        return first_wins, self.pair(b, a)[0], games
+
+    def opponents(self, name):
+        """(opponent, their wins, name's wins, games together) for everyone name has played"""
+        indx = self.index.get(name)
+        if indx is None:
+            return []
+        lo, hi = np.searchsorted(self.keys, [indx << 32, (indx + 1) << 32])
+        others = {int(key) & 0xFFFFFFFF for key in self.keys[lo:hi]}
+        others.update(key & 0xFFFFFFFF for key in self.pending_keys if key >> 32 == indx)
+        result = []
+        for other in sorted(others):
+            own, games = self.pair(indx, other)
+            result.append((self.names[other], self.pair(other, indx)[0], own, games))
+        return result
+
+    def state(self):
+        self.compact()
+        n = len(self.names)
+        return {'names': self.names,
+                'wins': self.wins[:n].tolist(),
+                'games': self.games[:n].tolist(),
+                'streak': self.streak[:n].tolist(),
+                'best_streak': self.best_streak[:n].tolist(),
+                'pairs': [self.keys.tolist(), self.pair_wins.tolist(), self.pair_games.tolist()]}
+
+
+class Leaderboard:
+    """Streaks and head to head for decks and players, plus sorted leaderboards that are
+    built once and reused until the next game"""
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.tables = {kind: Table(**state.get(kind, {})) for kind in KINDS}
+        self.views = {}
+
+    def apply(self, game):
+        """Count a linked game (Deck objects with Player owners)"""
+        self.tables['decks'].record([deckstats.deck_key(x) for x in game.decks], deckstats.deck_key(game.winner))
+        # a player with two decks in the pod still only played one game
+        owners = list(dict.fromkeys(x.owner.name for x in game.decks))
+        self.tables['players'].record(owners, game.winner.owner.name)
+        self.views.clear()
+
+    def rows(self, kind, entities):
+        """Stats of every deck/player with at least one game, entities maps name -> Deck/Player"""
+        table = self.tables[kind]
+        rows = []
+        for name, indx in table.index.items():
+            games = int(table.games[indx])
+            if not games or name not in entities:
+                continue
+            wins = int(table.wins[indx])
+            rows.append({'name': name,
+                         'rating': entities[name].rating,
+                         'gold': getattr(entities[name], 'gold', None),
+                         'wins': wins,
+                         'losses': games - wins,
+                         'games': games,
+                         'win_rate': round(wins / games, 3),
+                         'streak': int(table.streak[indx]),
+                         'best_streak': int(table.best_streak[indx])})
+        return rows
+
+    def board(self, kind, entities, sort='rating'):
+        """Rows sorted by a stat, best first"""
+        if kind not in KINDS or sort not in SORTS:
+            raise ValueError(f'Unknown leaderboard: {kind} by {sort}')
+        view = self.views.get((kind, sort))
+        if view is None:
+            view = self.rows(kind, entities)
+            view.sort(key=lambda x: (x[sort] if x[sort] is not None else float('-inf'), x['rating']), reverse=True)
+            self.views[(kind, sort)] = view
+        return view
+
+    def state(self):
+        return {kind: table.state() for kind, table in self.tables.items()}
+
+
+def find(names, query):
+    """Name matching query exactly, or the only one containing it (case insensitive)"""
+    if query in names:
+        return query
+    query = query.lower()
+    matches = [name for name in names if query in name.lower()]
+    exact = [name for name in matches if name.lower() == query]
+    if exact or len(matches) == 1:
+        return (exact or matches)[0]
+    return None
+
+
+def streak_text(streak):
+    return f'W{streak}' if streak > 0 else f'L{-streak}' if streak < 0 else '-'
+
+
+def board_text(rows, sort='rating', limit=10):
+    """Leaderboard formatted as a code block for a discord message"""
+    if not rows:
+        return 'No games recorded yet'
+    lines = [f"{'#':>3} {'Rating':>6} {'W-L':>7} {'Win%':>5} {'Strk':>4}  Name"]
+    for rank, row in enumerate(rows[:limit]):
+        gold = f" ({row['gold']} gold)" if sort == 'gold' else ''
+        lines.append(f"{rank + 1:>3} {row['rating']:>6} {row['wins']:>3}-{row['losses']:<3} "
+                     f"{row['win_rate']:>5.0%} {streak_text(row['streak']):>4}  {row['name']}{gold}")
+    return '```\n' + '\n'.join(lines) + '\n```'
+
+
+def stats_text(row, opponents, limit=5):
+    """One deck's/player's stats and its most played opponents"""
+    lines = [f"**{row['name']}**",
+             f"Rating {row['rating']}  |  {row['wins']}-{row['losses']} ({row['win_rate']:.0%})  |  "
+             f"streak {streak_text(row['streak'])}, best W{row['best_streak']}"]
+    if row['gold'] is not None:
+        lines[-1] += f"  |  {row['gold']} gold"
+    opponents = sorted(opponents, key=lambda x: x[3], reverse=True)[:limit]
+    if opponents:
+        lines.append('Most played against:')
+        lines += [f'  {name}: {games} games, {own} won / {theirs} lost to them'
+                  for name, theirs, own, games in opponents]
+    return '\n'.join(lines)
+
+
+def h2h_text(first, second, record):
+    first_wins, second_wins, games = record
+    if not games:
+        return f'{first} and {second} have not played each other yet'
+    return (f'**{first}** vs **{second}**: {games} games together\n'
+            f'{first} won {first_wins}, {second} won {second_wins}, '
+            f'someone else won {games - first_wins - second_wins}')
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    print('***Testing***')
+    rng = random.Random(0)
+    players = [deckstats.Player(f'player{i}') for i in range(12)]
+    decks = [deckstats.Deck(rng.choice(players), f'Commander {i}') for i in range(300)]
+    board = Leaderboard()
+
+    start = time.perf_counter()
+    for _ in range(10000):
+        pod = rng.sample(decks, 4)
+        board.apply(deckstats.Game('01-01-2023', rng.choice(pod), pod))
+    print(f'{(time.perf_counter() - start) * 100:.1f} us per game')
+
+    entities = {deckstats.deck_key(x): x for x in decks}
+    start = time.perf_counter()
+    rows = board.board('decks', entities, 'win_rate')
+    print(f'{(time.perf_counter() - start) * 1000:.2f} ms to build a leaderboard, ', end='')
+    start = time.perf_counter()
+    board.board('decks', entities, 'win_rate')
+    print(f'{(time.perf_counter() - start) * 1e6:.1f} us from the view')
+    print(board_text(rows, 'win_rate', 5))
+
+    restored = Leaderboard(board.state())
+    print('state round trip:', restored.state() == board.state())
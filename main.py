@@ -1,8 +1,63 @@
+import boottime    # first, see boottime.STARTED
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Literal
 import discord
 from discord import app_commands
+import autocomplete
+import cardsearch
 import config
 import deckstats
-import re
+import history
+import httpcache
+import ingest
+import jobs
+import leaderboard
+import matchmaker
+import metrics
+import ratings
+import storage
+from cache import cache
+
+
+# last #decklists message processed by pull_decks, edited messages before it
+# and links that failed for a reason that may go away (timeouts, 429, 5xx)
+CHECKPOINT_KEY = 'decklists_checkpoint'
+EDITED_KEY = 'decklists_edited'
+RETRY_KEY = 'decklists_retry'
+# pods shown per /random message, re-roll pages through the next best ones
+PODS_PER_PAGE = 3
+POD_PAGES = 5
+# guild id -> hash of the commands last synced to it, see tree_hash
+COMMANDS_KEY = 'synced_commands'
+
+# seconds since STARTED at each step of starting up: imports, run, login, sync, ready
+STARTED = boottime.STARTED
+startup = {'imports': time.perf_counter() - STARTED}
+
+
+httpcache.configure(directory=getattr(config, 'http_cache_dir', None))
+
+
+def tree_hash(tree, guild):
+    """Hash of the command payload a sync would send to guild"""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+                     key=lambda x: (x.get('type', 1), x['name']))
+    text = json.dumps([tree.client.application_id, payload], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def startup_text():
+    """Time each step of starting up took"""
+    if 'ready' not in startup:
+        return 'Still starting up'
+    return (f"Started in {startup['ready']:.2f}s: imports {startup['imports']:.2f}s, "
+            f"login {startup['login'] - startup.get('run', startup['imports']):.2f}s, "
+            f"command sync {startup['sync'] - startup['login']:.2f}s ({len(startup['synced'])} guild(s) synced), "
+            f"ready {startup['ready'] - startup['sync']:.2f}s")
 
 
 # ---------- CLASS DEFINITIONS ---------------
@@ -17,168 +72,253 @@ class MyClient(discord.Client):
 
     async def on_ready(self):
         print(f'Logged in as {self.user} (ID: {self.user.id})')
+        # on_ready fires again after reconnects, only the first one is part of starting up
+        if 'ready' not in startup:
+            startup['ready'] = time.perf_counter() - STARTED
+            print(startup_text())
+
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        # Remember edited posts that are older than the checkpoint so the next pull rereads them
+        if payload.channel_id != config.decklist_channel:
+            return
+        checkpoint = await asyncio.to_thread(storage.get_meta, CHECKPOINT_KEY)
+        if checkpoint and payload.message_id <= checkpoint['message_id']:
+            edited = await asyncio.to_thread(storage.get_meta, EDITED_KEY, [])
+            if payload.message_id not in edited:
+                await asyncio.to_thread(storage.set_meta, EDITED_KEY, edited + [payload.message_id])
 
     async def setup_hook(self) -> None:
-        # Sync the application command with Discord.
+        startup['login'] = time.perf_counter() - STARTED
+        # Sync the application commands with Discord, syncing is rate limited so guilds
+        # that already have the current commands are skipped (force_sync in config.py
+        # syncs anyway)
+        synced = await asyncio.to_thread(storage.get_meta, COMMANDS_KEY, {})
+        startup['synced'] = []
         SERVER_ID = discord.Object(id=config.guild_id)
-        self.tree.copy_global_to(guild=SERVER_ID)
-        await self.tree.sync(guild=SERVER_ID)
         # Private server for testing
         TEST_SERVER = discord.Object(id=config.test_guild)
-        self.tree.copy_global_to(guild=TEST_SERVER)
-        await self.tree.sync(guild=TEST_SERVER)
-
-  
-class PlayerSelect(discord.ui.Select):
-    def __init__(self, parent_view, min_selections):
-        options = [discord.SelectOption(label=player) for player in set([x.owner for x in parent_view.decks])]
-        super().__init__(placeholder='Select players', options=options, min_values=min_selections, max_values=4)
-        self.parent_view = parent_view
-
-    async def callback(self, interaction: discord.Interaction):
-        await self.parent_view.process_selection(interaction)
-
-
-class DeckSelect(discord.ui.Select):
-    def __init__(self, player, parent_view):
-        player_decks = [x for x in parent_view.decks if x.owner == player]
-        # options = [discord.SelectOption(label=f'{deck.commander} ({deck.owner})') for deck in player_decks]
-        options = [discord.SelectOption(label=deck.commander) for deck in player_decks]
-        super().__init__(placeholder=f"Select a {player} deck", options=options, min_values=1, max_values=1)
-        self.parent_view = parent_view
-
-    async def callback(self, interaction: discord.Interaction):
-        # check to see if we have a selection for each player
-        if all([x.values for x in self.parent_view.deck_select]):
-            await self.parent_view.pick_winner(interaction)
-        else:
-            await interaction.response.defer()
-        
-
-class WinnerSelect(discord.ui.Select):
-    def __init__(self, parent_view):
-        self.parent_view = parent_view
-        options = [discord.SelectOption(label=x) for x in self.parent_view.selected_decks]
-        super().__init__(placeholder='Select the winner', options=options)
-        
-    async def callback(self, interaction: discord.Interaction):
-        await self.parent_view.log_game(interaction)
+        for guild in (SERVER_ID, TEST_SERVER):
+            self.tree.copy_global_to(guild=guild)
+            digest = tree_hash(self.tree, guild)
+            if synced.get(str(guild.id)) != digest or getattr(config, 'force_sync', False):
+                await self.tree.sync(guild=guild)
+                synced[str(guild.id)] = digest
+                await asyncio.to_thread(storage.set_meta, COMMANDS_KEY, synced)
+                startup['synced'].append(guild.id)
+        startup['sync'] = time.perf_counter() - STARTED
 
 
-class RegisterGameView(discord.ui.View):
-    def __init__(self):
+class RandomView(discord.ui.View):
+    def __init__(self, pods):
+        super().__init__()
+        self.pods = pods
+        self.page = 0
+        if len(self.pods) > PODS_PER_PAGE:
+            reroll = discord.ui.Button(label='Re-roll', style=discord.ButtonStyle.secondary)
+            reroll.callback = self.reroll
+            self.add_item(reroll)
+
+    @metrics.timed('random.reroll')
+    async def reroll(self, interaction: discord.Interaction):
+        self.page = (self.page + 1) % -(-len(self.pods) // PODS_PER_PAGE)
+        await interaction.response.edit_message(content=self.page_text(), view=self)
+
+    def page_text(self):
+        if not self.pods:
+            return 'No decks found for the selected players'
+        start = self.page * PODS_PER_PAGE
+        return '\n'.join(f"{indx + 1}. {'  vs  '.join(deck.commander for deck in pod['decks'])}  (spread {pod['spread']:.0f})"
+                         for indx, pod in enumerate(self.pods[start:start + PODS_PER_PAGE], start))
+
+
+class HistoryView(discord.ui.View):
+    def __init__(self, pages):
         super().__init__()
-        self.decks = deckstats.load_json_data('decks.json',deckstats.Deck)
-        self.player_select = PlayerSelect(self, 4)
-        self.add_item(self.player_select)
+        self.pages = pages
+        self.newer_button = discord.ui.Button(label='Newer', style=discord.ButtonStyle.secondary)
+        self.newer_button.callback = self.newer
+        self.older_button = discord.ui.Button(label='Older', style=discord.ButtonStyle.secondary)
+        self.older_button.callback = self.older
+        self.add_item(self.newer_button)
+        self.add_item(self.older_button)
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.newer_button.disabled = self.pages.number == 0
+        self.older_button.disabled = not self.pages.has_older()
+
+    @metrics.timed('history.newer')
+    async def newer(self, interaction: discord.Interaction):
+        await asyncio.to_thread(self.pages.newer)
+        self.update_buttons()
+        await interaction.response.edit_message(content=self.pages.text(), view=self)
+
+    @metrics.timed('history.older')
+    async def older(self, interaction: discord.Interaction):
+        await asyncio.to_thread(self.pages.older)
+        self.update_buttons()
+        await interaction.response.edit_message(content=self.pages.text(), view=self)
         
-    async def process_selection(self, interaction: discord.Interaction):
-        '''Adds additional dropdowns to the view based on players selected'''
 
-        # Remove player selection dropdown
-        self.remove_item(self.player_select)
+# ---------- DISCORD BOT SLASH COMMANDS ---------------
+
 
-        # Add a new dropdown menu for each player (owner) that was selected
-        self.deck_select = [DeckSelect(player, self) for player in self.player_select.values]
-        for ea in self.deck_select:
-            self.add_item(ea)
+client = MyClient()
+metrics.instrument_responses()
 
-        # update view
-        await interaction.response.edit_message(view=self)
 
-    async def pick_winner(self, interaction: discord.Interaction):
-        '''Add dropdown to select the winner'''
+deck_names = autocomplete.DeckIndex()
+deck_names_lock = asyncio.Lock()
 
-        # Set attribute to use in log_game method and WinnerSelect class
-        # self.selected_decks = [x.values[0] for x in self.deck_select]
-        # Changed to format deck as commander (owner) to solve repeat commander issues
-        self.selected_decks =  [f'{value} ({self.player_select.values[indx]})' 
-                                for indx,value in enumerate([x.values[0] for x in self.deck_select])]
 
-        # Remove dropdowns and update view
-        for ea in self.deck_select:
-            self.remove_item(ea)
- 
-        # Add winner dropdown
-        self.winner_select = WinnerSelect(self)
-        self.add_item(self.winner_select)
+async def deck_index():
+    """Player and deck name index, updated with the decks added since it was last used"""
+    decks = await cache.get_async('decks.json', deckstats.Deck)
+    async with deck_names_lock:
+        if len(decks) - deck_names.count > 1000:
+            # indexing every deck takes a moment, keep the event loop free meanwhile
+            await asyncio.to_thread(deck_names.update, decks)
+        else:
+            deck_names.update(decks)
+    return deck_names
 
-        await interaction.response.edit_message(view=self)
 
-    async def log_game(self, interaction: discord.Interaction):
-        '''Called once all decks and winner have been selected to log the game'''
-        
-        # remove winner select dropdown
-        self.remove_item(self.winner_select)
+def choices(names):
+    # choice names and values are limited to 100 characters, find() still matches a cut off name
+    return [app_commands.Choice(name=x[:100], value=x[:100]) for x in names[:autocomplete.LIMIT]]
 
-        new_game = deckstats.register_game(
-            date=interaction.message.created_at.strftime('%m-%d-%Y'), 
-            winner=self.winner_select.values[0],
-            decks=self.selected_decks
-            )
 
-        await interaction.response.edit_message(content=new_game,view=self)
+async def private_followup(interaction: discord.Interaction, text):
+    """Ephemeral answer to a publicly deferred interaction, the thinking message is removed
+    since the first followup would otherwise replace it and be public"""
+    await interaction.delete_original_response()
+    await interaction.followup.send(text, ephemeral=True)
 
 
-class RandomView(discord.ui.View):
-    def __init__(self):
-        super().__init__()
-        self.decks = deckstats.load_json_data('decks.json',deckstats.Deck)
-        self.player_select = PlayerSelect(self, 1)
-        self.add_item(self.player_select)
+@metrics.timed('autocomplete.players')
+async def player_choices(interaction: discord.Interaction, current: str):
+    return choices((await deck_index()).players.search(current))
 
-    async def process_selection(self, interaction: discord.Interaction):
-        self.remove_item(self.player_select)
 
-        random_decks = deckstats.random_decks(self.decks, self.player_select.values)
-        response = '  vs  '.join([deck.commander for deck in random_decks])
+@metrics.timed('autocomplete.decks')
+async def deck_choices(interaction: discord.Interaction, current: str):
+    return choices((await deck_index()).decks.search(current))
 
-        await interaction.response.edit_message(content=response,view=self)
-        
 
-# ---------- DISCORD BOT SLASH COMMANDS ---------------
+@metrics.timed('autocomplete.names')
+async def name_choices(interaction: discord.Interaction, current: str):
+    """Players first, then decks"""
+    index = await deck_index()
+    return choices(index.players.search(current) + index.decks.search(current))
 
 
-client = MyClient()
+@metrics.timed('autocomplete.winner')
+async def winner_choices(interaction: discord.Interaction, current: str):
+    """The decks already entered for this game"""
+    prefix = autocomplete.normalize(current)
+    options = interaction.namespace
+    picked = [x for x in (options.first, options.second, options.third, options.fourth) if x]
+    return choices([x for x in dict.fromkeys(picked) if prefix in autocomplete.normalize(x)])
+
+
+def find_links(message: discord.Message):
+    """Returns (link, author) for every link in a message"""
+    # Use the regular expression to find links in each message
+    return [(link, message.author.name) for link in re.findall(r"(?P<url>https?://[^\s]+)", message.content)]
 
 
 @client.tree.command()
-async def pull_decks(interaction: discord.Interaction):
+@app_commands.describe(full='Rescan the whole channel instead of only new posts')
+@metrics.timed('pull_decks')
+async def pull_decks(interaction: discord.Interaction, full: bool = False):
     """Add decks from decklist links in #decklists channel"""
 
+    # answer right away, the scan runs as a background job that edits this response
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    if jobs.start('pull_decks', lambda job: pull_decks_job(job, full), interaction) is None:
+        await jobs.busy_message(interaction, 'pull_decks')
+
+
+def save_checkpoint(retry, last_message, edited):
+    """Remember where pull_decks got to: links to retry, the last message read and which
+    edited messages have been reread"""
+    storage.set_meta(RETRY_KEY, retry)
+    if last_message is not None:
+        storage.set_meta(CHECKPOINT_KEY, {'message_id': last_message.id,
+                                          'timestamp': last_message.created_at.isoformat()})
+    storage.set_meta(EDITED_KEY, [x for x in storage.get_meta(EDITED_KEY, []) if x not in edited])
+
+
+async def pull_decks_job(job: jobs.Job, full: bool):
     print('Pulling deck links from #decklists channel.')
+    decks = await cache.get_async('decks.json', deckstats.Deck)
+    known_links = {deck.decklist for deck in decks}
 
-    decks = deckstats.load_json_data(
-        'decks.json', deckstats.Deck)
-    start_count = len(decks)
+    checkpoint = None if full else await job.run_in_thread(storage.get_meta, CHECKPOINT_KEY)
+    edited = [] if full else await job.run_in_thread(storage.get_meta, EDITED_KEY, [])
+    posts = [tuple(x) for x in await job.run_in_thread(storage.get_meta, RETRY_KEY, [])]
 
+    # only read messages posted after the last pull
     channel = client.get_channel(config.decklist_channel)
-    async for message in channel.history(limit=None):
-        # Use the regular expression to find links in each message
-        for link in re.findall(r"(?P<url>https?://[^\s]+)", message.content):
-            if link not in [deck.decklist for deck in decks]:
-                commander = deckstats.get_commander_name(link)
-                print(link,commander)
-                decks.append(deckstats.Deck(
-                    owner=message.author.name,
-                    commander=commander,
-                    decklist=link
-                    ))
-    
-    number_of_new_decks = len(decks) - start_count
-    if number_of_new_decks > 0:
-        deckstats.save_to_json(decks, 'decks.json')
-        await interaction.response.send_message(
-            f'{number_of_new_decks} new deck(s) added to deck database', ephemeral=True)
-    else:
-        await interaction.response.send_message('No new decklists links found', ephemeral=True)
+    after = discord.Object(id=checkpoint['message_id']) if checkpoint else None
+    last_message = None
+    async for message in channel.history(limit=None, after=after, oldest_first=True):
+        posts.extend(find_links(message))
+        last_message = message
+        await job.progress(f'Reading #decklists: {len(posts)} links so far')
+
+    # plus older messages that were edited since
+    for message_id in edited:
+        try:
+            posts.extend(find_links(await channel.fetch_message(message_id)))
+        except discord.NotFound:
+            pass
+
+    async def lookup_progress(done, total):
+        await job.progress(f'Looking up commanders: {done}/{total}')
+
+    # commander lookups run concurrently without blocking other commands
+    new_decks, failed, retry = await ingest.new_decks(posts, known_links, progress=lookup_progress)
+    for link, error in failed.items():
+        print(link, error)
+
+    if new_decks:
+        await job.progress(f'Saving {len(new_decks)} new deck(s)', force=True)
+        await job.run_in_thread(deckstats.add_decks, new_decks)
+
+    # checkpoint only once the new decks are saved
+    await job.run_in_thread(save_checkpoint, retry, last_message, edited)
+
+    if new_decks:
+        return f'{len(new_decks)} new deck(s) added to deck database'
+    return 'No new decklists links found'
     
 
 @client.tree.command()
-async def game(interaction: discord.Interaction):
-    """Create a dropdown menu to record a new 4 player game"""
-    view = RegisterGameView()
-    await interaction.response.send_message(view=view)
+@app_commands.describe(first='Deck', second='Deck', third='Deck', fourth='Deck', winner='Deck that won')
+@app_commands.autocomplete(first=deck_choices, second=deck_choices, third=deck_choices, fourth=deck_choices,
+                           winner=winner_choices)
+@metrics.timed('game')
+async def game(interaction: discord.Interaction, first: str, second: str, third: str, fourth: str, winner: str):
+    """Record a new 4 player game"""
+    index = await deck_index()
+    decks = [index.decks.find(x) for x in (first, second, third, fourth)]
+    winner_deck = index.decks.find(winner)
+    if None in decks or len(set(decks)) < 4 or winner_deck not in decks:
+        await interaction.response.send_message('Pick four different decks from the suggestions, '
+                                                'the winner has to be one of them', ephemeral=True)
+        return
+
+    # registering applies the game to the ratings, which replays every game on a cold
+    # engine, answer within discord's 3 seconds first
+    await interaction.response.defer()
+    new_game = await asyncio.to_thread(
+        deckstats.register_game,
+        date=interaction.created_at.strftime('%Y-%m-%d'),
+        winner=winner_deck,
+        decks=decks
+        )
+    await interaction.followup.send(content=new_game)
 
 
 # @client.tree.command()
@@ -190,11 +330,181 @@ async def game(interaction: discord.Interaction):
     
 
 @client.tree.command()
-async def random(interaction: discord.Interaction):
-    """Pick random decks owned by the selected players"""
-    view = RandomView()
-    await interaction.response.send_message(view=view)
+@app_commands.describe(first='Player', second='Player', third='Player', fourth='Player')
+@app_commands.autocomplete(first=player_choices, second=player_choices, third=player_choices, fourth=player_choices)
+@metrics.timed('random')
+async def random(interaction: discord.Interaction, first: str, second: str = None, third: str = None,
+                 fourth: str = None):
+    """Pick balanced pods of decks owned by the selected players"""
+    index = await deck_index()
+    players = [index.players.find(x) for x in (first, second, third, fourth) if x]
+    if None in players:
+        await interaction.response.send_message('Pick players from the suggestions', ephemeral=True)
+        return
+
+    # best balanced pods for the selected players, searched off the event loop. The ratings
+    # come from the rating engine, which replays every game when it's cold
+    await interaction.response.defer()
+    decks = await cache.get_async('decks.json', deckstats.Deck)
+    maker = await asyncio.to_thread(matchmaker.from_database, decks)
+    view = RandomView(maker.best_pods(list(dict.fromkeys(players)), n=PODS_PER_PAGE * POD_PAGES))
+    await interaction.followup.send(content=view.page_text(), view=view)
+
+
+@client.tree.command()
+@app_commands.describe(query='Scryfall style search, e.g. t:creature o:"draw a card" c:g cmc<=3')
+@metrics.timed('card')
+async def card(interaction: discord.Interaction, query: str):
+    """Search cards offline from the scryfall bulk data"""
+    if cardsearch.ready():
+        await interaction.response.send_message(cardsearch.search_text(cardsearch.current(), query))
+
+        # a newer bulk file is picked up in the background, searches meanwhile use the current index
+        async def refresh(job):
+            await job.run_in_thread(cardsearch.get_index)
+
+        jobs.start('card_index', refresh)
+    else:
+        # first search builds the index
+        await interaction.response.defer(thinking=True)
+        index = await asyncio.to_thread(cardsearch.get_index)
+        await interaction.followup.send(cardsearch.search_text(index, query))
+
+
+@client.tree.command(name='leaderboard')
+@app_commands.describe(kind='Rank decks or players', sort='Stat to rank by', limit='Number of rows to show')
+@metrics.timed('leaderboard')
+async def show_leaderboard(interaction: discord.Interaction, kind: Literal['decks', 'players'] = 'decks',
+                           sort: Literal[leaderboard.SORTS] = 'rating', limit: app_commands.Range[int, 1, 20] = 10):
+    """Deck or player leaderboard"""
+    # the engine only applies games registered since the last call, the sorted board is reused.
+    # A cold engine replays every game first, which can take longer than discord waits
+    await interaction.response.defer()
+    rows = await asyncio.to_thread(ratings.query, lambda engine: engine.board(kind, sort))
+    await interaction.followup.send(leaderboard.board_text(rows, sort, limit))
+
+
+@client.tree.command(name='deckstats')
+@app_commands.describe(name='Deck (commander) or player name')
+@app_commands.autocomplete(name=name_choices)
+@metrics.timed('deckstats')
+async def deck_stats(interaction: discord.Interaction, name: str):
+    """Rating, record, streaks and most played opponents of a deck or player"""
+    def lookup(engine):
+        for kind in leaderboard.KINDS:
+            found = leaderboard.find(engine.entities(kind), name)
+            stats = found and engine.stats(kind, found)
+            if stats:
+                return stats
+        return None
+
+    await interaction.response.defer()
+    stats = await asyncio.to_thread(ratings.query, lookup)
+    if stats:
+        await interaction.followup.send(leaderboard.stats_text(*stats))
+    else:
+        await private_followup(interaction, f'No games found for `{name}`')
+
+
+@client.tree.command()
+@app_commands.describe(first='Deck or player', second='Deck or player')
+@app_commands.autocomplete(first=name_choices, second=name_choices)
+@metrics.timed('h2h')
+async def h2h(interaction: discord.Interaction, first: str, second: str):
+    """Head to head record of two decks or two players"""
+    def lookup(engine):
+        for kind in ('players', 'decks'):
+            names = engine.entities(kind)
+            first_name, second_name = leaderboard.find(names, first), leaderboard.find(names, second)
+            if first_name and second_name:
+                return first_name, second_name, engine.head_to_head(kind, first_name, second_name)
+        return None
+
+    await interaction.response.defer()
+    found = await asyncio.to_thread(ratings.query, lookup)
+    if found:
+        await interaction.followup.send(leaderboard.h2h_text(*found))
+        return
+    await private_followup(interaction, f'Could not find two decks or two players matching `{first}` and `{second}`')
+
+
+@client.tree.command(name='history')
+@app_commands.describe(deck='Only games of this deck', player='Only games of this player',
+                       period='A year, month or day (2024, 2024-03, 2024-03-15) or a range (2024-01..2024-03)')
+@app_commands.autocomplete(deck=deck_choices, player=player_choices)
+@metrics.timed('history')
+async def show_history(interaction: discord.Interaction, deck: str = None, player: str = None, period: str = None):
+    """Games played, newest first"""
+    index = await deck_index()
+    deck_name = index.decks.find(deck) if deck else None
+    player_name = index.players.find(player) if player else None
+    if (deck and deck_name is None) or (player and player_name is None):
+        await interaction.response.send_message('Pick decks and players from the suggestions', ephemeral=True)
+        return
+    try:
+        pages = await asyncio.to_thread(history.Pages, deck_name, player_name, period)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+    view = HistoryView(pages)
+    await interaction.response.send_message(content=pages.text(), view=view)
+
+
+@client.tree.command()
+@app_commands.default_permissions(administrator=True)
+@metrics.timed('rebuild_stats')
+async def rebuild_stats(interaction: discord.Interaction):
+    """Recompute stats.json from the downloaded decklists"""
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    async def work(job):
+        try:
+            import moxfield
+        except ImportError:
+            # no selenium, only the decklists that are already downloaded are used
+            moxfield = None
+        failed = {}
+        if moxfield is not None:
+            decks = await cache.get_async('decks.json', deckstats.Deck)
+            links = moxfield.missing_decklists(deck.decklist for deck in decks)
+            if links:
+                await job.progress(f'Downloading {len(links)} decklists from Moxfield', force=True)
+                _, failed = await job.run_in_thread(moxfield.download_decklists, links)
+                for link, error in failed.items():
+                    print(link, error)
+
+        await job.progress('Reading decklists and computing stats', force=True)
+        # card lookups and the stats are CPU bound, keep them off the bot process
+        directory = moxfield.DOWNLOAD_DIR if moxfield is not None else 'decklists'
+        stats = await job.run_in_process(deckstats.build_deck_stats, directory)
+        text = f'Stats rebuilt for {len(stats)} decks in {job.elapsed():.0f}s'
+        if failed:
+            text += f', {len(failed)} Moxfield decklists could not be downloaded'
+        return text
+
+    if jobs.start('rebuild_stats', work, interaction) is None:
+        await jobs.busy_message(interaction, 'rebuild_stats')
+
+
+@client.tree.command()
+@app_commands.default_permissions(administrator=True)
+@metrics.timed('botstats')
+async def botstats(interaction: discord.Interaction):
+    """Show command latency, response times, I/O time, errors and cache hit rates"""
+    stats = cache.stats()
+    http = httpcache.stats()
+    text = (f"{startup_text()}\n"
+            f"Cache hits: {stats['hits']}  misses: {stats['misses']}  hit rate: {stats['hit_rate']:.0%}\n"
+            f"HTTP cache fresh: {http['fresh']}  revalidated: {http['revalidated']}  misses: {http['miss']}  "
+            f"hit rate: {http['hit_rate']:.0%}  commander lookups saved: {http['extract_hit_rate']:.0%}\n"
+            + metrics.summary_text(metrics.summary()))
+    # prometheus (metrics_port in config.py) has everything if this gets cut off
+    await interaction.response.send_message(text[:2000], ephemeral=True)
 
 
 if __name__=='__main__':
+    # optional prometheus endpoint, e.g. metrics_port = 9108 in config.py
+    if getattr(config, 'metrics_port', None):
+        metrics.serve(config.metrics_port)
+    startup['run'] = time.perf_counter() - STARTED
     client.run(config.discord_token)
\ No newline at end of file
@@ -1,24 +1,136 @@
 #given players in match, return random decks that are appropriately grouped based on one or more criteria
+import heapq
 import random
-import json
+from bisect import bisect_left, bisect_right
+import deckstats
+import storage
 
-random_decks = []
 
-with open("decks.json", "r") as read_file:
-    decks = json.load(read_file)
-#who playing
-players = ['ostertoaster10','bonaparte jones','DrSull','Spenda4life']
+# A pod costs its rating spread (best minus worst deck) plus a penalty for each deck that
+# was played recently: RECENCY_WEIGHT for a deck in the last game, fading to nothing
+# after RECENCY_HORIZON games.
+RECENCY_WEIGHT = 100
+RECENCY_HORIZON = 20
 
-for x in players:
-    random_decks.append(random.choice([deck['commander'] for deck in decks if deck['owner'] == x]))
 
-# for each shortlist of decks, pick a random item from each
-print(random_decks)
+class Matchmaker:
+    def __init__(self, decks, ratings=None, games=(), rng=random):
+        """decks are Deck objects with owner names, ratings maps deck key -> current rating
+        and games are Game objects (deck names) in the order they were played. rng breaks
+        ties, so equally good pods come out in a different order every time"""
 
-#Check criteria
-#ELO
-#win streak
-#Win record
-#Time since last played
+        ratings = ratings or {}
+        self.rng = rng
+        last_played = {}
+        for indx, game in enumerate(games):
+            for name in game.decks:
+                last_played[name] = indx
 
-#option to re-randomize
+        # per owner index of (rating, penalty, deck) sorted by rating
+        self.owners = {}
+        for deck in decks:
+            key = deckstats.deck_key(deck)
+            rating = ratings.get(key, deck.rating)
+            if key in last_played:
+                games_since = len(games) - 1 - last_played[key]
+                penalty = RECENCY_WEIGHT * max(0, 1 - games_since / RECENCY_HORIZON)
+            else:
+                penalty = 0
+            self.owners.setdefault(deck.owner, []).append((rating, penalty, deck))
+        for entries in self.owners.values():
+            # shuffled first so decks with the same rating are tried in a random order
+            rng.shuffle(entries)
+            entries.sort(key=lambda x: x[0])
+        self.ratings = {owner: [x[0] for x in entries] for owner, entries in self.owners.items()}
+
+    def closest(self, owner, lo, hi):
+        """Yield (distance from [lo, hi], entry) for an owner's decks, closest first"""
+        ratings, entries = self.ratings[owner], self.owners[owner]
+        left = bisect_left(ratings, lo)
+        right = bisect_right(ratings, hi)
+        for indx in range(left, right):
+            yield 0, entries[indx]
+        left -= 1
+        while left >= 0 or right < len(ratings):
+            if right >= len(ratings) or (left >= 0 and lo - ratings[left] <= ratings[right] - hi):
+                yield lo - ratings[left], entries[left]
+                left -= 1
+            else:
+                yield ratings[right] - hi, entries[right]
+                right += 1
+
+    def best_pods(self, owners, n=5):
+        """The n pods (one deck per owner) with the lowest cost, cheapest first.
+        Branch and bound over owners with the fewest decks first: decks are tried closest
+        rating first, and a partial pod is dropped once its spread and penalties so far plus
+        the cheapest possible completion can't beat the n-th best pod found"""
+
+        owners = sorted(set(owners), key=lambda x: len(self.owners.get(x, ())))
+        if not owners or any(owner not in self.owners for owner in owners):
+            return []
+        min_penalty = [min(x[1] for x in self.owners[owner]) for owner in owners]
+        rest_penalty = [sum(min_penalty[i:]) for i in range(len(owners) + 1)]
+        last = len(owners) - 1
+
+        heap = []       # (-cost, random tiebreak, spread, decks), worst pod on top
+
+        def search(depth, lo, hi, penalty, picked):
+            for dist, (rating, deck_penalty, deck) in self.closest(owners[depth], lo, hi):
+                # later decks are only further away, so the spread part of the bound only grows
+                worst = -heap[0][0] if len(heap) == n else float('inf')
+                if hi - lo + dist + penalty + rest_penalty[depth] >= worst:
+                    break
+                new_lo, new_hi = min(lo, rating), max(hi, rating)
+                new_penalty = penalty + deck_penalty
+                if depth == last:
+                    cost = new_hi - new_lo + new_penalty
+                    if cost < worst:
+                        item = (-cost, self.rng.random(), new_hi - new_lo, picked + [deck])
+                        if len(heap) < n:
+                            heapq.heappush(heap, item)
+                        else:
+                            heapq.heapreplace(heap, item)
+                elif new_hi - new_lo + new_penalty + rest_penalty[depth + 1] < worst:
+                    search(depth + 1, new_lo, new_hi, new_penalty, picked + [deck])
+
+        # least recently played decks of the first owner first, they tend to give good pods early
+        first = list(self.owners[owners[0]])
+        self.rng.shuffle(first)
+        first.sort(key=lambda x: x[1])
+        if last == 0:
+            return [{'cost': deck_penalty, 'spread': 0, 'decks': [deck]} for _, deck_penalty, deck in first[:n]]
+        for rating, deck_penalty, deck in first:
+            if len(heap) == n and deck_penalty + rest_penalty[1] >= -heap[0][0]:
+                break
+            search(1, rating, rating, deck_penalty, [deck])
+
+        return [{'cost': -cost, 'spread': spread, 'decks': decks}
+                for cost, _, spread, decks in sorted(heap, key=lambda x: (-x[0], x[1]))]
+
+
+def from_database(decks=None):
+    """Matchmaker using current ratings from the rating engine and the game history"""
+    import ratings
+    decks = decks if decks is not None else deckstats.load_json_data('decks.json', deckstats.Deck)
+    current = ratings.query(lambda engine: {key: deck.rating for key, deck in engine.decks.items()})
+    # only the last RECENCY_HORIZON games carry a penalty
+    games = [deckstats.Game(**x) for x in reversed(storage.game_history(limit=RECENCY_HORIZON))]
+    return Matchmaker(decks, current, games)
+
+
+if __name__ == '__main__':
+    import time
+    rng = random.Random(0)
+    owners = [f'player{i}' for i in range(4)]
+    decks = [deckstats.Deck(owner=owner, commander=f'Commander {i}', rating=rng.randint(1300, 1700))
+             for owner in owners for i in range(60)]
+    games = [deckstats.Game('01-01-2023', None, [deckstats.deck_key(x) for x in rng.sample(decks, 4)])
+             for _ in range(500)]
+    maker = Matchmaker(decks, games=games)
+
+    start = time.perf_counter()
+    for _ in range(100):
+        pods = maker.best_pods(owners, n=5)
+    print(f'{(time.perf_counter() - start) * 10:.3f} ms per search over 60^4 pods')
+    for pod in pods:
+        print(round(pod['cost'], 1), pod['spread'], [deck.commander for deck in pod['decks']])
@@ -0,0 +1,279 @@
+import contextvars
+import functools
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Latency histograms for slash commands and view callbacks, time until each interaction
+# got its first response (discord gives up after RESPONSE_DEADLINE seconds), time spent
+# in database/file I/O and error counts. Recording is a bisect and a few additions under
+# a lock, everything else only runs when /botstats or the prometheus endpoint asks.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10)   # seconds, plus +Inf
+RESPONSE_DEADLINE = 3
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket the q-th observation falls in (max for the last one)"""
+        rank = q * self.count
+        seen = 0
+        for indx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BUCKETS[indx], self.max) if indx < len(BUCKETS) else self.max
+        return 0.0
+
+
+latency = {}            # handler -> Histogram of the whole callback
+first_response = {}     # handler -> Histogram from the callback starting to its first response
+io_time = {}            # I/O function -> Histogram
+handler_io = {}         # handler -> seconds of I/O done while it ran
+errors = {}             # handler -> exceptions raised
+late = {}               # handler -> first responses more than RESPONSE_DEADLINE after the interaction
+started = time.time()
+
+_lock = threading.Lock()
+# (handler name, start) of the command/callback running in this task or thread
+_current = contextvars.ContextVar('metrics_handler', default=None)
+
+
+def observe(table, name, seconds):
+    with _lock:
+        histogram = table.get(name)
+        if histogram is None:
+            histogram = table[name] = Histogram()
+        histogram.observe(seconds)
+
+
+def increment(table, name, amount=1):
+    with _lock:
+        table[name] = table.get(name, 0) + amount
+
+
+def find_interaction(args):
+    return next((x for x in args if hasattr(x, 'response') and hasattr(x, 'created_at')), None)
+
+
+def timed(name):
+    """Decorator for slash commands and view callbacks (coroutines), records latency and errors"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            token = _current.set((name, start, find_interaction(args)))
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                increment(errors, name)
+                raise
+            finally:
+                _current.reset(token)
+                observe(latency, name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def io(func):
+    """Decorator for functions that read or write the database or data files"""
+    name = f'{func.__module__}.{func.__name__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            observe(io_time, name, elapsed)
+            handler = _current.get()
+            if handler is not None:
+                increment(handler_io, handler[0], elapsed)
+    return wrapper
+
+
+def responded():
+    """Record the first response of the interaction being handled"""
+    handler = _current.get()
+    if handler is None:
+        return
+    name, start, interaction = handler
+    observe(first_response, name, time.perf_counter() - start)
+    if interaction is not None:
+        # the deadline counts from when discord created the interaction, not from our start
+        if (datetime.now(timezone.utc) - interaction.created_at).total_seconds() > RESPONSE_DEADLINE:
+            increment(late, name)
+
+
+def instrument_responses():
+    """Hook every way of giving an interaction its first response"""
+    from discord import InteractionResponse
+
+    def hooked(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            responded()
+            return await method(self, *args, **kwargs)
+        return wrapper
+
+    for method in ('send_message', 'defer', 'edit_message', 'send_modal', 'autocomplete'):
+        original = getattr(InteractionResponse, method)
+        if not hasattr(original, '__wrapped__'):
+            setattr(InteractionResponse, method, hooked(original))
+
+
+def snapshot():
+    """Copy of every metric, taken under the lock"""
+    def copy(table):
+        result = {}
+        for name, histogram in table.items():
+            clone = Histogram()
+            clone.counts, clone.count, clone.total, clone.max = \
+                list(histogram.counts), histogram.count, histogram.total, histogram.max
+            result[name] = clone
+        return result
+
+    with _lock:
+        return {'latency': copy(latency), 'first_response': copy(first_response), 'io_time': copy(io_time),
+                'handler_io': dict(handler_io), 'errors': dict(errors), 'late': dict(late)}
+
+
+def summary():
+    """Per handler and per I/O function stats in milliseconds"""
+    data = snapshot()
+    handlers = {}
+    for name, histogram in sorted(data['latency'].items()):
+        response = data['first_response'].get(name)
+        handlers[name] = {'calls': histogram.count,
+                          'mean_ms': round(1000 * histogram.total / histogram.count, 1),
+                          'p50_ms': round(1000 * histogram.quantile(0.5), 1),
+                          'p95_ms': round(1000 * histogram.quantile(0.95), 1),
+                          'max_ms': round(1000 * histogram.max, 1),
+                          'first_response_p95_ms': round(1000 * response.quantile(0.95), 1) if response else None,
+                          'io_ms': round(1000 * data['handler_io'].get(name, 0), 1),
+                          'late': data['late'].get(name, 0),
+                          'errors': data['errors'].get(name, 0)}
+    io = {name: {'calls': histogram.count,
+                 'total_ms': round(1000 * histogram.total, 1),
+                 'p95_ms': round(1000 * histogram.quantile(0.95), 2)}
+          for name, histogram in sorted(data['io_time'].items())}
+    return {'uptime_s': round(time.time() - started), 'handlers': handlers, 'io': io}
+
+
+def summary_text(stats):
+    """summary() formatted as code blocks for a discord message"""
+    lines = [f"Uptime {stats['uptime_s'] // 3600}h {stats['uptime_s'] // 60 % 60}m",
+             '```', f"{'handler':28} {'calls':>5} {'p50':>6} {'p95':>6} {'max':>6} {'resp95':>6} {'io':>6} {'late':>4} {'err':>3}"]
+    for name, x in stats['handlers'].items():
+        response = x['first_response_p95_ms'] if x['first_response_p95_ms'] is not None else '-'
+        lines.append(f"{name[:28]:28} {x['calls']:>5} {x['p50_ms']:>6} {x['p95_ms']:>6} {x['max_ms']:>6} "
+                     f"{response:>6} {x['io_ms']:>6} {x['late']:>4} {x['errors']:>3}")
+    lines += ['```', '```', f"{'I/O':28} {'calls':>6} {'total':>9} {'p95':>7}"]
+    for name, x in stats['io'].items():
+        lines.append(f"{name[:28]:28} {x['calls']:>6} {x['total_ms']:>9} {x['p95_ms']:>7}")
+    lines.append('```')
+    return '\n'.join(lines) + '\n(times in ms)'
+
+
+def prometheus_text():
+    """All metrics in the prometheus text exposition format"""
+    data = snapshot()
+    lines = []
+
+    def histograms(metric, help_text, label, table):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for name, histogram in sorted(table.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram.total}')
+            lines.append(f'{metric}_count{{{label}="{name}"}} {histogram.count}')
+
+    def counters(metric, help_text, label, table):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for name, value in sorted(table.items()):
+            lines.append(f'{metric}{{{label}="{name}"}} {value}')
+
+    histograms('hor_handler_seconds', 'Slash command and view callback latency', 'handler', data['latency'])
+    histograms('hor_first_response_seconds', 'Time until the first interaction response', 'handler',
+               data['first_response'])
+    histograms('hor_io_seconds', 'Database and data file I/O time', 'function', data['io_time'])
+    counters('hor_handler_io_seconds_total', 'I/O time spent inside each handler', 'handler', data['handler_io'])
+    counters('hor_handler_errors_total', 'Exceptions raised by each handler', 'handler', data['errors'])
+    counters('hor_late_responses_total', f'First responses later than {RESPONSE_DEADLINE}s', 'handler', data['late'])
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve /metrics for prometheus from a background thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    print(f'Serving metrics on http://{host}:{port}/metrics')
+    return server
+
+
+if __name__ == '__main__':
+    import asyncio
+    print('***Testing***')
+
+    @timed('bench')
+    async def handler(x):
+        return x
+
+    async def plain(x):
+        return x
+
+    async def run(func, calls=100000):
+        start = time.perf_counter()
+        for i in range(calls):
+            await func(i)
+        return (time.perf_counter() - start) / calls
+
+    overhead = asyncio.run(run(handler)) - asyncio.run(run(plain))
+    print(f'timed() overhead {overhead * 1e6:.2f} us per call')
+
+    @io
+    def read(x):
+        return x
+    start = time.perf_counter()
+    for i in range(100000):
+        read(i)
+    print(f'io() call {(time.perf_counter() - start) * 10:.2f} us')
+    print(summary_text(summary()))
@@ -1,49 +1,261 @@
+import itertools
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.common.by import By
-import time
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from webdriver_manager.chrome import ChromeDriverManager
+import cardnames
+import deckstats
 
 
-def get_moxfield_decklist(link, download = False):
+# Moxfield only renders decklists with javascript, so they're read through headless Chrome.
+# Starting Chrome is most of the cost of a lookup, so a BrowserPool keeps a few sessions
+# open and spreads a batch of deck links across them. Every step waits on the element it
+# needs (up to WAIT_TIMEOUT seconds) instead of sleeping.
+
+DOWNLOAD_DIR = os.environ.get('HOR_DECKLIST_DIR', os.path.join(os.path.dirname(__file__), 'decklists'))
+SESSIONS = 3
+WAIT_TIMEOUT = 30
+
+_driver_path = None
+_driver_lock = threading.Lock()
+
+
+def driver_path():
+    """ChromeDriver matching the installed Chrome, installed once per process"""
+    global _driver_path
+    with _driver_lock:
+        if _driver_path is None:
+            _driver_path = ChromeDriverManager().install()
+    return _driver_path
 
+
+def new_driver(download_dir, headless=True):
     prefs = {
-        "download.default_directory": r'C:\Users\Mike\Documents\Code\Python\WebScraping\downloads',
+        "download.default_directory": os.path.abspath(download_dir),
         "download.prompt_for_download": False,
         "download.directory_upgrade": True,
         "safebrowsing.enabled": True
         }
 
     options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument('--headless=new')
+    options.add_argument('--window-size=1280,1024')
     options.add_experimental_option("prefs", prefs)
     options.add_experimental_option('excludeSwitches', ['enable-logging'])
-    driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
-    driver.implicitly_wait(30)
+    return webdriver.Chrome(service=ChromeService(driver_path()), options=options)
+
+
+class BrowserPool:
+    """Up to size Chrome sessions, started on first use and reused for every deck after that.
+    Each session downloads into its own folder under download_dir so concurrent downloads
+    can't be mixed up"""
+
+    def __init__(self, size=SESSIONS, download_dir=DOWNLOAD_DIR, timeout=WAIT_TIMEOUT, headless=True):
+        self.size = size
+        self.download_dir = download_dir
+        self.timeout = timeout
+        self.headless = headless
+        self.idle = queue.Queue()
+        self.sessions = []      # every open driver, idle or not
+        self.folders = {}       # driver -> its download folder
+        self.numbers = itertools.count()    # folder names are never reused, even after a discard
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def acquire(self):
+        """An idle session, a new one if the pool isn't full, otherwise wait for one"""
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                if len(self.sessions) < self.size:
+                    folder = os.path.join(self.download_dir, f'.session{next(self.numbers)}')
+                    os.makedirs(folder, exist_ok=True)
+                    driver = new_driver(folder, self.headless)
+                    self.folders[driver] = folder
+                    self.sessions.append(driver)
+                    return driver
+            # check again now and then, a discarded session frees a place in the pool
+            try:
+                return self.idle.get(timeout=1)
+            except queue.Empty:
+                pass
+
+    @contextmanager
+    def session(self):
+        driver = self.acquire()
+        healthy = True
+        try:
+            yield driver
+        except TimeoutException:
+            # the page didn't load as expected, the browser is fine
+            raise
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            if healthy:
+                self.idle.put(driver)
+            else:
+                self.discard(driver)
+
+    def discard(self, driver):
+        """Quit a crashed or hung browser instead of giving it back to the pool"""
+        with self.lock:
+            self.sessions.remove(driver)
+            self.folders.pop(driver, None)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
 
-    driver.get(link)
+    def close(self):
+        with self.lock:
+            sessions, self.sessions, self.folders = self.sessions, [], {}
+        for driver in sessions:
+            try:
+                driver.quit()
+            except WebDriverException:
+                pass
+        self.idle = queue.Queue()
 
-    download_button  = driver.find_element(By.LINK_TEXT, "Download")
-    download_button.click()
+    def fetch(self, link, download=False):
+        """Decklist text from moxfield's export dialog. With download the MTGO export is
+        also saved to download_dir, named after the deck id"""
+        with self.session() as driver:
+            wait = WebDriverWait(driver, self.timeout)
+            driver.get(link)
+            wait.until(EC.element_to_be_clickable((By.LINK_TEXT, 'Download'))).click()
+            textarea = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'textarea[name="full"]')))
+            decklist_text = wait.until(lambda d: textarea.get_attribute('value'))
 
-    decklist_element = driver.find_element(By.CSS_SELECTOR, 'textarea[name="full"]')
-    decklist_text = decklist_element.get_attribute("value")
+            if download:
+                folder = self.folders[driver]
+                before = set(os.listdir(folder))
+                wait.until(EC.element_to_be_clickable((By.LINK_TEXT, 'Download for MTGO'))).click()
+                file_name = wait.until(lambda d: finished_download(folder, before))
+                shutil.move(os.path.join(folder, file_name), decklist_path(link, self.download_dir))
 
-    if download == True:
-        mtgo_button = driver.find_element(By.LINK_TEXT, 'Download for MTGO')
-        mtgo_button.click()
-        time.sleep(5)
+        return decklist_text
 
-    driver.quit()
+    def fetch_all(self, links, download=False):
+        """Fetch many decks across the pool's sessions. Returns two dicts: link -> parsed
+        decklist for the links that worked, link -> error message for the rest"""
+        found, failed = {}, {}
 
-    return decklist_text
+        def work(link):
+            try:
+                found[link] = parse_decklist(self.fetch(link, download))
+            except Exception as e:
+                failed[link] = str(e).strip() or type(e).__name__
+
+        with ThreadPoolExecutor(self.size) as executor:
+            list(executor.map(work, dict.fromkeys(links)))
+        return found, failed
+
+
+def finished_download(folder, before):
+    """Name of a completed new file in folder, None while chrome is still writing it"""
+    new_files = [x for x in os.listdir(folder) if x not in before]
+    done = [x for x in new_files if not x.endswith(('.crdownload', '.tmp'))]
+    return done[0] if done and len(done) == len(new_files) else None
+
+
+def decklist_path(link, download_dir=DOWNLOAD_DIR):
+    """Where the MTGO export of a deck is saved, named after the deck id"""
+    deck_id = link.rstrip('/').rsplit('/', 1)[-1]
+    return os.path.join(download_dir, f'{deck_id}.txt')
+
+
+def missing_decklists(links, download_dir=DOWNLOAD_DIR):
+    """Moxfield links whose decklist isn't in download_dir yet"""
+    return [link for link in dict.fromkeys(links)
+            if deckstats.deck_site(link) == 'moxfield' and not os.path.exists(decklist_path(link, download_dir))]
+
+
+def download_decklists(links, download_dir=DOWNLOAD_DIR, size=SESSIONS):
+    """Save the MTGO export of every link to download_dir through one BrowserPool.
+    Returns the same two dicts as BrowserPool.fetch_all"""
+    os.makedirs(download_dir, exist_ok=True)
+    with BrowserPool(size, download_dir) as pool:
+        return pool.fetch_all(links, download=True)
+
+
+def get_moxfield_decklist(link, download = False):
+    """Decklist text of a single deck, see BrowserPool for more than one"""
+    with BrowserPool(size=1) as pool:
+        return pool.fetch(link, download)
 
 
 def parse_decklist(moxfield_decklist_text):
+    """'<quantity> <card name>' of every line, without set codes, collector numbers and foil markers"""
     decklist = []
     for line in moxfield_decklist_text.split('\n'):
-        decklist.append(line[:line.find('(')].strip())
+        entry = cardnames.parse_line(line)
+        if entry is not None:
+            decklist.append(f'{entry[0]} {entry[1]}')
     return decklist
 
 
-decklist = get_moxfield_decklist('https://www.moxfield.com/decks/zD3I9kSPaUmDmPIrIk_Mtg')
-print(decklist)
\ No newline at end of file
+# page with moxfield's export flow: the decklist dialog appears a moment after clicking
+# Download, and the MTGO export is a file download
+TEST_PAGE = """<html><body>
+<a href="#" onclick="setTimeout(function() {
+    var area = document.createElement('textarea');
+    area.name = 'full';
+    area.value = '1 Sol Ring (C21) 263\\n1 Arcane Signet (ELD) 331\\n1 Command Tower (C21) 284';
+    document.body.appendChild(area);
+    var mtgo = document.createElement('a');
+    mtgo.textContent = 'Download for MTGO';
+    mtgo.href = '/export.txt';
+    mtgo.download = 'export.txt';
+    document.body.appendChild(mtgo);
+}, 500); return false;">Download</a>
+</body></html>"""
+
+
+if __name__ == '__main__':
+    import functools
+    import tempfile
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+    print('***Testing***')
+
+    with tempfile.TemporaryDirectory() as site, tempfile.TemporaryDirectory() as downloads:
+        for i in range(6):
+            os.makedirs(os.path.join(site, 'decks', f'deck{i}'))
+            with open(os.path.join(site, 'decks', f'deck{i}', 'index.html'), 'w') as f:
+                f.write(TEST_PAGE)
+        with open(os.path.join(site, 'export.txt'), 'w') as f:
+            f.write('1 Sol Ring\n1 Arcane Signet\n1 Command Tower\n')
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(SimpleHTTPRequestHandler, directory=site))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.server_port}'
+        links = [f'{base}/decks/deck{i}/' for i in range(6)] + [f'{base}/missing/']
+
+        with BrowserPool(size=3, download_dir=downloads, timeout=5) as pool:
+            start = time.perf_counter()
+            found, failed = pool.fetch_all(links, download=True)
+            print(f'{len(found)} decks, {len(failed)} failed in {time.perf_counter() - start:.1f}s '
+                  f'with {len(pool.sessions)} browser sessions')
+        print(found[links[0]])
+        print(sorted(x for x in os.listdir(downloads) if not x.startswith('.')))
+        server.shutdown()
@@ -0,0 +1,215 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import deckstats
+import leaderboard
+import metrics
+import storage
+
+
+STATE_FILE = 'ratings.json'
+# the saved state is a checkpoint (games after its offset are replayed on load), so it's
+# only rewritten every SAVE_EVERY games or SAVE_SECONDS instead of after every game
+SAVE_EVERY = 50
+SAVE_SECONDS = 300
+
+
+class RatingEngine:
+    """Keeps current deck/player ratings, records, gold, streaks and head to head records
+    and applies new games one at a time. State is persisted with the id of the last game
+    applied, a full replay only happens when the rating parameters or the game history
+    change"""
+
+    def __init__(self, k_factor=None, d_factor=None, gold_ante=None, state_file=STATE_FILE):
+        # 0 is a valid setting, only None means the default
+        self.params = {'k_factor': deckstats.K_FACTOR if k_factor is None else k_factor,
+                       'd_factor': deckstats.D_FACTOR if d_factor is None else d_factor,
+                       'gold_ante': deckstats.GOLD_ANTE if gold_ante is None else gold_ante}
+        self.path = os.path.join(os.path.dirname(storage.DB_PATH), state_file)
+        self.offset = 0             # games applied
+        self.last_id = 0            # id of the last game applied
+        self.rewrites = 0           # storage.rewrites('games') the games were loaded under
+        self.saved_offset = None    # None until this state has been saved
+        self.saved_at = time.monotonic()
+        self.players = {}   # player name -> Player
+        self.decks = {}     # deck key -> Deck
+        self.leaderboard = leaderboard.Leaderboard()
+        self.load()
+
+    def load(self):
+        """Load saved state, starting over if it was built with different parameters"""
+        try:
+            state = deckstats.read_file(self.path)
+        except (OSError, ValueError):
+            state = None
+
+        if state is None or state['params'] != self.params or 'last_id' not in state:
+            self.reset()
+            return
+
+        self.offset = self.saved_offset = state['offset']
+        self.last_id, self.rewrites = state['last_id'], state['rewrites']
+        self.players = {x['name']: deckstats.Player(**x) for x in state['players']}
+        self.decks = {}
+        for obj in state['decks']:
+            deck = deckstats.Deck(**obj)
+            deck.owner = self.players[deck.owner]
+            self.decks[deckstats.deck_key(deck)] = deck
+        self.leaderboard = leaderboard.Leaderboard(state['leaderboard'])
+
+    def reset(self):
+        """Drop all applied games and start from the saved players and decks"""
+        players, decks = deckstats.load_roster()
+        self.players = {x.name: x for x in players}
+        self.decks = {deckstats.deck_key(x): x for x in decks}
+        self.leaderboard = leaderboard.Leaderboard()
+        self.offset = self.last_id = 0
+        self.rewrites = storage.rewrites('games')
+        self.saved_offset = None
+
+    @metrics.io
+    def save(self):
+        state = {'params': self.params,
+                 'offset': self.offset,
+                 'last_id': self.last_id,
+                 'rewrites': self.rewrites,
+                 'players': [x.__dict__ for x in self.players.values()],
+                 'decks': [dict(x.__dict__, owner=x.owner.name) for x in self.decks.values()],
+                 'leaderboard': self.leaderboard.state()}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self.saved_offset, self.saved_at = self.offset, time.monotonic()
+
+    def add_new_decks(self):
+        """Pick up players and decks added since the state was built"""
+        players, decks = deckstats.load_roster()
+        for player in players:
+            known = self.players.get(player.name)
+            if known is None:
+                self.players[player.name] = player
+            elif known.wins + known.losses == 0:
+                # starting gold depends on owning a deck, so refresh it until the first game
+                known.gold = player.gold
+        for deck in decks:
+            key = deckstats.deck_key(deck)
+            if key not in self.decks:
+                deck.owner = self.players[deck.owner.name]
+                self.decks[key] = deck
+
+    def apply(self, game):
+        """Apply a single game (deck names, not objects) on top of the current state.
+        Like load_game_database, a game naming a deck that doesn't exist is reported and
+        left out (it still counts towards the offset). Returns True if it was applied"""
+        if game.id is not None:
+            self.last_id = game.id
+        names = game.decks + [game.winner]
+        if any(name not in self.decks for name in names):
+            self.add_new_decks()
+            missing = [name for name in names if name not in self.decks]
+            if missing:
+                deckstats.report_unresolved('decks in games', missing, False)
+                self.offset += 1
+                return False
+        game.winner = self.decks[game.winner]
+        game.decks = [self.decks[name] for name in game.decks]
+        deckstats.apply_game(game, **self.params)
+        self.leaderboard.apply(game)
+        self.offset += 1
+        return True
+
+    def update(self):
+        """Apply every game registered since the last update, saving a checkpoint now and then"""
+        if storage.rewrites('games') != self.rewrites:
+            # game history was rewritten, nothing saved can be trusted
+            self.reset()
+        games = [deckstats.Game(**x) for x in storage.load('games', self.last_id)]
+        for game in games:
+            self.apply(game)
+        if games and (self.saved_offset is None or self.offset - self.saved_offset >= SAVE_EVERY
+                      or time.monotonic() - self.saved_at >= SAVE_SECONDS):
+            self.save()
+        return len(games)
+
+    def standings(self):
+        return list(self.players.values()), list(self.decks.values())
+
+    def entities(self, kind):
+        return self.decks if kind == 'decks' else self.players
+
+    def board(self, kind='decks', sort='rating'):
+        """Leaderboard rows of decks or players sorted by a stat, see leaderboard.SORTS"""
+        return self.leaderboard.board(kind, self.entities(kind), sort)
+
+    def stats(self, kind, name):
+        """(row, opponents) of one deck or player, None if it hasn't played"""
+        row = next((x for x in self.board(kind) if x['name'] == name), None)
+        if row is None:
+            return None
+        return row, self.leaderboard.tables[kind].opponents(name)
+
+    def head_to_head(self, kind, first, second):
+        return self.leaderboard.tables[kind].head_to_head(first, second)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def _current_engine():
+    global _engine
+    if _engine is None:
+        _engine = RatingEngine()
+    _engine.update()
+    return _engine
+
+
+def get_engine():
+    """Shared engine, brought up to date with the game database"""
+    with _engine_lock:
+        return _current_engine()
+
+
+def query(func, *args):
+    """func(engine, *args) on the shared engine, brought up to date first, while holding its
+    lock so no game gets applied halfway through the read. Blocking, the bot runs it in a
+    thread. Results shouldn't be the engine's own dicts, those change with the next game"""
+    with _engine_lock:
+        return func(_current_engine(), *args)
+
+
+def snapshot(players, decks):
+    return ({x.name: (x.rating, x.gold, x.wins, x.losses) for x in players},
+            {deckstats.deck_key(x): (x.rating, x.wins, x.losses) for x in decks})
+
+
+def verify():
+    """Compare a full replay against applying every game incrementally with a
+    save/load round trip between games. Returns True if both give identical results"""
+
+    players, decks, games = deckstats.load_game_database()
+    board = leaderboard.Leaderboard()
+    for game in games:
+        deckstats.apply_game(game)
+        board.apply(game)
+    replayed = snapshot(players, decks), board.state()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state_file = os.path.join(tmp, STATE_FILE)
+        engine = RatingEngine(state_file=state_file)
+        for game in deckstats.load_json_data('games.json', deckstats.Game):
+            engine.apply(game)
+            engine.save()
+            engine = RatingEngine(state_file=state_file)
+        incremental = snapshot(*engine.standings()), engine.leaderboard.state()
+
+    return replayed == incremental
+
+
+if __name__ == '__main__':
+    print('***Testing***')
+    print('incremental matches full replay:', verify())
+    deckstats.print_standings(*get_engine().standings())
@@ -1,22 +1,139 @@
-import random
+import argparse
+import os
+import time
+from multiprocessing import Pool
+import numpy as np
 import deckstats
 
 
-if __name__ == '__main__':
+# Monte Carlo check of the elo parameters. Many independent leagues are simulated side by
+# side: every round each league plays one random 4 player pod, the winner is drawn from
+# the decks' hidden "true skill" and all pods are rated at once with the same formula
+# as deckstats.elo / deckstats.multi_ev.
+
+POD_SIZE = 4
+
+
+def batch_multi_ev(d_factor, ratings):
+    """deckstats.multi_ev for every seat of every pod. ratings is (..., players)"""
+    players = ratings.shape[-1]
+    diff = (ratings[..., None, :] - ratings[..., :, None]) / d_factor   # [i, j] = r_j - r_i
+    ev = 1 / (1 + 10 ** diff)
+    ev *= 1 - np.eye(players)
+    return ev.sum(axis=-1) / (players * (players - 1) / 2)
+
+
+def batch_elo(k_factor, d_factor, ratings, winner_indx):
+    """deckstats.elo for a batch of pods, winner_indx has one seat per pod"""
+    won = np.zeros(ratings.shape)
+    np.put_along_axis(won, winner_indx[..., None], 1, axis=-1)
+    # np.round rounds half to even like python's round
+    return np.round(ratings + k_factor * (won - batch_multi_ev(d_factor, ratings)))
+
+
+def true_skill(model, leagues, decks, rng, spread=200):
+    """Hidden strength of every deck on the elo scale"""
+    if model == 'equal':
+        return np.zeros((leagues, decks))
+    if model == 'normal':
+        return rng.normal(0, spread, (leagues, decks))
+    if model == 'uniform':
+        return rng.uniform(-spread * 1.7, spread * 1.7, (leagues, decks))
+    if model == 'tiers':
+        # a few power levels, like precons vs tuned vs cedh
+        return rng.choice([-spread, 0, spread, 2 * spread], (leagues, decks), p=[0.3, 0.4, 0.2, 0.1])
+    raise ValueError(f'Unknown skill model: {model}')
+
+
+def spearman(a, b):
+    """Rank correlation of each row of a with the same row of b"""
+    ra = a.argsort(axis=1).argsort(axis=1).astype(float)
+    rb = b.argsort(axis=1).argsort(axis=1).astype(float)
+    ra -= ra.mean(axis=1, keepdims=True)
+    rb -= rb.mean(axis=1, keepdims=True)
+    denom = np.sqrt((ra ** 2).sum(axis=1) * (rb ** 2).sum(axis=1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denom > 0, (ra * rb).sum(axis=1) / denom, 0)
+
 
-  decks = deckstats.load_json_data('decks.json', deckstats.Deck)
+def run_leagues(args):
+    """Simulate a chunk of leagues, returns rank correlation with true skill at every checkpoint"""
+    leagues, decks, rounds, model, k_factor, d_factor, report_every, seed = args
+    rng = np.random.default_rng(seed)
+    skill = true_skill(model, leagues, decks, rng)
+    ratings = np.full((leagues, decks), 1500.0)
+    rows = np.arange(leagues)[:, None]
+
+    checkpoints = []
+    for rnd in range(1, rounds + 1):
+        # 4 distinct random decks per league
+        pods = rng.random((leagues, decks)).argpartition(POD_SIZE, axis=1)[:, :POD_SIZE]
+        strength = 10 ** (skill[rows, pods] / 400)
+        cumulative = (strength / strength.sum(axis=1, keepdims=True)).cumsum(axis=1)
+        winners = (rng.random((leagues, 1)) > cumulative).sum(axis=1).clip(max=POD_SIZE - 1)
+        ratings[rows, pods] = batch_elo(k_factor, d_factor, ratings[rows, pods], winners)
+
+        if rnd % report_every == 0 or rnd == rounds:
+            checkpoints.append((rnd, spearman(ratings, skill)))
+    return checkpoints
+
+
+def simulate(decks=60, leagues=2000, rounds=1000, model='normal', k_factor=deckstats.K_FACTOR,
+             d_factor=deckstats.D_FACTOR, report_every=50, processes=None, seed=0):
+    """Run leagues * rounds pods spread over a process pool.
+    Returns [(round, games per deck, mean rank correlation, 10th percentile)]"""
+
+    processes = processes or os.cpu_count()
+    chunks = np.array_split(np.arange(leagues), processes)
+    jobs = [(len(chunk), decks, rounds, model, k_factor, d_factor, report_every, seed + i)
+            for i, chunk in enumerate(chunks) if len(chunk)]
+    with Pool(len(jobs)) as pool:
+        results = pool.map(run_leagues, jobs)
+
+    report = []
+    for indx, (rnd, _) in enumerate(results[0]):
+        correlation = np.concatenate([result[indx][1] for result in results])
+        report.append((rnd, rnd * POD_SIZE / decks, float(correlation.mean()),
+                       float(np.percentile(correlation, 10))))
+    return report
+
+
+def check_batch_elo(samples=10000, seed=0):
+    """The batched formula has to give the same numbers as deckstats.elo"""
+    rng = np.random.default_rng(seed)
+    ratings = rng.integers(1000, 2000, (samples, POD_SIZE)).astype(float)
+    winners = rng.integers(0, POD_SIZE, samples)
+    batched = batch_elo(deckstats.K_FACTOR, deckstats.D_FACTOR, ratings, winners)
+    return all(deckstats.elo(deckstats.K_FACTOR, deckstats.D_FACTOR, ratings[i].tolist(), winners[i]) == batched[i].tolist()
+               for i in range(samples))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo check of the elo parameters')
+    parser.add_argument('--decks', type=int, default=60)
+    parser.add_argument('--leagues', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=1000)
+    parser.add_argument('--model', default='normal', choices=['equal', 'normal', 'uniform', 'tiers'])
+    parser.add_argument('--k-factor', type=float, default=deckstats.K_FACTOR)
+    parser.add_argument('--d-factor', type=float, default=deckstats.D_FACTOR)
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
 
-  for _ in range(35):
+    print('batched elo matches deckstats.elo:', check_batch_elo())
 
-    selected_decks = deckstats.random_decks(decks)
-    winner = random.choice(selected_decks)
-  
-    for deck in selected_decks:
-      if deck == winner:
-        deck.wins += 1
-      else:
-        deck.losses += 1
+    start = time.perf_counter()
+    report = simulate(args.decks, args.leagues, args.rounds, args.model, args.k_factor,
+                      args.d_factor, processes=args.processes)
+    elapsed = time.perf_counter() - start
+    print(f'{args.leagues * args.rounds:,} pods in {elapsed:.1f}s')
 
-  decks = [x for x in decks if x.wins + x.losses >= 3]
-  for indx, deck in enumerate(sorted(decks, key=lambda x: x.wins/(x.wins + x.losses), reverse=True)):
-    print(indx + 1, deck, deck.wins, deck.losses)
\ No newline at end of file
+    final = report[-1][2]
+    print('round  games/deck  spearman  p10')
+    for rnd, games, mean, p10 in report:
+        print(f'{rnd:5}  {games:10.1f}  {mean:8.3f}  {p10:.3f}')
+    converged = next((games for _, games, mean, _ in report if mean >= 0.9 * final), None)
+    if converged is None:
+        # e.g. the equal model, where there is no true ranking for the ratings to approach
+        print(f'Did not converge, the final correlation is {final:.3f}')
+    else:
+        print(f'Reaches 90% of the final correlation ({final:.3f}) after {converged:.1f} games per deck')
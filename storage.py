@@ -0,0 +1,396 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+import metrics
+
+
+# players, decks and games live in a sqlite database in WAL mode so a new game is a
+# single atomic insert instead of rewriting games.json. The json files it's migrated from
+# and other state derived from it (ratings.json) live in the same directory.
+# Game dates are stored as 'YYYY-MM-DD' so they sort, game_decks has a row per deck in
+# each game so the history of a deck or player is an index range instead of a full scan.
+# Its player column is the deck's owner from the decks table, deck names aren't parsed.
+DB_PATH = os.path.join(os.path.dirname(__file__), 'hall_of_records.db')
+
+# json file each table was migrated from
+TABLES = {'players.json': 'players',
+          'decks.json': 'decks',
+          'games.json': 'games'}
+
+COLUMNS = {'players': ('name', 'rating', 'gold', 'wins', 'losses'),
+           'decks': ('owner', 'commander', 'decklist', 'rating', 'wins', 'losses'),
+           'games': ('date', 'winner', 'decks')}
+
+# columns holding lists, stored as json text
+JSON_COLUMNS = {('games', 'decks')}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE,
+    rating INTEGER, gold INTEGER, wins INTEGER, losses INTEGER);
+CREATE TABLE IF NOT EXISTS decks (
+    id INTEGER PRIMARY KEY, owner TEXT NOT NULL, commander TEXT NOT NULL, decklist TEXT,
+    rating INTEGER, wins INTEGER, losses INTEGER);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY, date TEXT NOT NULL, winner TEXT NOT NULL, decks TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS game_decks (
+    game_id INTEGER NOT NULL, date TEXT NOT NULL, deck TEXT NOT NULL, player TEXT NOT NULL, won INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT PRIMARY KEY, version INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS deck_stats (
+    name TEXT PRIMARY KEY, hash TEXT NOT NULL, stats TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS games_by_date ON games (date, id);
+"""
+# dropped while game_decks is filled from scratch, building them afterwards is several times faster
+GAME_DECK_INDEXES = {'game_decks_by_deck': '(deck, date, game_id)',
+                     'game_decks_by_player': '(player, date, game_id)'}
+SCHEMA += ''.join(f'CREATE INDEX IF NOT EXISTS {name} ON game_decks {columns};\n'
+                  for name, columns in GAME_DECK_INDEXES.items())
+# PRAGMA user_version of an up to date database, upgrade() brings older ones up to it
+SCHEMA_VERSION = 3
+# meta key written in the same transaction as the json import, until it exists every new
+# connection tries the import again
+MIGRATED_KEY = 'migrated'
+# meta key of what the cached deck stats were computed from
+DECK_STATS_KEY = 'deck_stats'
+
+_local = threading.local()
+_inherited = []     # connections of the parent process, see _after_fork
+
+
+def _after_fork():
+    """A forked child (e.g. a jobs process pool worker) opens its own connections, sqlite
+    connections can't be used across a fork. The parent's are kept referenced so they are
+    never closed from the child either"""
+    global _local
+    _inherited.append(_local)
+    _local = threading.local()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+# callables run with the table name after a write to it is committed
+listeners = []
+
+
+def connect():
+    """Per-thread connection, creating and migrating the database on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path == DB_PATH:
+        return conn
+
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    _local.conn, _local.path, _local.versions = conn, DB_PATH, None
+
+    try:
+        if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            upgrade()
+        if conn.execute('SELECT 1 FROM meta WHERE key = ?', (MIGRATED_KEY,)).fetchone() is None:
+            migrate()
+    except BaseException:
+        # the next connect() tries again instead of handing out a half set up database
+        _local.conn = None
+        conn.close()
+        raise
+    return conn
+
+
+@contextmanager
+def transaction():
+    """Write transaction, the lock is taken up front so concurrent writers queue up"""
+    conn = connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def iso_date(date):
+    """'YYYY-MM-DD' for a date written that way or the old 'MM-DD-YYYY' way"""
+    if isinstance(date, str) and len(date) == 10 and date[2] == '-' and date[5] == '-':
+        month, day, year = date.split('-')
+        return f'{year}-{month}-{day}'
+    return date
+
+
+def _deck_owners(conn, decks=None):
+    """'Commander (owner)' deck name -> owner of the decks in the decks table, or only of
+    the given deck names"""
+    rows = conn.execute("SELECT commander || ' (' || owner || ')', owner FROM decks")
+    return {name: owner for name, owner in rows if decks is None or name in decks}
+
+
+@metrics.io
+def deck_owner(deck):
+    """Owner of a deck that played a game, None if it never did"""
+    row = connect().execute('SELECT player FROM game_decks WHERE deck = ? LIMIT 1', (deck,)).fetchone()
+    return row[0] if row else None
+
+
+def _encode(table, row):
+    if table == 'games':
+        row = dict(row, date=iso_date(row.get('date')))
+    return [row.get('id')] + [json.dumps(row.get(col)) if (table, col) in JSON_COLUMNS else row.get(col)
+                              for col in COLUMNS[table]]
+
+
+def _decode(table, row):
+    obj = dict(row)
+    for col in COLUMNS[table]:
+        if (table, col) in JSON_COLUMNS:
+            obj[col] = json.loads(obj[col])
+    return obj
+
+
+@metrics.io
+def load(table, after_id=0):
+    """Return rows of a table as dicts (with their numeric id) in insertion order, only
+    those with an id above after_id"""
+    rows = connect().execute(f'SELECT * FROM {table} WHERE id > ? ORDER BY id', (after_id,))
+    return [_decode(table, row) for row in rows]
+
+
+@metrics.io
+def count(table):
+    return connect().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def _insert(conn, table, rows):
+    """Insert rows keeping their id if they have one, so ids stay stable across saves"""
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM games').fetchone()[0] if table == 'games' else 0
+    columns = ('id',) + COLUMNS[table]
+    conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                     [_encode(table, row) for row in rows])
+    if table == 'games':
+        _index_games(conn, last_id)
+    elif table == 'decks':
+        # games recorded before their deck was (re)saved
+        owners = _deck_owners(conn, {_deck_name(row) for row in rows})
+        conn.executemany('UPDATE game_decks SET player = ? WHERE deck = ? AND player != ?',
+                         [(owner, name, owner) for name, owner in owners.items()])
+    _bump(conn, table)
+
+
+def _deck_name(row):
+    return f"{row.get('commander')} ({row.get('owner')})"
+
+
+def _index_games(conn, after_id=0):
+    """Add the game_decks rows of the games with an id above after_id"""
+    owners = _deck_owners(conn)
+    rows = []
+    for game_id, date, winner, decks in conn.execute('SELECT id, date, winner, decks FROM games WHERE id > ?',
+                                                     (after_id,)):
+        # a deck that isn't in the decks table (yet) gets its owner once it's saved
+        rows += [(game_id, date, deck, owners.get(deck, ''), deck == winner) for deck in json.loads(decks)]
+    rebuild = not after_id and len(rows) > 10000
+    if rebuild:
+        for name in GAME_DECK_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+    conn.executemany('INSERT INTO game_decks (game_id, date, deck, player, won) VALUES (?, ?, ?, ?, ?)', rows)
+    if rebuild:
+        for name, columns in GAME_DECK_INDEXES.items():
+            conn.execute(f'CREATE INDEX {name} ON game_decks {columns}')
+
+
+def _clear(conn, table):
+    conn.execute(f'DELETE FROM {table}')
+    if table == 'games':
+        conn.execute('DELETE FROM game_decks')
+    _bump(conn, table)
+    # readers that only follow new rows (see rewrites) have to start over
+    _bump(conn, table + '.cleared')
+
+
+def _bump(conn, table):
+    conn.execute('INSERT INTO versions (name, version) VALUES (?, 1) '
+                 'ON CONFLICT (name) DO UPDATE SET version = version + 1', (table,))
+    _local.versions = None
+
+
+def version(table):
+    """Counter that goes up with every write to a table, from any process. The counters are
+    only read again after some connection committed (PRAGMA data_version changed), so
+    checking one is usually no more than that pragma"""
+    conn = connect()
+    data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+    versions = _local.versions
+    if versions is None or versions[0] != data_version:
+        versions = _local.versions = (data_version, dict(conn.execute('SELECT name, version FROM versions')))
+    return versions[1].get(table, 0)
+
+
+def rewrites(table):
+    """Counter that only goes up when the rows of a table are replaced instead of added to"""
+    return version(table + '.cleared')
+
+
+def notify(table):
+    for listener in listeners:
+        listener(table)
+
+
+@metrics.io
+def insert(table, rows):
+    """Append rows to a table in one transaction"""
+    with transaction() as conn:
+        _insert(conn, table, rows)
+    notify(table)
+
+
+@metrics.io
+def save(table, rows):
+    """Replace the whole contents of a table in one transaction"""
+    with transaction() as conn:
+        _clear(conn, table)
+        _insert(conn, table, rows)
+    notify(table)
+
+
+@metrics.io
+def get_meta(key, default=None):
+    row = connect().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+@metrics.io
+def set_meta(key, value):
+    with transaction() as conn:
+        conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+
+@metrics.io
+def deck_stats():
+    """Decklist file name -> (content hash, stats) of every file with cached stats"""
+    return {name: (digest, json.loads(stats))
+            for name, digest, stats in connect().execute('SELECT name, hash, stats FROM deck_stats')}
+
+
+@metrics.io
+def update_deck_stats(changed, removed=(), source=None):
+    """Write the stats of changed decklist files (name -> (hash, stats)) and drop the removed
+    ones in one transaction. A new source (what the stats were computed from, kept in meta
+    under DECK_STATS_KEY) replaces every cached entry"""
+    with transaction() as conn:
+        if source is not None:
+            conn.execute('DELETE FROM deck_stats')
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (DECK_STATS_KEY, json.dumps(source)))
+        conn.executemany('INSERT OR REPLACE INTO deck_stats (name, hash, stats) VALUES (?, ?, ?)',
+                         [(name, digest, json.dumps(stats)) for name, (digest, stats) in changed.items()])
+        conn.executemany('DELETE FROM deck_stats WHERE name = ?', [(name,) for name in removed])
+
+
+def migrate(force=False):
+    """One-shot import of players.json, decks.json and games.json in a single transaction.
+    Only runs once per database (see MIGRATED_KEY), and tables that already have rows are
+    left alone, unless force is set"""
+
+    migrated = {}
+    with transaction() as conn:
+        # checked inside the transaction, another process may have just migrated
+        if not force and conn.execute('SELECT 1 FROM meta WHERE key = ?', (MIGRATED_KEY,)).fetchone():
+            return
+        for file_name, table in TABLES.items():
+            path = os.path.join(os.path.dirname(DB_PATH), file_name)
+            if not os.path.exists(path):
+                continue
+            if conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] and not force:
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                rows = json.load(f)
+            _clear(conn, table)
+            _insert(conn, table, rows)
+            migrated[file_name] = len(rows)
+        conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (MIGRATED_KEY, json.dumps(migrated)))
+
+    for file_name, rows in migrated.items():
+        notify(TABLES[file_name])
+        print(f'Migrated {rows} rows from {file_name}')
+
+
+def upgrade():
+    """Bring a database created by an older version of the bot up to SCHEMA_VERSION"""
+    with transaction() as conn:
+        # checked again inside the transaction, another process may have just upgraded
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        if version < 2:
+            # game dates were 'MM-DD-YYYY' strings, which don't sort
+            dates = conn.execute('SELECT id, date FROM games').fetchall()
+            changed = [(iso_date(date), game_id) for game_id, date in dates if iso_date(date) != date]
+            conn.executemany('UPDATE games SET date = ? WHERE id = ?', changed)
+            _bump(conn, 'games')
+            if changed:
+                print(f'Converted {len(changed)} game dates')
+        if version < 3:
+            # game_decks used to take the player from the deck name, which breaks on
+            # names with parentheses
+            conn.execute('DELETE FROM game_decks')
+            _index_games(conn)
+            games = conn.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+            if games:
+                print(f'Indexed {games} games by deck and player')
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+
+def _game_filters(deck, player, start, end):
+    """FROM and WHERE clauses (with their parameters) selecting the games that match"""
+    where, params = [], []
+    for column, value in (('deck', deck), ('player', player)):
+        if value is not None:
+            where.append(f'{column} = ?')
+            params.append(value)
+    table, id_column = ('game_decks', 'game_id') if where else ('games', 'id')
+    if start is not None:
+        where.append('date >= ?')
+        params.append(start)
+    if end is not None:
+        where.append('date < ?')
+        params.append(end)
+    return table, id_column, where, params
+
+
+@metrics.io
+def game_history(deck=None, player=None, start=None, end=None, before=None, limit=20):
+    """Games newest first, only those of a deck and/or player and from start up to (not
+    including) end if given. Pages continue from before, the (date, id) of the last game of
+    the previous page, so a page only reads its own slice of an index"""
+    table, id_column, where, params = _game_filters(deck, player, start, end)
+    if before is not None:
+        where.append(f'(date, {id_column}) < (?, ?)')
+        params += list(before)
+    ids = [row[0] for row in connect().execute(
+        f"SELECT DISTINCT {id_column}, date FROM {table} {'WHERE ' + ' AND '.join(where) if where else ''} "
+        f"ORDER BY date DESC, {id_column} DESC LIMIT ?", params + [limit])]
+    rows = {row['id']: _decode('games', row) for row in connect().execute(
+        f"SELECT * FROM games WHERE id IN ({', '.join('?' * len(ids))})", ids)}
+    return [rows[x] for x in ids]
+
+
+@metrics.io
+def count_games(deck=None, player=None, start=None, end=None):
+    """Number of games game_history can page through with the same filters"""
+    table, id_column, where, params = _game_filters(deck, player, start, end)
+    return connect().execute(f"SELECT COUNT(DISTINCT {id_column}) FROM {table} "
+                             f"{'WHERE ' + ' AND '.join(where) if where else ''}", params).fetchone()[0]
+
+
+if __name__ == '__main__':
+    import sys
+    connect()
+    # --force imports the json files again, replacing what's in the database
+    migrate(force='--force' in sys.argv)
+    for table in COLUMNS:
+        print(table, count(table))
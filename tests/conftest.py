@@ -0,0 +1,81 @@
+import json
+import os
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+
+
+@pytest.fixture
+def game_database(tmp_path, monkeypatch):
+    """Write players.json, decks.json and games.json to tmp_path and point the database
+    next to them, so it's migrated from them on first use. Returns tmp_path"""
+
+    rng = random.Random(0)
+    players = [{'name': f'player{i}', 'rating': 1500, 'gold': 300, 'wins': 0, 'losses': 0} for i in range(6)]
+    decks = [{'owner': f'player{i % 6}', 'commander': f'Commander {i}', 'decklist': None,
+              'rating': 1500, 'wins': 0, 'losses': 0} for i in range(18)]
+    names = [f"{x['commander']} ({x['owner']})" for x in decks]
+    games = []
+    for day in range(60):
+        pod = rng.sample(names, 4)
+        games.append({'date': f'2024-{day // 28 + 1:02d}-{day % 28 + 1:02d}', 'winner': rng.choice(pod), 'decks': pod})
+    for file_name, rows in (('players.json', players), ('decks.json', decks), ('games.json', games)):
+        with open(tmp_path / file_name, 'w') as f:
+            json.dump(rows, f)
+
+    monkeypatch.setattr(storage, 'DB_PATH', str(tmp_path / 'hall_of_records.db'))
+    return tmp_path
+
+
+class StubServer:
+    """Local HTTP server answering each path with a scripted list of responses, one per
+    request (the last one repeats). A response is (status, headers, body)"""
+
+    def __init__(self):
+        self.routes = {}
+        self.hits = {}
+        self.requests = []      # (path, headers) of every request
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append((self.path, dict(self.headers)))
+                responses = stub.routes.get(self.path, [(404, {}, b'not found')])
+                hit = stub.hits[self.path] = stub.hits.get(self.path, 0) + 1
+                status, headers, body = responses[min(hit, len(responses)) - 1]
+                if callable(body):
+                    body(self)
+                    return
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def http_stub():
+    stub = StubServer()
+    yield stub
+    stub.close()
@@ -0,0 +1,80 @@
+import json
+import os
+import pytest
+import carddb
+import deckstats
+
+CARDS = json.dumps([{'name': f'Card {i}', 'type_line': 'Artifact', 'cmc': i % 7} for i in range(200)]).encode()
+
+
+@pytest.fixture
+def scryfall(http_stub, tmp_path, monkeypatch):
+    """Stub of the scryfall bulk data API serving CARDS as the oracle cards file"""
+    monkeypatch.setattr(carddb, 'DATA_DIR', str(tmp_path))
+    entry = {'type': 'oracle_cards', 'download_uri': http_stub.url + '/oracle.json',
+             'updated_at': '2024-01-01T10:00:00', 'size': len(CARDS)}
+    http_stub.routes['/bulk-data'] = [(200, {}, json.dumps({'data': [entry]}).encode())]
+    http_stub.routes['/oracle.json'] = [(200, {}, CARDS)]
+    return http_stub
+
+
+def send_range(handler):
+    """Answer a Range request with the rest of CARDS"""
+    start = int(handler.headers['Range'].split('=')[1].rstrip('-'))
+    handler.send_response(206)
+    handler.send_header('Content-Length', str(len(CARDS) - start))
+    handler.end_headers()
+    handler.wfile.write(CARDS[start:])
+
+
+def send_cut(handler):
+    """Promise the whole file but hang up half way through"""
+    handler.send_response(200)
+    handler.send_header('Content-Length', str(len(CARDS)))
+    handler.end_headers()
+    handler.wfile.write(CARDS[:len(CARDS) // 2])
+    handler.wfile.flush()
+    handler.close_connection = True
+
+
+def test_download_then_skip_unchanged(scryfall, tmp_path):
+    assert deckstats.scryfall_bulk_data(api=scryfall.url)
+    assert (tmp_path / 'scryfall_data.json').read_bytes() == CARDS
+    assert carddb.open_database().get('Card 7')['cmc'] == 0
+
+    assert not deckstats.scryfall_bulk_data(api=scryfall.url)
+    assert scryfall.hits['/oracle.json'] == 1
+
+
+def test_partial_file_is_resumed(scryfall, tmp_path):
+    deckstats.write_file({'partial_updated_at': '2024-01-01T10:00:00'}, str(tmp_path / deckstats.BULK_META))
+    (tmp_path / 'scryfall_data.json.part').write_bytes(CARDS[:1000])
+    scryfall.routes['/oracle.json'] = [(206, {}, send_range)]
+
+    assert deckstats.scryfall_bulk_data(api=scryfall.url)
+    assert scryfall.requests[-1][1]['Range'] == 'bytes=1000-'
+    assert (tmp_path / 'scryfall_data.json').read_bytes() == CARDS
+
+
+def test_connection_cut_mid_stream(scryfall, tmp_path):
+    scryfall.routes['/oracle.json'] = [(200, {}, send_cut), (200, {}, CARDS)]
+    assert deckstats.scryfall_bulk_data(api=scryfall.url) is False
+    assert not os.path.exists(tmp_path / 'scryfall_data.json.part')
+    assert not os.path.exists(tmp_path / 'scryfall_data.json')
+
+    assert deckstats.scryfall_bulk_data(api=scryfall.url)
+    assert (tmp_path / 'scryfall_data.json').read_bytes() == CARDS
+
+
+def test_unreachable_api(tmp_path, monkeypatch):
+    monkeypatch.setattr(carddb, 'DATA_DIR', str(tmp_path))
+    assert deckstats.scryfall_bulk_data(api='http://127.0.0.1:9') is False
+
+
+def test_card_from_raw_dump(tmp_path):
+    raw = [{'object': 'card', 'id': 'abc', 'name': 'Sol Ring', 'cmc': 1.0, 'type_line': 'Artifact',
+            'colors': [], 'legalities': {'commander': 'banned'}, 'image_uris': {}}]
+    with open(tmp_path / 'scryfall_data.json', 'w') as f:
+        json.dump(raw, f)
+    card, = deckstats.load_json_data(str(tmp_path / 'scryfall_data.json'), deckstats.Card)
+    assert card.as_dict() == {'name': 'Sol Ring', 'cmc': 1.0, 'type_line': 'Artifact', 'colors': ()}
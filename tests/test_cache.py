@@ -0,0 +1,27 @@
+from concurrent.futures import ProcessPoolExecutor
+import deckstats
+import storage
+from cache import DataCache
+
+
+def add_deck(db_path):
+    storage.DB_PATH = db_path
+    storage.insert('decks', [{'owner': 'player0', 'commander': 'Added Elsewhere'}])
+
+
+def test_entries_survive_other_writes(game_database):
+    cache = DataCache()
+    decks = cache.get('decks.json', deckstats.Deck)
+    storage.set_meta('checkpoint', 123)
+    storage.insert('games', [{'date': '2024-05-01', 'winner': str(decks[0]), 'decks': [str(x) for x in decks[:4]]}])
+    assert cache.get('decks.json', deckstats.Deck) == decks
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_write_from_another_process_is_seen(game_database):
+    cache = DataCache()
+    assert len(cache.get('decks.json', deckstats.Deck)) == 18
+    with ProcessPoolExecutor(1) as executor:
+        executor.submit(add_deck, storage.DB_PATH).result()
+    assert len(cache.get('decks.json', deckstats.Deck)) == 19
+    assert cache.misses == 2
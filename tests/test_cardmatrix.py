@@ -0,0 +1,43 @@
+import json
+import pytest
+import carddb
+import cardmatrix
+import deckstats
+
+CARDS = [{'name': 'Sol Ring', 'mana_cost': '{1}', 'cmc': 1.0, 'type_line': 'Artifact', 'edhrec_rank': 1},
+         {'name': 'Counterspell', 'mana_cost': '{U}{U}', 'cmc': 2.0, 'type_line': 'Instant', 'edhrec_rank': 40},
+         {'name': 'Lightning Helix', 'mana_cost': '{R}{W}', 'cmc': 2.0, 'type_line': 'Instant', 'edhrec_rank': 310},
+         {'name': 'Craterhoof Behemoth', 'mana_cost': '{5}{G}{G}{G}', 'cmc': 8.0,
+          'type_line': 'Creature — Beast', 'edhrec_rank': 905},
+         {'name': 'Unranked Oddity', 'mana_cost': '{B}{B}{B}', 'cmc': 3.0, 'type_line': 'Sorcery'},
+         {'name': 'Island', 'mana_cost': '', 'cmc': 0.0, 'type_line': 'Basic Land — Island', 'edhrec_rank': 5},
+         {'name': 'Command Tower', 'mana_cost': '', 'cmc': 0.0, 'type_line': 'Land', 'edhrec_rank': 2}]
+
+DECKS = {'one card': {'Sol Ring': 1},
+         'basics ignored': {'Counterspell': 3, 'Island': 30},
+         'every color': {'Lightning Helix': 2, 'Craterhoof Behemoth': 1, 'Counterspell': 1, 'Command Tower': 1},
+         'unranked': {'Unranked Oddity': 4, 'Sol Ring': 1, 'Island': 2}}
+
+
+@pytest.mark.parametrize('name', DECKS)
+def test_batch_matches_deck_stats(name):
+    cards = {x['name']: deckstats.Card(**x) for x in CARDS}
+    deck = [cards[card] for card, qty in DECKS[name].items() for _ in range(qty)]
+    stats, = cardmatrix.batch_deck_stats([{'name': name, 'cards': deck}], cardmatrix.CardMatrix.from_cards(CARDS))
+    assert (stats['average_cmc'], stats['edh_score'], stats['pips']) == deckstats.deck_stats(deck)
+
+
+def test_first_card_of_a_name_wins():
+    matrix = cardmatrix.CardMatrix.from_cards([CARDS[0], dict(CARDS[1], name='Sol Ring')])
+    assert matrix.rows['Sol Ring'] == 0
+
+
+def test_matrix_per_source(tmp_path, monkeypatch):
+    monkeypatch.setattr(carddb, 'DATA_DIR', str(tmp_path))
+    (tmp_path / 'first.json').write_text(json.dumps(CARDS[:2]))
+    (tmp_path / 'second.json').write_text(json.dumps(CARDS[2:4]))
+
+    assert cardmatrix.load_matrix('first.json').names == ['Sol Ring', 'Counterspell']
+    assert cardmatrix.load_matrix('second.json').names == ['Lightning Helix', 'Craterhoof Behemoth']
+    assert cardmatrix.load_matrix('first.json').names == ['Sol Ring', 'Counterspell']
+    assert (tmp_path / 'first.cards.npz').exists() and (tmp_path / 'second.cards.npz').exists()
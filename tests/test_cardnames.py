@@ -0,0 +1,53 @@
+import pytest
+import cardnames
+
+NAMES = ['Sol Ring', 'Lightning Bolt', 'Lightning Helix', 'Delver of Secrets // Insectile Aberration',
+         'Fire // Ice', 'Lim-Dûl the Necromancer', "Urza's Saga", 'Wear // Tear', 'Tear Asunder']
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('1 Sol Ring', (1, 'Sol Ring')),
+    ('4x Lightning Bolt', (4, 'Lightning Bolt')),
+    ('1 Sol Ring (C21) 263', (1, 'Sol Ring')),
+    ('1 Sol Ring (C21) 263 *F*', (1, 'Sol Ring')),
+    ('2 Fire // Ice (MH2) 290', (2, 'Fire // Ice')),
+    ('Sol Ring', (1, 'Sol Ring')),
+    ('1 Borrowing 100,000 Arrows', (1, 'Borrowing 100,000 Arrows')),
+    ('   ', None),
+])
+def test_parse_line(line, expected):
+    assert cardnames.parse_line(line) == expected
+
+
+@pytest.fixture
+def resolver():
+    return cardnames.NameResolver(NAMES)
+
+
+@pytest.mark.parametrize('written, name', [
+    ('Delver of Secrets', 'Delver of Secrets // Insectile Aberration'),
+    ('Fire/Ice', 'Fire // Ice'),
+    ('Fire / Ice', 'Fire // Ice'),
+    ('fire // ice', 'Fire // Ice'),
+    ('Lim-Dul the Necromancer', 'Lim-Dûl the Necromancer'),
+    ('Urza’s Saga', "Urza's Saga"),
+    ('SOL RING', 'Sol Ring'),
+])
+def test_aliases_and_normalized_names(resolver, written, name):
+    assert resolver.get(written) == name
+
+
+def test_face_alias_never_shadows_a_real_name():
+    resolver = cardnames.NameResolver(['Tear // Wear', 'Tear'])
+    assert resolver.get('Tear') == 'Tear'
+
+
+def test_typos_are_corrected_or_suggested(resolver):
+    found, missing = resolver.resolve(['Lightning Helx', 'Tear Asundr', 'Lightning Bolt', 'Lightnig',
+                                       'Not A Real Card'])
+    assert found == {'Lightning Helx': 'Lightning Helix', 'Tear Asundr': 'Tear Asunder',
+                     'Lightning Bolt': 'Lightning Bolt'}
+    # close to two cards but not close enough to pick one, both are suggested
+    assert missing['Lightnig'] == ['Lightning Bolt', 'Lightning Helix']
+    assert missing['Not A Real Card'] == []
+    assert 'did you mean' in cardnames.missing_text(missing)
@@ -0,0 +1,36 @@
+import json
+import deckstats
+import carddb
+import storage
+
+CARDS = [{'name': 'Sol Ring', 'mana_cost': '{1}', 'cmc': 1.0, 'type_line': 'Artifact', 'edhrec_rank': 1},
+         {'name': 'Counterspell', 'mana_cost': '{U}{U}', 'cmc': 2.0, 'type_line': 'Instant', 'edhrec_rank': 10},
+         {'name': 'Island', 'mana_cost': '', 'cmc': 0.0, 'type_line': 'Basic Land — Island', 'edhrec_rank': 5}]
+
+
+def test_only_changed_decklists_are_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(carddb, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(storage, 'DB_PATH', str(tmp_path / 'hall_of_records.db'))
+    (tmp_path / 'stats_cards.json').write_text(json.dumps(CARDS))
+    decklists = tmp_path / 'decklists'
+    decklists.mkdir()
+    for i in range(3):
+        (decklists / f'deck{i}.txt').write_text(f'1 Sol Ring\n{i + 1} Counterspell\n10 Island\n')
+
+    def build():
+        return deckstats.build_deck_stats(str(decklists), str(tmp_path / 'stats.json'), 'stats_cards.json')
+
+    first = build()
+    assert [x['name'] for x in first] == ['deck0.txt', 'deck1.txt', 'deck2.txt']
+    cached = storage.deck_stats()
+
+    written = []
+    monkeypatch.setattr(storage, 'update_deck_stats', lambda *args: written.append(args))
+    (decklists / 'deck1.txt').write_text('1 Sol Ring\n')
+    (decklists / 'deck2.txt').unlink()
+    second = build()
+    (changed, removed, source), = written
+    assert list(changed) == ['deck1.txt'] and removed == ['deck2.txt'] and source is None
+    assert second == [first[0], changed['deck1.txt'][1]]
+    assert cached['deck0.txt'][1] == first[0]
+    assert json.loads((tmp_path / 'stats.json').read_text()) == second
@@ -0,0 +1,82 @@
+import asyncio
+import aiohttp
+import pytest
+import httpcache
+import ingest
+
+PAGE = b'<html><input name="deck_input[commander]" value="Atraxa, Praetors\' Voice"></html>'
+
+
+@pytest.fixture
+def sleeps(monkeypatch, tmp_path):
+    """Backoff delays fetch_page asked for, without waiting them out"""
+    cache_dir = httpcache.CACHE_DIR
+    httpcache.configure(directory=str(tmp_path / 'http_cache'))
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, *args):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(ingest.asyncio, 'sleep', sleep)
+    yield delays
+    httpcache.configure(directory=cache_dir)
+
+
+def fetch(http_stub, *paths, **kwargs):
+    found, failed, transient = asyncio.run(ingest.fetch_commanders(
+        [http_stub.url + path for path in paths], sites={http_stub.url: 'mtggoldfish'}, **kwargs))
+    assert transient <= set(failed)
+    return found, failed
+
+
+def test_server_errors_are_retried(http_stub, sleeps):
+    http_stub.routes['/flaky'] = [(503, {}, b''), (502, {}, b''), (200, {}, PAGE)]
+    found, failed = fetch(http_stub, '/flaky')
+    assert found == {http_stub.url + '/flaky': "Atraxa, Praetors' Voice"} and not failed
+    assert http_stub.hits['/flaky'] == 3
+    assert len(sleeps) == 2 and sleeps[0] < sleeps[1]
+
+
+def test_retry_after_is_honoured_up_to_a_cap(http_stub, sleeps):
+    http_stub.routes['/polite'] = [(429, {'Retry-After': '2'}, b''), (200, {}, PAGE)]
+    http_stub.routes['/greedy'] = [(429, {'Retry-After': '86400'}, b''), (200, {}, PAGE)]
+    found, failed = fetch(http_stub, '/polite', '/greedy', backoff=0.1)
+    assert len(found) == 2 and not failed
+    assert sorted(round(x) for x in sleeps) == [2, ingest.MAX_RETRY_AFTER]
+
+
+def test_gives_up_after_the_last_retry(http_stub, sleeps):
+    http_stub.routes['/down'] = [(503, {}, b'')]
+    found, failed = fetch(http_stub, '/down', retries=2)
+    assert failed == {http_stub.url + '/down': 'HTTP 503'}
+    assert http_stub.hits['/down'] == 3
+
+
+def test_client_errors_are_not_retried(http_stub, sleeps):
+    found, failed = fetch(http_stub, '/missing')
+    assert failed == {http_stub.url + '/missing': 'HTTP 404'}
+    assert http_stub.hits['/missing'] == 1 and not sleeps
+
+
+def test_pages_are_served_from_the_cache_the_second_time(http_stub, sleeps):
+    http_stub.routes['/deck'] = [(200, {'Cache-Control': 'max-age=600'}, PAGE)]
+
+    async def fetch_twice():
+        async with aiohttp.ClientSession() as session:
+            return [await ingest.fetch_page(session, http_stub.url + '/deck') for _ in range(2)]
+
+    assert asyncio.run(fetch_twice()) == [PAGE, PAGE]
+    assert http_stub.hits['/deck'] == 1
+
+
+def test_only_transient_failures_are_kept_for_later(http_stub, sleeps):
+    http_stub.routes['/down'] = [(503, {}, b'')]
+    http_stub.routes['/empty'] = [(200, {}, b'<html></html>')]
+    posts = [(http_stub.url + path, 'owner') for path in ('/down', '/missing', '/empty')]
+    posts.append(('https://example.com/deck', 'owner'))
+    decks, failed, retry = asyncio.run(ingest.new_decks(posts, set(), sites={http_stub.url: 'mtggoldfish'},
+                                                        retries=1))
+    assert not decks and len(failed) == 4
+    assert retry == [(http_stub.url + '/down', 'owner')]
@@ -0,0 +1,40 @@
+import itertools
+import random
+import deckstats
+from matchmaker import Matchmaker
+
+
+def make_decks(players, per_player, rating=None, seed=0):
+    rng = random.Random(seed)
+    return [deckstats.Deck(owner=f'player{p}', commander=f'Commander {p}-{i}',
+                           rating=rating if rating is not None else rng.randint(1300, 1700))
+            for p in range(players) for i in range(per_player)]
+
+
+def test_best_pods_match_brute_force():
+    decks = make_decks(4, 8)
+    rng = random.Random(1)
+    games = [deckstats.Game('2024-01-01', None, [deckstats.deck_key(x) for x in rng.sample(decks, 4)])
+             for _ in range(30)]
+    maker = Matchmaker(decks, games=games)
+    owners = [f'player{p}' for p in range(4)]
+
+    costs = []
+    for pod in itertools.product(*(maker.owners[owner] for owner in owners)):
+        ratings = [x[0] for x in pod]
+        costs.append(max(ratings) - min(ratings) + sum(x[1] for x in pod))
+    best = maker.best_pods(owners, n=5)
+    assert [round(x['cost'], 6) for x in best] == [round(x, 6) for x in sorted(costs)[:5]]
+
+
+def test_ties_are_broken_at_random():
+    decks = make_decks(4, 10, rating=1500)
+    owners = [f'player{p}' for p in range(4)]
+
+    def best(owners, seed):
+        pod = Matchmaker(decks, rng=random.Random(seed)).best_pods(owners, 1)[0]
+        return tuple(deckstats.deck_key(x) for x in pod['decks'])
+
+    # every pod of decks rated 1500 costs the same, so does every single deck
+    assert len({best(owners, seed) for seed in range(10)}) > 1
+    assert len({best(['player0'], seed) for seed in range(10)}) > 1
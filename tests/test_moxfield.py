@@ -0,0 +1,58 @@
+from unittest import mock
+import pytest
+
+pytest.importorskip('selenium')
+import moxfield
+
+EXPORT = b'1 Sol Ring\n1 Arcane Signet\n1 Command Tower\n'
+
+
+@pytest.fixture
+def deck_site(http_stub):
+    """Six deck pages with moxfield's export flow, served from the local stub"""
+    for i in range(6):
+        http_stub.routes[f'/decks/deck{i}/'] = [(200, {'Content-Type': 'text/html'}, moxfield.TEST_PAGE.encode())]
+    http_stub.routes['/export.txt'] = [(200, {'Content-Type': 'application/octet-stream'}, EXPORT)]
+    return http_stub
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = moxfield.BrowserPool(size=3, download_dir=str(tmp_path), timeout=5)
+    try:
+        pool.idle.put(pool.acquire())
+    except Exception as e:
+        # selenium alone isn't enough, it also needs Chrome and its driver
+        pool.close()
+        pytest.skip(f'Chrome is not available: {e}')
+    yield pool
+    pool.close()
+
+
+def test_fetch_all_reads_and_downloads_decklists(deck_site, pool, tmp_path):
+    links = [f'{deck_site.url}/decks/deck{i}/' for i in range(6)] + [f'{deck_site.url}/missing/']
+    found, failed = pool.fetch_all(links, download=True)
+
+    assert list(failed) == [links[-1]]
+    assert found[links[0]] == ['1 Sol Ring', '1 Arcane Signet', '1 Command Tower']
+    assert len(found) == 6
+    assert len(pool.sessions) <= 3
+    for i in range(6):
+        with open(tmp_path / f'deck{i}.txt', 'rb') as f:
+            assert f.read() == EXPORT
+
+
+def test_missing_decklists(tmp_path):
+    (tmp_path / 'abc.txt').write_text('1 Sol Ring\n')
+    links = ['https://www.moxfield.com/decks/abc', 'https://www.moxfield.com/decks/def/',
+             'https://www.mtggoldfish.com/deck/1', 'https://www.moxfield.com/decks/def/']
+    assert moxfield.missing_decklists(links, str(tmp_path)) == ['https://www.moxfield.com/decks/def/']
+
+
+def test_session_folders_are_not_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(moxfield, 'new_driver', lambda folder, headless: mock.Mock())
+    pool = moxfield.BrowserPool(size=2, download_dir=str(tmp_path))
+    first, second = pool.acquire(), pool.acquire()
+    pool.discard(first)
+    third = pool.acquire()
+    assert pool.folders[third] != pool.folders[second]
@@ -0,0 +1,80 @@
+import deckstats
+import leaderboard
+import ratings
+import storage
+
+
+def replay():
+    """Standings and leaderboard of a full replay of the game database"""
+    players, decks, games = deckstats.load_game_database()
+    board = leaderboard.Leaderboard()
+    for game in games:
+        deckstats.apply_game(game)
+        board.apply(game)
+    return ratings.snapshot(players, decks), board.state()
+
+
+def test_incremental_matches_replay(game_database):
+    assert ratings.verify()
+
+
+def test_update_in_batches_matches_replay(game_database):
+    games = storage.load('games')
+    storage.save('games', games[:20])
+    engine = ratings.RatingEngine(state_file=str(game_database / 'ratings.json'))
+    engine.update()
+    engine.save()
+
+    # a new engine picks up from the saved offset
+    storage.insert('games', [{k: v for k, v in game.items() if k != 'id'} for game in games[20:]])
+    engine = ratings.RatingEngine(state_file=str(game_database / 'ratings.json'))
+    assert engine.offset == 20 and engine.last_id == games[19]['id']
+    assert engine.update() == len(games) - 20
+    assert (ratings.snapshot(*engine.standings()), engine.leaderboard.state()) == replay()
+
+
+def test_unknown_deck_is_skipped_by_both_paths(game_database):
+    # a game naming a deck that doesn't exist, as a winner and as a pod member
+    pod = ['Commander 0 (player0)', 'Commander 1 (player1)', 'Commander 2 (player2)']
+    storage.insert('games', [{'date': '2024-03-01', 'winner': 'Nobody (nobody)', 'decks': pod + ['Nobody (nobody)']},
+                             {'date': '2024-03-02', 'winner': pod[0], 'decks': pod + ['Ghost (player3)']}])
+    assert ratings.verify()
+
+    engine = ratings.RatingEngine(state_file=str(game_database / 'ratings.json'))
+    engine.update()
+    assert engine.offset == storage.count('games')
+    assert ratings.snapshot(*engine.standings()) == replay()[0]
+
+
+def test_zero_parameters_are_kept(game_database):
+    engine = ratings.RatingEngine(k_factor=0, gold_ante=0, state_file=str(game_database / 'ratings.json'))
+    assert engine.params['k_factor'] == 0 and engine.params['gold_ante'] == 0
+    engine.update()
+    players, _ = engine.standings()
+    assert all(x.rating == 1500 for x in players)
+
+
+def test_query_results_are_not_changed_by_later_games(game_database, monkeypatch):
+    monkeypatch.setattr(ratings, '_engine', ratings.RatingEngine(state_file=str(game_database / 'ratings.json')))
+    rows = ratings.query(lambda engine: engine.board('decks', 'games'))
+    before = [dict(row) for row in rows]
+    pod = [row['name'] for row in rows[:4]]
+    storage.insert('games', [{'date': '2024-03-01', 'winner': pod[0], 'decks': pod}])
+
+    after = ratings.query(lambda engine: engine.board('decks', 'games'))
+    assert rows == before
+    assert sum(x['games'] for x in after) == sum(x['games'] for x in before) + 4
+
+
+def test_rewritten_history_is_replayed(game_database):
+    engine = ratings.RatingEngine(state_file=str(game_database / 'ratings.json'))
+    engine.update()
+    engine.save()
+
+    # same number of games, but a different winner in one of them
+    games = storage.load('games')
+    games[5]['winner'] = next(x for x in games[5]['decks'] if x != games[5]['winner'])
+    storage.save('games', games)
+    engine = ratings.RatingEngine(state_file=str(game_database / 'ratings.json'))
+    assert engine.update() == len(games)
+    assert (ratings.snapshot(*engine.standings()), engine.leaderboard.state()) == replay()
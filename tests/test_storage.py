@@ -0,0 +1,73 @@
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+import storage
+
+PARENT = {}     # connection of the test process, compared with in forked workers
+
+
+def count_games(db_path):
+    storage.DB_PATH = db_path
+    return storage.count('games')
+
+
+def test_migration_is_retried_after_a_failure(game_database):
+    games = (game_database / 'games.json').read_text()
+    (game_database / 'games.json').write_text(games[:-10])
+    with pytest.raises(ValueError):
+        storage.connect()
+    assert (game_database / 'hall_of_records.db').exists()
+
+    (game_database / 'games.json').write_text(games)
+    assert storage.count('games') == len(json.loads(games))
+    assert storage.get_meta(storage.MIGRATED_KEY) == {'players.json': 6, 'decks.json': 18, 'games.json': 60}
+
+
+def test_processes_starting_together_all_see_the_migrated_games(game_database):
+    with ProcessPoolExecutor(4) as executor:
+        counts = list(executor.map(count_games, [storage.DB_PATH] * 8))
+    assert counts == [60] * 8
+    assert storage.count('games') == 60
+
+
+def test_emptied_tables_are_not_migrated_again(game_database):
+    storage.save('games', [])
+    storage._local.conn = None    # a fresh connection, as after a restart
+    assert storage.count('games') == 0
+
+
+def test_players_come_from_the_decks_table(game_database):
+    deck = {'owner': 'Bob (2nd)', 'commander': 'Kenrith (Returned King)', 'decklist': None,
+            'rating': 1500, 'wins': 0, 'losses': 0}
+    name = 'Kenrith (Returned King) (Bob (2nd))'
+    storage.insert('games', [{'date': '2024-04-01', 'winner': name, 'decks': [name, 'Commander 0 (player0)']}])
+    assert storage.game_history(player='Bob (2nd)') == []
+
+    # the deck is saved after its first game
+    storage.insert('decks', [deck])
+    assert [x['winner'] for x in storage.game_history(player='Bob (2nd)')] == [name]
+    assert storage.deck_owner(name) == 'Bob (2nd)'
+    games = json.loads((game_database / 'games.json').read_text())
+    assert storage.count_games(player='player0') == sum(any(x.endswith('(player0)') for x in game['decks'])
+                                                        for game in games) + 1
+
+
+def test_upgrade_refills_players(game_database):
+    conn = storage.connect()
+    conn.execute("UPDATE game_decks SET player = 'wrong'")
+    conn.execute('PRAGMA user_version = 2')
+    storage._local.conn = None
+    assert storage.count_games(player='wrong') == 0
+    assert storage.deck_owner('Commander 1 (player1)') == 'player1'
+
+
+def forked_connection_is_new():
+    return storage.connect() is not PARENT['conn'] and storage.count('games')
+
+
+def test_forked_workers_open_their_own_connection(game_database):
+    PARENT['conn'] = storage.connect()
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork')) as executor:
+        assert executor.submit(forked_connection_is_new).result() == 60
+    assert storage.connect() is PARENT['conn']